@@ -1,4 +1,6 @@
 import sys, os
+import argparse
+import time
 from os import system
 from os.path import abspath
 
@@ -14,11 +16,42 @@ from modules.logger import SetupLogger
 from modules.configreader import GetConfig
 from modules.passwordreader import ReadPasswordHash
 from modules.connection import Connection
-from modules.common import MergeDicts, GetUpperLevelDir
+from modules.cassette import Cassette
+from modules.metrics import MetricsRegistry
+from modules.promexporter import FormatPrometheusText
+from modules.profiler import JournalProfiler
+from modules.tracer import Tracer
+from modules.common import GetUpperLevelDir, IsDeadlineNear, MergeDicts
 from modules.postprocessor import PostProcessor
 from modules.commentprocessor import CommentProcessor
+from modules.parallelrunner import RunJournals
+from modules.scheduler import JournalScheduler
 
-def main():
+def ParseArguments(arguments):
+    parser = argparse.ArgumentParser(description = 'Archives posts, comments and images of LiveJournal-like blogs.')
+    parser.add_argument('--daemon', action = 'store_true', help = 'keep running and sync every user each syncIntervalMinutes from config')
+    parser.add_argument('--max-runtime', type = int, metavar = 'MINUTES', dest = 'maxRuntimeMinutes',
+                        help = 'stop taking new posts, comment pages and journals when this many minutes have passed; the rest is done on next run')
+    cassetteGroup = parser.add_mutually_exclusive_group()
+    cassetteGroup.add_argument('--record', metavar = 'CASSETTE', dest = 'recordCassettePath',
+                               help = 'save every server response to CASSETTE file, passwords and session cookies are stripped from saved requests')
+    cassetteGroup.add_argument('--replay', metavar = 'CASSETTE', dest = 'replayCassettePath',
+                               help = 'take server responses from CASSETTE file saved with --record instead of the server, without delays between requests')
+    parser.add_argument('--replay-latency', action = 'store_true', dest = 'replayLatency',
+                        help = 'with --replay, wait as long for every response as the server took when it was recorded')
+    parser.add_argument('--metrics-report', metavar = 'FILE', dest = 'metricsReportPath',
+                        help = 'write JSON report with request, sleep, parse and file write timings and counters of every journal to FILE after each journal run')
+    parser.add_argument('--prom-file', metavar = 'FILE', dest = 'promFilePath',
+                        help = 'write run metrics of every journal to FILE in Prometheus text format (for node_exporter textfile collector) after each journal run')
+    parser.add_argument('--profile', choices = ['cpu', 'memory', 'all'],
+                        help = 'profile journal runs with cProfile (cpu) and/or tracemalloc (memory, needs pytracemalloc), results go to logs folder')
+    parser.add_argument('--profile-sample-rate', type = float, default = 1.0, metavar = 'SHARE', dest = 'profileSampleRate',
+                        help = 'with --profile, profile only this share of journal runs, from 0 to 1 (default 1), so that profiling can stay on at low cost')
+    parser.add_argument('--trace', metavar = 'FOLDER', dest = 'traceFolderPath',
+                        help = 'write timeline of every journal run (requests, sleeps, parsing, merges, file writes) to FOLDER as Chrome trace event JSON')
+    return parser.parse_args(arguments)
+
+def main(arguments = []):
     # Some constants
     scriptName = 'Archiver'
     httpRequestTimeoutSeconds = 30
@@ -30,13 +63,29 @@ def main():
     dateFormatString = '%Y-%m-%d %H:%M:%S' # dates should be in yyyy-mm-dd hh:mm:ss
     cachedDataFolderName = 'cached data'
     cachedPostIdsFileName = 'cachedpostids.xml'
+    sharedImagesFolderName = 'shared images' # images of journals with shareImages set are stored here once per content
     
     #switching working directory to the directory where the script is located
     if os.getcwdu() != workingScriptDirPath:
         os.chdir(workingScriptDirPath)
     logger = SetupLogger(os.path.join(GetUpperLevelDir(), logFolderName, logFileName), dateFormatString)
+    cassette = None
     try:
-        cnn = Connection(httpRequestTimeoutSeconds, scriptName)
+        options = ParseArguments(arguments)
+        deadline = None if options.maxRuntimeMinutes is None else time.time() + options.maxRuntimeMinutes * 60
+        if options.recordCassettePath is not None:
+            cassette = Cassette(options.recordCassettePath, 'record')
+        elif options.replayCassettePath is not None:
+            cassette = Cassette(options.replayCassettePath, 'replay', options.replayLatency)
+            httpRequestDelaySeconds = 0 # nobody to be banned by
+        if cassette is not None:
+            cassette.Open()
+        cnn = Connection(httpRequestTimeoutSeconds, scriptName, cassette)
+        metricsRegistry = MetricsRegistry()
+        profiler = None
+        if options.profile is not None:
+            profiler = JournalProfiler(os.path.join(GetUpperLevelDir(), logFolderName), ['cpu', 'memory'] if options.profile == 'all' else [options.profile],
+                                       options.profileSampleRate)
         
         configSections = GetConfig(os.path.join(GetUpperLevelDir(), configFileName))
         for setting in configSections:
@@ -46,28 +95,88 @@ def main():
                        'delay': httpRequestDelaySeconds,
                        'cachedDataFolder': cachedDataFolderName,
                        'cachedPostIdsFile':cachedPostIdsFileName,
+                       'sharedImagesFolder': sharedImagesFolderName,
                        'xsltFile': xsltFileName,
-                       'dateFormatString': dateFormatString}
-        for configSection in configSections:
-            try:
-                environment = MergeDicts(configSection, globalSettings)
+                       'dateFormatString': dateFormatString,
+                       'deadline': deadline}
+
+        def ProcessJournal(environment, processors = None):
+            # in daemon mode processors are kept between runs, otherwise they are created anew
+            keepWarm = processors is not None
+            processors = processors if keepWarm else {}
+            if IsDeadlineNear(deadline):
+                logger.info(u'%s: %s: run time is over, journal is left for next run' % (environment['sectionName'], environment['journal']))
+                return
+            # every journal counts its own requests, sleeps and file writes, even when journals are processed in parallel
+            metrics = metricsRegistry.GetJournalMetrics(environment['sectionName'], environment['journal'])
+            tracer = Tracer() if options.traceFolderPath is not None else None
+            metrics.Reset(tracer)
+            environment = MergeDicts(environment, {'metrics': metrics, 'cnn': environment['cnn'].WithMetrics(metrics)})
+            succeeded = False
+
+            def RunProcessors():
                 #retrieving posts
-                postPrc = PostProcessor(scriptName, environment)
-                postPrc.ProcessPosts()
+                if 'posts' not in processors:
+                    processors['posts'] = PostProcessor(scriptName, environment)
+                with metrics.Measure('stage.posts'):
+                    processors['posts'].ProcessPosts()
 
                 #retrieving comments
                 if environment['archiveComments']:
-                    commPrc = CommentProcessor(environment)
-                    commPrc.ProcessComments()
+                    if 'comments' not in processors:
+                        processors['comments'] = CommentProcessor(environment)
+                    with metrics.Measure('stage.comments'):
+                        processors['comments'].ProcessComments(keepWarm)
+
+            try:
+                if profiler is not None:
+                    profiler.Profile(environment['sectionName'], environment['journal'], RunProcessors)
+                else:
+                    RunProcessors()
+                succeeded = True
             except Exception as ex:
+                metrics.Increment('errors')
                 logger.debug(u'Critical error in processing journal %s on server %s' % (environment['journal'], environment['sectionName']), exc_info = True)
                 logger.error(u'Application has encountered an error while processing journal %s on server %s: %s. Check %s\%s\%s for full exception traceback and other details.' %
                              (environment['journal'], environment['sectionName'], ex, workingScriptDirPath, logFolderName, logFileName))
+            metrics.Finish(succeeded)
+            logger.info(metrics.FormatSummary())
+            if tracer is not None:
+                SaveTrace(tracer, environment['sectionName'], environment['journal'])
+            SaveMetricsReports()
+
+        def SaveTrace(tracer, sectionName, journal):
+            path = os.path.join(options.traceFolderPath, u'trace_%s_%s_%s.json' % (sectionName, journal, time.strftime('%Y%m%d-%H%M%S')))
+            try:
+                tracer.Save(path)
+                logger.info(u'%s: %s: saved run trace to %s' % (sectionName, journal, path))
+            except Exception:
+                logger.warning(u'%s: %s: couldn\'t write run trace to %s' % (sectionName, journal, path), exc_info = True)
+
+        def SaveMetricsReports():
+            # in daemon mode this keeps reports fresh, every journal run rewrites them
+            for path, formatReport in [(options.metricsReportPath, None), (options.promFilePath, FormatPrometheusText)]:
+                if path is not None:
+                    try:
+                        metricsRegistry.SaveReport(path, formatReport)
+                    except Exception:
+                        logger.warning(u'Couldn\'t write metrics report to %s' % path, exc_info = True)
+
+        if options.daemon:
+            # passwords were asked for once above, everything else is kept in memory between syncs
+            JournalScheduler(configSections, globalSettings, ProcessJournal).Run()
+        else:
+            # journals on different servers are processed in parallel, see maxConcurrentJournals in config for journals on the same server
+            RunJournals(configSections, globalSettings, ProcessJournal)
+        SaveMetricsReports()
     except Exception as e:
         logger.debug(u'Critical application error', exc_info = True)
         logger.critical(u'Application has encountered a critical error and was stopped: %s. Check %s\%s\%s for full exception traceback and other details.' %
                         (e, workingScriptDirPath, logFolderName, logFileName))
+    finally:
+        if cassette is not None:
+            cassette.Close()
 
 
 if __name__ == '__main__':	
-    main()
\ No newline at end of file
+    main(sys.argv[1:])
\ No newline at end of file
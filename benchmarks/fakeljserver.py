@@ -0,0 +1,303 @@
+"""Local stand-in for a LiveJournal server, so that whole archiver runs can be benchmarked and tested offline.
+
+Serves the flat interface modes the archiver uses (getchallenge, syncitems, getevents, getdaycounts, sessiongenerate, sessionexpire),
+comment export pages, OpenID user profiles and images from a fixture dictionary like this one (see journalgenerator.py):
+
+{'journals': {'test_account': {'password': 'pwd',
+                               'posts': [{'itemid': 1, 'anum': 12, 'time': '2016-12-06 03:25:00', 'eventtime': '2016-12-06 03:20:00',
+                                          'subject': u'...', 'event': u'<p>...</p>', 'props': {'taglist': u'a, b'}}],
+                               'comments': [{'id': 1, 'jitemid': 1, 'posterid': 10, 'parentid': 0, 'state': 'A',
+                                             'subject': u'...', 'body': u'...', 'date': '2016-12-06T04:00:00Z'}],
+                               'usermaps': {'10': 'some_user'}}},
+ 'profiles': {'11': u'Real Name'}, # titles of profile pages of ext_ users by user id
+ 'images': {'1.jpg': 2048}} # image name (served at /images/<name>) and its size in bytes
+"""
+import sys
+import re
+import json
+import time
+import random
+import threading
+import argparse
+import urllib
+from hashlib import md5
+from collections import deque
+from urlparse import urlparse, parse_qs
+from xml.sax.saxutils import escape, quoteattr
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+def MD5(string):
+    hash = md5()
+    hash.update(string.encode('utf-8'))
+    return hash.hexdigest()
+
+def GetEventsAnswer(user, post):
+    """Returns list of (key, value) pairs getevents answers with for fixture post"""
+    answer = [('events_count', '1'), ('events_1_itemid', str(post['itemid'])), ('events_1_anum', str(post['anum'])),
+              ('events_1_eventtime', post.get('eventtime', post['time'])), ('events_1_subject', post.get('subject', u'')),
+              ('events_1_event', urllib.quote_plus(post.get('event', u'').encode('utf-8'))),
+              ('events_1_url', 'http://%s.example.com/%d.html' % (user.replace('_', '-'), int(post['itemid']) * 256 + int(post['anum'])))]
+    props = sorted(post.get('props', {}).iteritems())
+    for i, (name, value) in enumerate(props, 1):
+        answer.extend([('prop_%d_itemid' % i, str(post['itemid'])), ('prop_%d_name' % i, name), ('prop_%d_value' % i, value)])
+    return answer + [('prop_count', str(len(props)))]
+
+class FakeLjServer:
+    """Serves fixture journals over HTTP. Can answer slowly (latencySeconds), fail a share of requests with HTTP 500 (errorRate)
+        and answer HTTP 503 to requests above maxRequestsPerSecond, like a real server under load would"""
+
+    def __init__(self, fixture, latencySeconds = 0, errorRate = 0, maxRequestsPerSecond = None, seed = 0):
+        self.latencySeconds = latencySeconds
+        self.errorRate = errorRate
+        self.maxRequestsPerSecond = maxRequestsPerSecond
+        self.syncItemsPageSize = 100 # as many sync items as LiveJournal returns at once
+        self.commentsMetaPageSize = 10000
+        self.commentsBodyPageSize = 1000
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requestTimes = deque()
+        self.requestCounts = {} # request kind (flat mode, comment_meta, profile, image...) -> number of requests
+        self.challenges = set()
+        self.sessions = {} # session token -> user
+        self.sessionCount = 0
+        self.httpServer = None
+        self.thread = None
+        self.url = None
+        self.SetFixture(fixture)
+
+    def SetFixture(self, fixture):
+        """Replaces served journals, e. g. with edited ones between two archiver runs"""
+        journals = {}
+        for user, journal in fixture.get('journals', {}).iteritems():
+            journals[user] = {'password': journal['password'],
+                              'posts': sorted(journal.get('posts', []), key = lambda post: post['time']),
+                              'postsById': dict((int(post['itemid']), post) for post in journal.get('posts', [])),
+                              'comments': sorted(journal.get('comments', []), key = lambda comment: int(comment['id'])),
+                              'usermaps': dict((str(userId), name) for userId, name in journal.get('usermaps', {}).iteritems())}
+        with self.lock:
+            self.journals = journals
+            self.profiles = dict((str(userId), title) for userId, title in fixture.get('profiles', {}).iteritems())
+            self.images = dict(fixture.get('images', {}))
+
+    def Start(self, port = 0):
+        """Starts serving in background thread on localhost, port 0 picks a free one. Returns server url"""
+        self.httpServer = ThreadingHttpServer(('127.0.0.1', port), FakeLjRequestHandler)
+        self.httpServer.fakeLjServer = self
+        self.thread = threading.Thread(target = self.httpServer.serve_forever, kwargs = {'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d' % self.httpServer.server_address[1]
+        return self.url
+
+    def Stop(self):
+        if self.httpServer is not None:
+            self.httpServer.shutdown()
+            self.httpServer.server_close()
+            self.httpServer = None
+            self.thread.join()
+
+    def GetRequestCount(self, kind):
+        with self.lock:
+            return self.requestCounts.get(kind, 0)
+
+    def Answer(self, method, path, params, cookies):
+        """Returns (http status, content type, body) for request"""
+        kind = self.GetRequestKind(path, params)
+        with self.lock:
+            self.requestCounts[kind] = self.requestCounts.get(kind, 0) + 1
+            isRateLimited = self.IsRateLimited(time.time())
+            isFailed = self.errorRate > 0 and self.random.random() < self.errorRate
+        if self.latencySeconds > 0:
+            time.sleep(self.latencySeconds)
+        if isRateLimited:
+            return 503, 'text/plain', 'Too many requests'
+        if isFailed:
+            return 500, 'text/plain', 'Injected error'
+
+        if path == '/interface/flat' and method == 'POST':
+            return 200, 'text/plain; charset=utf-8', self.FormatFlatAnswer(self.AnswerFlatRequest(params))
+        if path == '/export_comments.bml' and method == 'GET':
+            user = self.sessions.get(cookies.get('ljsession'))
+            if user is None:
+                return 403, 'text/plain', 'Not logged in'
+            return 200, 'text/xml; charset=utf-8', self.GetCommentsPage(user, params.get('get'), int(params.get('startid', 0))).encode('utf-8')
+        if path == '/profile' and method == 'GET':
+            title = self.profiles.get(params.get('userid'))
+            if title is None:
+                return 404, 'text/html', 'No such user'
+            return 200, 'text/html; charset=utf-8', (u'<html><head><title>%s - Profile</title></head><body></body></html>' % escape(title)).encode('utf-8')
+        if path.startswith('/images/') and method == 'GET':
+            return self.GetImage(urllib.unquote(path[len('/images/'):]).decode('utf-8'))
+        return 404, 'text/plain', 'Not found'
+
+    def GetRequestKind(self, path, params):
+        if path == '/interface/flat':
+            return params.get('mode', 'flat')
+        if path == '/export_comments.bml':
+            return params.get('get', 'export_comments')
+        if path.startswith('/images/'):
+            return 'image'
+        return path.strip('/') or 'root'
+
+    def IsRateLimited(self, now):
+        """Counts request in one second sliding window, returns True if there were more than maxRequestsPerSecond requests in it"""
+        if self.maxRequestsPerSecond is None:
+            return False
+        while len(self.requestTimes) > 0 and self.requestTimes[0] <= now - 1:
+            self.requestTimes.popleft()
+        self.requestTimes.append(now)
+        return len(self.requestTimes) > self.maxRequestsPerSecond
+
+    def AnswerFlatRequest(self, params):
+        """Returns list of (key, value) pairs answering flat interface request"""
+        mode = params.get('mode')
+        if mode == 'getchallenge':
+            with self.lock:
+                challenge = 'c0:%d:%d' % (len(self.challenges), self.random.randint(0, 10 ** 9))
+                self.challenges.add(challenge)
+            return [('auth_scheme', 'c0'), ('challenge', challenge), ('expire_time', '%d' % (time.time() + 60)), ('server_time', '%d' % time.time()), ('success', 'OK')]
+
+        user = params.get('user')
+        journal = self.journals.get(user)
+        with self.lock:
+            isChallengeKnown = params.get('auth_challenge') in self.challenges
+            self.challenges.discard(params.get('auth_challenge')) # challenges are single use
+        if journal is None or not isChallengeKnown or params.get('auth_response') != MD5(params['auth_challenge'] + MD5(journal['password'])):
+            return [('errmsg', 'Invalid password'), ('success', 'FAIL')]
+
+        if mode == 'syncitems':
+            lastSync = params.get('lastsync', '')
+            changedPosts = [post for post in journal['posts'] if post['time'] > lastSync]
+            answer = []
+            for i, post in enumerate(changedPosts[:self.syncItemsPageSize], 1):
+                answer.extend([('sync_%d_action' % i, 'update'), ('sync_%d_item' % i, 'L-%d' % post['itemid']), ('sync_%d_time' % i, post['time'])])
+            return answer + [('sync_count', str(min(len(changedPosts), self.syncItemsPageSize))), ('sync_total', str(len(changedPosts))), ('success', 'OK')]
+        if mode == 'getdaycounts':
+            dayCounts = {}
+            for post in journal['posts']:
+                day = post.get('eventtime', post['time'])[0:10]
+                dayCounts[day] = dayCounts.get(day, 0) + 1
+            return sorted((day, str(count)) for day, count in dayCounts.iteritems()) + [('success', 'OK')]
+        if mode == 'getevents':
+            post = journal['postsById'].get(int(params.get('itemid', 0)))
+            if post is None:
+                return [('events_count', '0'), ('prop_count', '0'), ('success', 'OK')]
+            return GetEventsAnswer(user, post) + [('success', 'OK')]
+        if mode == 'sessiongenerate':
+            with self.lock:
+                self.sessionCount += 1
+                token = 'v2:u1:s%d:a%d:fake//1' % (self.sessionCount, self.random.randint(0, 10 ** 9))
+                self.sessions[token] = user
+            return [('ljsession', token), ('success', 'OK')]
+        if mode == 'sessionexpire':
+            expiredIds = [key[len('expire_id_'):] for key in params if key.startswith('expire_id_')]
+            with self.lock:
+                for token in [token for token in self.sessions if token.split(':')[2][1:] in expiredIds]:
+                    del self.sessions[token]
+            return [('success', 'OK')]
+        return [('errmsg', 'Client error: Unknown mode %s' % mode), ('success', 'FAIL')]
+
+    def FormatFlatAnswer(self, answer):
+        """Flat answers are key and value lines one after another, values can't have line breaks"""
+        lines = []
+        for key, value in answer:
+            lines.append(key)
+            lines.append(re.sub('[\r\n]+', ' ', unicode(value)))
+        return (u'\n'.join(lines) + u'\n').encode('utf-8')
+
+    def GetCommentsPage(self, user, infoType, startId):
+        """Returns comment_meta or comment_body export page xml with comments starting with startId"""
+        journal = self.journals[user]
+        comments = [comment for comment in journal['comments'] if int(comment['id']) >= startId]
+        maxId = int(journal['comments'][-1]['id']) if len(journal['comments']) > 0 else 0
+        if infoType == 'comment_meta':
+            page = comments[:self.commentsMetaPageSize]
+            parts = [u'<?xml version="1.0" encoding="utf-8"?>\n<livejournal>\n<maxid>%d</maxid>\n' % maxId]
+            if len(comments) > len(page):
+                parts.append(u'<nextid>%d</nextid>\n' % int(comments[len(page)]['id']))
+            parts.append(u'<comments>\n')
+            for comment in page:
+                parts.append(u'<comment id="%d" posterid="%d" state="%s" jitemid="%d" />\n' % (int(comment['id']), int(comment['posterid']), comment.get('state', 'A'), int(comment['jitemid'])))
+            parts.append(u'</comments>\n<usermaps>\n')
+            for posterId in sorted(set(str(comment['posterid']) for comment in page), key = int):
+                parts.append(u'<usermap id="%s" user=%s />\n' % (posterId, quoteattr(journal['usermaps'].get(posterId, u'user%s' % posterId))))
+            parts.append(u'</usermaps>\n</livejournal>\n')
+            return u''.join(parts)
+        if infoType == 'comment_body':
+            parts = [u'<?xml version="1.0" encoding="utf-8"?>\n<livejournal>\n<comments>\n']
+            for comment in comments[:self.commentsBodyPageSize]:
+                parts.append(u'<comment id="%d" jitemid="%d" posterid="%d" state="%s"%s>' % (int(comment['id']), int(comment['jitemid']), int(comment['posterid']), comment.get('state', 'A'),
+                                                                                          u' parentid="%d"' % int(comment['parentid']) if comment.get('parentid') else u''))
+                if comment.get('state', 'A') != 'D': # deleted comments come without texts
+                    if comment.get('subject'):
+                        parts.append(u'<subject>%s</subject>' % escape(comment['subject']))
+                    parts.append(u'<body>%s</body>' % escape(comment.get('body', u'')))
+                    parts.append(u'<date>%s</date>' % comment['date'])
+                parts.append(u'</comment>\n')
+            parts.append(u'</comments>\n</livejournal>\n')
+            return u''.join(parts)
+        return u'<?xml version="1.0" encoding="utf-8"?>\n<livejournal><error>Unknown export type</error></livejournal>\n'
+
+    def GetImage(self, name):
+        size = self.images.get(name)
+        if size is None:
+            return 404, 'text/plain', 'No such image'
+        extension = name.rsplit('.', 1)[-1].lower()
+        contentType = 'image/%s' % {'jpg': 'jpeg'}.get(extension, extension)
+        return 200, contentType, (name.encode('utf-8') * (int(size) / max(len(name), 1) + 1))[:int(size)]
+
+class ThreadingHttpServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class FakeLjRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.0'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.Respond('GET', url.path, self.ParseParams(url.query))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.getheader('Content-Length') or 0))
+        self.Respond('POST', url.path, self.ParseParams(body))
+
+    def ParseParams(self, query):
+        return dict((key, values[-1].decode('utf-8')) for key, values in parse_qs(query, keep_blank_values = True).iteritems())
+
+    def Respond(self, method, path, params):
+        cookies = dict(cookie.strip().split('=', 1) for cookie in (self.headers.getheader('Cookie') or '').split(';') if '=' in cookie)
+        status, contentType, body = self.server.fakeLjServer.Answer(method, path, params, cookies)
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # requests are counted in requestCounts instead
+
+def ParseArguments(arguments):
+    parser = argparse.ArgumentParser(description = 'Serves journals from fixture file like a LiveJournal server would.')
+    parser.add_argument('fixture', help = 'json fixture file made by journalgenerator.py')
+    parser.add_argument('--port', type = int, default = 8080)
+    parser.add_argument('--latency', type = float, default = 0, metavar = 'SECONDS', help = 'delay before every answer')
+    parser.add_argument('--error-rate', type = float, default = 0, dest = 'errorRate', help = 'share of requests answered with HTTP 500, 0..1')
+    parser.add_argument('--max-rps', type = int, dest = 'maxRequestsPerSecond', help = 'answer HTTP 503 to requests above this rate')
+    return parser.parse_args(arguments)
+
+def main(arguments):
+    options = ParseArguments(arguments)
+    with open(options.fixture, 'rb') as fixtureFile:
+        fixture = json.load(fixtureFile)
+    server = FakeLjServer(fixture, options.latency, options.errorRate, options.maxRequestsPerSecond)
+    print 'Serving %s at %s, Ctrl+C to stop' % (options.fixture, server.Start(options.port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.Stop()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,294 @@
+"""Generates synthetic journals of any size for benchmarks: fixtures served by fakeljserver.py, changed versions of them
+as they would be on the next archiver run, and local archives of fixtures as the archiver would have left them"""
+import sys
+import os
+import json
+import copy
+import random
+import datetime
+import argparse
+from collections import OrderedDict
+from xml.etree.ElementTree import Element, SubElement, tostring
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modules'))
+import common
+from postprocessor import PostProcessor
+from commentmetadatastore import CommentMetadataStore
+from fakeljserver import GetEventsAnswer
+
+class JournalGenerator:
+    """Makes fixture journals. Same seed gives same journals, so benchmark runs are comparable"""
+
+    def __init__(self, seed = 0, server = 'http://127.0.0.1:8080'):
+        self.random = random.Random(seed)
+        self.server = server
+        self.dateFormatString = '%Y-%m-%d %H:%M:%S'
+        self.commentDateFormatString = '%Y-%m-%dT%H:%M:%SZ'
+        self.startDate = datetime.datetime(2010, 1, 1, 12, 0, 0)
+        self.maxThreadDepth = 40 # deeper threads are rare on LiveJournal, and xml of them gets deeper than parsers like
+        self.extUserShare = 0.1 # share of commenters that are OpenID users
+        self.postsWithImagesShare = 0.3
+        self.sharedImageCount = 5 # images like userpics and banners that many posts link to
+        self.words = (u'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore magna aliqua enim ad minim '
+                      u'veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo consequat duis aute irure in reprehenderit voluptate velit '
+                      u'esse cillum fugiat nulla pariatur excepteur sint occaecat cupidatat non proident sunt culpa qui officia deserunt mollit anim id est '
+                      u'\u043f\u0440\u0438\u0432\u0435\u0442 \u043c\u0438\u0440').split() # and a couple of non-ascii words
+        self.moods = [u'happy', u'tired', u'busy', u'sleepy', u'cheerful']
+
+    def GenerateFixture(self, journal = 'test_account', password = 'pwd', postCount = 1000, commentCount = 10000, userCount = None):
+        """Returns fixture with one journal of postCount posts and commentCount comments written by userCount users"""
+        fixture = {'journals': {journal: {'password': password, 'posts': [], 'comments': [], 'usermaps': {}}}, 'profiles': {}, 'images': {}}
+        self.AddUsers(fixture, journal, userCount if userCount is not None else max(10, commentCount / 100))
+        self.AddPosts(fixture, journal, postCount, self.startDate)
+        self.AddComments(fixture, journal, commentCount)
+        return fixture
+
+    def ChangeFixture(self, fixture, journal = 'test_account', newPostCount = 0, editedPostCount = 0, deletedPostCount = 0,
+                      newCommentCount = 0, editedCommentCount = 0, deletedCommentCount = 0):
+        """Returns copy of fixture changed the way a journal changes between two archiver runs. Changes happen a day after the latest post"""
+        fixture = copy.deepcopy(fixture)
+        journalData = fixture['journals'][journal]
+        posts = journalData['posts']
+        changeDate = max(self.ParseDate(post['time']) for post in posts) + datetime.timedelta(days = 1) if len(posts) > 0 else self.startDate
+        nextItemId = self.GetNextId(posts, 'itemid') # ids of deleted posts and comments are never given again
+        nextCommentId = self.GetNextId(journalData['comments'], 'id')
+
+        deletedItemIds = set(post['itemid'] for post in self.random.sample(posts, min(deletedPostCount, len(posts))))
+        journalData['posts'] = posts = [post for post in posts if post['itemid'] not in deletedItemIds]
+        journalData['comments'] = [comment for comment in journalData['comments'] if comment['jitemid'] not in deletedItemIds] # comments are gone with their post
+        for i, post in enumerate(self.random.sample(posts, min(editedPostCount, len(posts)))):
+            post['time'] = self.FormatDate(changeDate + datetime.timedelta(minutes = i))
+            post['subject'] = u'%s (upd)' % post['subject']
+            post['event'] = u'%s<p><b>UPD:</b> %s</p>' % (post['event'], self.GetSentence())
+            post['props']['revnum'] = unicode(int(post['props'].get('revnum', u'0')) + 1)
+
+        parentIds = set(comment['parentid'] for comment in journalData['comments'])
+        # only comments without replies are deleted: archiver removes deleted comment from post file together with its replies
+        deletableComments = [comment for comment in journalData['comments'] if comment['state'] != 'D' and comment['id'] not in parentIds]
+        for comment in self.random.sample(deletableComments, min(deletedCommentCount, len(deletableComments))):
+            comment['state'] = 'D'
+            comment.pop('subject', None)
+            comment.pop('body', None)
+        editableComments = [comment for comment in journalData['comments'] if comment['state'] != 'D' and comment['id'] not in parentIds] # LiveJournal lets edit only comments without replies
+        for comment in self.random.sample(editableComments, min(editedCommentCount, len(editableComments))):
+            comment['body'] = u'%s (edited)' % comment['body']
+
+        self.AddPosts(fixture, journal, newPostCount, changeDate + datetime.timedelta(hours = 1), nextItemId)
+        self.AddComments(fixture, journal, newCommentCount, nextCommentId)
+        return fixture
+
+    def AddUsers(self, fixture, journal, userCount):
+        usermaps = fixture['journals'][journal]['usermaps']
+        for userId in xrange(100, 100 + userCount):
+            if self.random.random() < self.extUserShare:
+                usermaps[str(userId)] = u'ext_%d' % userId
+                fixture['profiles'][str(userId)] = u'%s %s' % (self.random.choice(self.words).title(), self.random.choice(self.words).title())
+            else:
+                usermaps[str(userId)] = u'user_%d' % userId
+
+    def AddPosts(self, fixture, journal, postCount, firstPostDate, nextItemId = None):
+        """Adds posts after existing ones, a few hours apart"""
+        posts = fixture['journals'][journal]['posts']
+        nextItemId = nextItemId or self.GetNextId(posts, 'itemid')
+        postDate = firstPostDate
+        for itemId in xrange(nextItemId, nextItemId + postCount):
+            postDate += datetime.timedelta(hours = self.random.randint(1, 30), seconds = self.random.randint(0, 3599))
+            posts.append(self.GeneratePost(fixture, itemId, postDate))
+
+    def GeneratePost(self, fixture, itemId, postDate):
+        props = {u'taglist': u', '.join(sorted(set(u'tag%d' % self.random.randint(1, 50) for i in xrange(self.random.randint(0, 4))))),
+                 u'current_mood': self.random.choice(self.moods),
+                 u'current_music': self.GetSentence(3).rstrip(u'.'),
+                 u'revnum': u'0',
+                 u'useragent': u'Mozilla/5.0',
+                 u'opt_backdated': u'0'}
+        return {'itemid': itemId, 'anum': self.random.randint(0, 255),
+                'time': self.FormatDate(postDate), 'eventtime': self.FormatDate(postDate - datetime.timedelta(minutes = self.random.randint(0, 59))),
+                'subject': self.GetSentence(5).rstrip(u'.'), 'event': self.GenerateMarkup(fixture, itemId), 'props': props}
+
+    def GenerateMarkup(self, fixture, itemId):
+        """Returns post html with paragraphs, links, unclosed tags, lj-cut and sometimes images, plain and linked to their bigger versions"""
+        paragraphs = []
+        for i in xrange(self.random.randint(1, 8)):
+            sentences = [self.GetSentence() for j in xrange(self.random.randint(1, 6))]
+            if self.random.random() < 0.3:
+                sentences.append(u'<a href="http://example.com/%d">%s</a>' % (self.random.randint(1, 10 ** 6), self.GetSentence(3)))
+            if self.random.random() < 0.3:
+                sentences.insert(0, u'<b>%s</b><br>' % self.GetSentence(2))
+            paragraphs.append(u'<p>%s</p>' % u' '.join(sentences))
+        if self.random.random() < self.postsWithImagesShare:
+            for i in xrange(self.random.randint(1, 4)):
+                paragraphs.insert(self.random.randint(0, len(paragraphs)), self.GenerateImageMarkup(fixture, itemId, i))
+        if len(paragraphs) > 2:
+            paragraphs.insert(2, u'<lj-cut text="More">')
+            paragraphs.append(u'</lj-cut>')
+        return u'\n'.join(paragraphs)
+
+    def GenerateImageMarkup(self, fixture, itemId, number):
+        kind = self.random.random()
+        if kind < 0.2:
+            name = u'shared_%d.png' % self.random.randint(1, self.sharedImageCount)
+            fixture['images'].setdefault(name, self.random.randint(1024, 8192))
+            return u'<img src="%s/images/%s" alt="">' % (self.server, name)
+        name = u'%d_%d.jpg' % (itemId, number)
+        fixture['images'][name] = self.random.randint(2 * 1024, 64 * 1024)
+        if kind < 0.6:
+            return u'<img src="%s/images/%s" width="600" alt="%s">' % (self.server, name, self.GetSentence(2).rstrip(u'.'))
+        bigName = u'%d_%d_big.jpg' % (itemId, number)
+        fixture['images'][bigName] = self.random.randint(64 * 1024, 256 * 1024)
+        return u'<a href="%s/images/%s"><img src="%s/images/%s" /></a>' % (self.server, bigName, self.server, name)
+
+    def AddComments(self, fixture, journal, commentCount, nextCommentId = None):
+        """Adds comments after existing ones. Comments go mostly to posts of the time they are written and often answer the latest comment
+            of the post, so threads grow deep"""
+        journalData = fixture['journals'][journal]
+        posts = sorted(journalData['posts'], key = lambda post: post['time'])
+        if len(posts) == 0 or commentCount == 0:
+            return
+        userIds = sorted(int(userId) for userId in journalData['usermaps'])
+        depths = {}
+        commentsByPost = {}
+        for comment in journalData['comments']:
+            depths[comment['id']] = depths.get(comment['parentid'], 0) + 1
+            commentsByPost.setdefault(comment['jitemid'], []).append(comment)
+        nextCommentId = nextCommentId or self.GetNextId(journalData['comments'], 'id')
+
+        for i in xrange(commentCount):
+            post = posts[max(0, int(len(posts) * (i + 0.5) / commentCount) - int(self.random.expovariate(0.3)))]
+            postComments = commentsByPost.setdefault(post['itemid'], [])
+            parent = None
+            kind = self.random.random()
+            if len(postComments) > 0 and kind < 0.6:
+                parent = postComments[-1]
+            elif len(postComments) > 0 and kind < 0.8:
+                parent = self.random.choice(postComments)
+            if parent is not None and depths[parent['id']] >= self.maxThreadDepth:
+                parent = None
+            commentDate = self.ParseDate(post['time']) + datetime.timedelta(minutes = 7 * len(postComments) + self.random.randint(1, 6))
+            comment = {'id': nextCommentId, 'jitemid': post['itemid'], 'posterid': self.random.choice(userIds),
+                       'parentid': parent['id'] if parent is not None else 0, 'state': 'S' if self.random.random() < 0.02 else 'A',
+                       'body': u' '.join(self.GetSentence() for j in xrange(self.random.randint(1, 4))),
+                       'date': commentDate.strftime(self.commentDateFormatString)}
+            if self.random.random() < 0.3:
+                comment['subject'] = self.GetSentence(3).rstrip(u'.')
+            depths[comment['id']] = depths.get(comment['parentid'], 0) + 1
+            postComments.append(comment)
+            journalData['comments'].append(comment)
+            nextCommentId += 1
+
+    def GetNextId(self, items, idKey):
+        return max([item[idKey] for item in items] + [0]) + 1
+
+    def GetSentence(self, wordCount = None):
+        words = [self.random.choice(self.words) for i in xrange(wordCount or self.random.randint(4, 15))]
+        return u'%s.' % u' '.join(words).capitalize()
+
+    def ParseDate(self, s):
+        return datetime.datetime.strptime(s, self.dateFormatString)
+
+    def FormatDate(self, date):
+        return date.strftime(self.dateFormatString)
+
+def WriteArchive(fixture, rootDir, journal = 'test_account', sectionName = 'LiveJournal', server = 'http://127.0.0.1:8080', fullSyncDate = None):
+    """Writes archive of fixture journal into rootDir (the directory archiver keeps section folders in) as if the archiver has just synced it
+        with images and XSLT off: post files, post and user indexes, sync dates and comment metadata store"""
+    dateFormatString = '%Y-%m-%d %H:%M:%S'
+    commentDateFormatString = '%Y-%m-%dT%H:%M:%SZ'
+    journalPath = os.path.join(rootDir, sectionName, journal)
+    cachedDataPath = os.path.join(journalPath, 'cached data')
+    serverSchema, serverNetloc = server.split('://', 1)
+    environment = {'sectionName': sectionName, 'journal': journal, 'server': server, 'serverSchema': serverSchema, 'serverNetloc': serverNetloc,
+                   'archiveImages': False, 'applyXSLT': False, 'dateFormatString': dateFormatString}
+    postProcessor = PostProcessor('Archiver', environment)
+    journalData = fixture['journals'][journal]
+    posts = sorted(journalData['posts'], key = lambda post: post['time'])
+
+    usermaps = Element('usermaps')
+    usermapsById = {}
+    for userId in sorted(set(str(comment['posterid']) for comment in journalData['comments']), key = int):
+        usermap = SubElement(usermaps, 'usermap', {'id': userId, 'user': journalData['usermaps'][userId]})
+        if userId in fixture.get('profiles', {}):
+            usermap.attrib['real_name'] = fixture['profiles'][userId]
+        usermapsById[userId] = usermap
+
+    store = CommentMetadataStore(os.path.join(cachedDataPath, 'cachedcommentsmetadata.dat'), dateFormatString)
+    store.Open()
+    repliesByParent = {} # (post id, parent comment id) -> comments
+    try:
+        for comment in sorted(journalData['comments'], key = lambda comment: comment['id']):
+            repliesByParent.setdefault((comment['jitemid'], comment['parentid']), []).append(comment)
+            date = datetime.datetime.strptime(comment['date'], commentDateFormatString).strftime(dateFormatString) if comment['state'] != 'D' else None
+            subjectAndBody = u'%s%s' % (comment.get('subject', u''), comment.get('body', u''))
+            store.Update(comment['id'], comment['state'], date, common.MD5(subjectAndBody) if subjectAndBody != u'' else '')
+    finally:
+        store.Close()
+
+    def AppendComments(parentNode, postId, parentId):
+        replies = repliesByParent.get((postId, parentId))
+        if replies is None:
+            return
+        commentsNode = SubElement(parentNode, 'comments')
+        for comment in replies:
+            usermap = usermapsById[str(comment['posterid'])]
+            attributes = {'id': str(comment['id']), 'jitemid': str(postId), 'posterid': str(comment['posterid']), 'state': comment['state']}
+            if parentId != 0:
+                attributes['parentid'] = str(parentId)
+            attributes['poster_name'] = usermap.attrib.get('real_name', usermap.attrib['user'])
+            attributes['poster_url'] = (common.CreateAuthorExtUrl(server, usermap.attrib['id']) if usermap.attrib['user'].startswith('ext_')
+                                        else common.CreateAuthorUrl(serverSchema, serverNetloc, usermap.attrib['user']))
+            commentNode = SubElement(commentsNode, 'comment', attributes)
+            if comment['state'] != 'D':
+                if comment.get('subject'):
+                    SubElement(commentNode, 'subject').text = comment['subject']
+                SubElement(commentNode, 'body').text = comment['body']
+                SubElement(commentNode, 'date').text = datetime.datetime.strptime(comment['date'], commentDateFormatString).strftime(dateFormatString)
+            AppendComments(commentNode, postId, comment['id'])
+
+    postIds = Element('posts')
+    for post in posts:
+        postRecord = postProcessor.DecodePostData(OrderedDict(GetEventsAnswer(journal, post)))
+        postXml = postProcessor.FlatPostDataToXmlObject(postRecord)
+        AppendComments(postXml, post['itemid'], 0)
+        publicId = postProcessor.GetPublicPostId(postRecord)
+        SubElement(postIds, 'post', {'dbid': str(post['itemid']), 'publicid': str(publicId)})
+        WriteFile(os.path.join(journalPath, '%d.xml' % publicId), common.PrettyPrintXml(postXml, None).encode('utf-8'))
+
+    WriteFile(os.path.join(cachedDataPath, 'cachedpostids.xml'), tostring(postIds, 'utf-8'))
+    WriteFile(os.path.join(cachedDataPath, 'cacheduserids.xml'), tostring(usermaps, 'utf-8'))
+    WriteFile(os.path.join(cachedDataPath, postProcessor.syncItemsIndexFileName), ''.join('%d\t%s\n' % (post['itemid'], post['time']) for post in posts))
+    if len(posts) > 0:
+        WriteFile(os.path.join(cachedDataPath, postProcessor.lastSyncFileName), posts[-1]['time'])
+    WriteFile(os.path.join(cachedDataPath, postProcessor.lastFullSyncFileName), (fullSyncDate or datetime.datetime.now()).strftime(dateFormatString))
+
+def WriteFile(path, content):
+    common.CreatePathIfNotExists(path)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+def ParseArguments(arguments):
+    parser = argparse.ArgumentParser(description = 'Generates synthetic journal fixtures for fakeljserver.py and local archive of them.')
+    parser.add_argument('output', help = 'folder to write fixture.json, fixture_changed.json and archive folder to')
+    parser.add_argument('--posts', type = int, default = 1000)
+    parser.add_argument('--comments', type = int, default = 10000)
+    parser.add_argument('--users', type = int)
+    parser.add_argument('--changed-percent', type = float, default = 1, dest = 'changedPercent',
+                        help = 'share of posts and comments added, edited and deleted in fixture_changed.json, each')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--server', default = 'http://127.0.0.1:8080', help = 'url fakeljserver.py will be started at, image links point there')
+    return parser.parse_args(arguments)
+
+def main(arguments):
+    options = ParseArguments(arguments)
+    generator = JournalGenerator(options.seed, options.server)
+    fixture = generator.GenerateFixture(postCount = options.posts, commentCount = options.comments, userCount = options.users)
+    changedPosts = int(options.posts * options.changedPercent / 100)
+    changedComments = int(options.comments * options.changedPercent / 100)
+    changedFixture = generator.ChangeFixture(fixture, newPostCount = changedPosts, editedPostCount = changedPosts, deletedPostCount = changedPosts,
+                                             newCommentCount = changedComments, editedCommentCount = changedComments, deletedCommentCount = changedComments)
+    for fileName, data in [('fixture.json', fixture), ('fixture_changed.json', changedFixture)]:
+        WriteFile(os.path.join(options.output, fileName), json.dumps(data))
+    WriteArchive(fixture, os.path.join(options.output, 'archive'), server = options.server)
+    print 'Wrote fixtures and archive of %d posts and %d comments to %s' % (options.posts, options.comments, options.output)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
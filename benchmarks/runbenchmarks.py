@@ -0,0 +1,287 @@
+"""Times the archive pipeline and its hot paths on generated journals and reports results as json.
+Results can be stored as baseline and later runs compared with it, so that slowdowns are noticed before release.
+Timings are only comparable on the same machine, so baseline is saved on the machine that runs the comparison and is not committed:
+
+python benchmarks/runbenchmarks.py --scale 1k --save-baseline benchmarks/baseline.json
+python benchmarks/runbenchmarks.py --scale 1k --baseline benchmarks/baseline.json
+"""
+import sys
+import os
+import json
+import copy
+import shutil
+import logging
+import tempfile
+import argparse
+import platform
+import subprocess
+from timeit import default_timer
+from collections import OrderedDict
+from xml.etree.ElementTree import Element, SubElement, fromstring
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modules'))
+import common
+from connection import Connection
+from postprocessor import PostProcessor
+from commentprocessor import CommentProcessor
+from imagescraper import ImageScraper
+from fakeljserver import FakeLjServer, GetEventsAnswer
+from journalgenerator import JournalGenerator, WriteArchive
+
+try:
+    import resource # not available on Windows
+except ImportError:
+    resource = None
+
+scales = OrderedDict([('1k', {'posts': 1000, 'comments': 10000}),
+                      ('10k', {'posts': 10000, 'comments': 100000}),
+                      ('100k', {'posts': 100000, 'comments': 1000000})])
+changedShare = 0.01 # share of posts and comments added, edited and deleted before incremental sync, each
+journal = 'test_account'
+dateFormatString = '%Y-%m-%d %H:%M:%S'
+
+def GetPeakRssKb():
+    """Returns peak resident memory of the process in kilobytes or None if the platform can't tell"""
+    if resource is None:
+        return None
+    peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peakRss / 1024 if sys.platform == 'darwin' else peakRss # bytes on macOS, kilobytes elsewhere
+
+def MeasureOpsPerSecond(operation, minSeconds):
+    """Calls operation(i) with growing i until minSeconds pass"""
+    ops = 0
+    start = default_timer()
+    while True:
+        operation(ops)
+        ops += 1
+        elapsed = default_timer() - start
+        if elapsed >= minSeconds:
+            break
+    return OrderedDict([('ops', ops), ('seconds', round(elapsed, 3)), ('opsPerSecond', round(ops / elapsed, 2))])
+
+def MeasureStartup(runs = 5):
+    """Imports archiver in fresh interpreters, which is most of what a run with nothing to sync costs. Returns the fastest of runs"""
+    script = ('import sys, json; from timeit import default_timer; start = default_timer(); sys.path.insert(0, %r); import archiver; '
+              'print json.dumps({"seconds": default_timer() - start})') % os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    measurements = []
+    for i in xrange(runs):
+        start = default_timer()
+        measurement = json.loads(subprocess.check_output([sys.executable, '-c', script]))
+        measurement['processSeconds'] = default_timer() - start
+        measurements.append(measurement)
+    return OrderedDict([('seconds', round(min(measurement['seconds'] for measurement in measurements), 4)),
+                        ('processSeconds', round(min(measurement['processSeconds'] for measurement in measurements), 4))])
+
+def GetEnvironment(url):
+    return {'cnn': Connection(30, 'Benchmark'), 'delay': 0, 'cachedDataFolder': 'cached data', 'cachedPostIdsFile': 'cachedpostids.xml',
+            'xsltFile': 'stylesheet.xsl', 'dateFormatString': dateFormatString, 'deadline': None, 'applyXSLT': False, 'archiveImages': False,
+            'archiveComments': True, 'fullSyncIntervalDays': 7, 'syncIntervalMinutes': 60, 'maxConcurrentJournals': 1,
+            'sectionName': 'Benchmark', 'journal': journal, 'server': url, 'serverSchema': 'http', 'serverNetloc': url.split('://', 1)[1],
+            'exportCommentsPage': 'export_comments.bml', 'eventPropertiesToExclude': [], 'propPropertiesToExclude': [], 'passwordHash': common.MD5('pwd')}
+
+class BenchmarkRunner:
+    """Runs benchmarks inside working folder, archives go one level up from it the way archiver keeps them"""
+
+    def __init__(self, scale, minSeconds = 1.0, stages = ('initial', 'incremental'), seed = 0):
+        self.scale = scale
+        self.minSeconds = minSeconds
+        self.stages = stages
+        self.seed = seed
+        self.server = None
+        self.rootPath = None
+
+    def Run(self):
+        results = OrderedDict([('scale', self.scale), ('python', platform.python_version()), ('platform', platform.platform()),
+                               ('startup', OrderedDict()), ('pipeline', OrderedDict()), ('hotPaths', OrderedDict())])
+        results['startup']['importArchiver'] = MeasureStartup()
+        previousDir = os.getcwdu()
+        self.rootPath = tempfile.mkdtemp(prefix = 'ljarch-benchmark-')
+        workingPath = os.path.join(self.rootPath, 'work')
+        os.mkdir(workingPath)
+        os.chdir(workingPath) # common.GetUpperLevelDir() is now rootPath
+        self.server = FakeLjServer({})
+        try:
+            url = self.server.Start()
+            generator = JournalGenerator(self.seed, url)
+            fixture, changedFixture = self.RunStage(results, 'generate', lambda: self.GenerateFixtures(generator), 0)
+            if 'initial' in self.stages:
+                self.server.SetFixture(fixture)
+                self.RunStage(results, 'initialPosts', lambda: PostProcessor('Archiver', GetEnvironment(url)).ProcessPosts(), len(fixture['journals'][journal]['posts']))
+                self.RunStage(results, 'initialComments', lambda: CommentProcessor(GetEnvironment(url)).ProcessComments(), len(fixture['journals'][journal]['comments']))
+            else:
+                self.RunStage(results, 'writeArchive', lambda: WriteArchive(fixture, self.rootPath, journal, 'Benchmark', url), len(fixture['journals'][journal]['posts']))
+            if 'incremental' in self.stages:
+                self.server.SetFixture(changedFixture)
+                self.RunStage(results, 'incrementalPosts', lambda: PostProcessor('Archiver', GetEnvironment(url)).ProcessPosts(), None)
+                self.RunStage(results, 'incrementalComments', lambda: CommentProcessor(GetEnvironment(url)).ProcessComments(), None)
+            self.RunHotPaths(results['hotPaths'], fixture, url)
+        finally:
+            self.server.Stop()
+            os.chdir(previousDir)
+            shutil.rmtree(self.rootPath, ignore_errors = True)
+        return results
+
+    def GenerateFixtures(self, generator):
+        fixture = generator.GenerateFixture(journal, 'pwd', self.scale['posts'], self.scale['comments'])
+        changedPosts = int(self.scale['posts'] * changedShare)
+        changedComments = int(self.scale['comments'] * changedShare)
+        changedFixture = generator.ChangeFixture(fixture, journal, changedPosts, changedPosts, changedPosts, changedComments, changedComments, changedComments)
+        return fixture, changedFixture
+
+    def RunStage(self, results, name, stage, itemCount):
+        """Runs pipeline stage once, records its time, number of requests made to server and peak memory"""
+        requestCountBefore = sum(self.server.requestCounts.values())
+        start = default_timer()
+        result = stage()
+        elapsed = default_timer() - start
+        stageResults = OrderedDict([('seconds', round(elapsed, 3)), ('requests', sum(self.server.requestCounts.values()) - requestCountBefore)])
+        if itemCount:
+            stageResults['itemsPerSecond'] = round(itemCount / elapsed, 2)
+        stageResults['peakRssKb'] = GetPeakRssKb()
+        results['pipeline'][name] = stageResults
+        logging.getLogger('log').warning(u'%s: %.1f s' % (name, elapsed))
+        return result
+
+    def RunHotPaths(self, results, fixture, url):
+        environment = GetEnvironment(url)
+        posts = fixture['journals'][journal]['posts'][:1000]
+        postProcessor = PostProcessor('Archiver', environment)
+
+        answers = [self.server.FormatFlatAnswer(GetEventsAnswer(journal, post) + [('success', 'OK')]).decode('utf-8') for post in posts]
+        results['ReadServerAnswer'] = MeasureOpsPerSecond(lambda i: environment['cnn'].ReadServerAnswer(answers[i % len(answers)]), self.minSeconds)
+
+        postRecords = [postProcessor.DecodePostData(OrderedDict(GetEventsAnswer(journal, post))) for post in posts]
+        results['FlatPostDataToXmlObject'] = MeasureOpsPerSecond(lambda i: postProcessor.FlatPostDataToXmlObject(postRecords[i % len(postRecords)]), self.minSeconds)
+
+        postXmls = self.GetArchivedPostXmls(fixture, url)
+        results['PrettyPrintXml'] = MeasureOpsPerSecond(lambda i: common.PrettyPrintXml(postXmls[i % len(postXmls)], None), self.minSeconds)
+
+        markups, scraperSettings = self.GetScrapedMarkups(fixture, environment)
+        if len(markups) > 0:
+            results['ImageScraper.scrape'] = MeasureOpsPerSecond(lambda i: ImageScraper.ScrapeImages(markups[i % len(markups)], scraperSettings), self.minSeconds)
+
+        commentProcessor, firstCommentId, lastCommentId, commentsPage = self.GetCommentsPage(environment)
+        try:
+            # once the first call has put page metadata into store, calls check the page for changes, like most syncs do
+            results['GetNewOrUpdatedComments'] = MeasureOpsPerSecond(lambda i: commentProcessor.GetNewOrUpdatedComments(firstCommentId, lastCommentId, commentsPage), self.minSeconds)
+            newComments = self.GetNewCommentsOfBusiestPost(commentProcessor, commentsPage)
+            results['AddUpdateCommentsInPostXml'] = MeasureOpsPerSecond(
+                lambda i: commentProcessor.AddUpdateCommentsInPostXml(fromstring('<post><url>http://example.com/1.html</url></post>'), copy.deepcopy(newComments)), self.minSeconds)
+            results['AddUpdateCommentsInPostXml']['commentsPerOp'] = len(newComments)
+        finally:
+            commentProcessor.Close()
+
+    def GetArchivedPostXmls(self, fixture, url):
+        """Returns xml of archived posts with their comments"""
+        archivePath = os.path.join(self.rootPath, 'hotpaths')
+        postCount = min(200, len(fixture['journals'][journal]['posts']))
+        postIds = set(post['itemid'] for post in fixture['journals'][journal]['posts'][:postCount])
+        sample = {'journals': {journal: common.MergeDicts(fixture['journals'][journal],
+                                                          {'posts': fixture['journals'][journal]['posts'][:postCount],
+                                                           'comments': [comment for comment in fixture['journals'][journal]['comments'] if comment['jitemid'] in postIds]})},
+                  'profiles': fixture['profiles']}
+        WriteArchive(sample, archivePath, journal, 'Benchmark', url)
+        journalPath = os.path.join(archivePath, 'Benchmark', journal)
+        return [common.ReadXmlFileOrDefault(os.path.join(journalPath, fileName), 'post') for fileName in sorted(os.listdir(journalPath)) if fileName.endswith('.xml')]
+
+    def GetScrapedMarkups(self, fixture, environment):
+        """Downloads images of posts with images once, so that timed scraping finds all of them in image cache the way re-syncs of edited posts do"""
+        markups = [post['event'] for post in fixture['journals'][journal]['posts'] if '<img' in post['event']][:100]
+        settings = {'cnn': environment['cnn'], 'httpRequestDelaySeconds': 0, 'sectionName': environment['sectionName'], 'journal': journal,
+                    'cachedImagesXml': Element('images'), 'imagesFolder': 'images'}
+        for markup in markups:
+            for imageInfo in ImageScraper.ScrapeImages(markup, settings)['downloadedImageInfos']:
+                SubElement(settings['cachedImagesXml'], 'image', dict((k, v) for k, v in imageInfo.items() if k in ['local', 'remote', 'linkedLocal', 'linkedRemote']))
+        return markups, settings
+
+    def GetCommentsPage(self, environment):
+        """Returns comment processor with open metadata store and first page of comment bodies combined with metadata"""
+        commentProcessor = CommentProcessor(environment)
+        commentProcessor.OpenMetadataStore()
+        metadata = fromstring(self.server.GetCommentsPage(journal, 'comment_meta', 0).encode('utf-8'))
+        bodies = fromstring(self.server.GetCommentsPage(journal, 'comment_body', 0).encode('utf-8'))
+        combinationResult = commentProcessor.CombineCommentBodiesWithMetadata(bodies, metadata)
+        commentsPage = combinationResult['enrichedComments']
+        return commentProcessor, int(commentsPage[0].attrib['id']), combinationResult['maxCommentId'], commentsPage
+
+    def GetNewCommentsOfBusiestPost(self, commentProcessor, commentsPage):
+        """Returns comments of the post with most comments on page, marked as new"""
+        commentsByPostId = {}
+        for comment in commentsPage:
+            commentsByPostId.setdefault(comment.attrib['jitemid'], []).append(comment)
+        newComments = copy.deepcopy(max(commentsByPostId.itervalues(), key = len))
+        for comment in newComments:
+            comment.attrib['processingstate'] = 'new'
+        return newComments
+
+def CompareWithBaseline(results, baseline, tolerance):
+    """Compares results with baseline of the same scale. Returns comparison of every metric and list of regressions:
+        hot paths that got slower, pipeline stages that take longer or need more memory than tolerance allows"""
+    comparison = OrderedDict()
+    regressions = []
+    metrics = [('hotPaths', name, 'opsPerSecond', -1) for name in results['hotPaths']]
+    metrics += [('pipeline', name, key, 1) for name in results['pipeline'] for key in ['seconds', 'peakRssKb']]
+    metrics += [('startup', name, 'seconds', 1) for name in results.get('startup', {})]
+    for group, name, key, worseDirection in metrics:
+        baselineValue = baseline.get(group, {}).get(name, {}).get(key)
+        currentValue = results[group][name].get(key)
+        if not baselineValue or currentValue is None:
+            continue
+        change = float(currentValue) / baselineValue - 1
+        metricName = '%s.%s.%s' % (group, name, key)
+        comparison[metricName] = OrderedDict([('baseline', baselineValue), ('current', currentValue), ('change', round(change, 3))])
+        if change * worseDirection > tolerance:
+            regressions.append(u'%s changed by %+.0f%% (baseline %s, now %s)' % (metricName, change * 100, baselineValue, currentValue))
+    return comparison, regressions
+
+def ParseArguments(arguments):
+    parser = argparse.ArgumentParser(description = 'Benchmarks archiver on generated journals served by local fake server.')
+    parser.add_argument('--scale', choices = scales.keys(), default = '1k', help = '1k: 1000 posts, 10k comments; 10k: 10k posts, 100k comments; 100k: 100k posts, 1M comments')
+    parser.add_argument('--min-seconds', type = float, default = 1.0, dest = 'minSeconds', help = 'how long every hot path is timed')
+    parser.add_argument('--skip-initial-sync', action = 'store_true', dest = 'skipInitialSync',
+                        help = 'write archive of journal directly instead of syncing it from scratch, for big scales')
+    parser.add_argument('--output', help = 'file to write json results to, they are printed otherwise')
+    parser.add_argument('--baseline', help = 'json file with stored results to compare with, exit code is 1 if anything regressed')
+    parser.add_argument('--save-baseline', dest = 'saveBaseline', help = 'json file to store results in as baseline for their scale')
+    parser.add_argument('--tolerance', type = float, default = 0.25, help = 'allowed relative slowdown before a metric counts as regression')
+    return parser.parse_args(arguments)
+
+def main(arguments):
+    options = ParseArguments(arguments)
+    logger = logging.getLogger('log')
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.WARNING)
+
+    stages = ('incremental',) if options.skipInitialSync else ('initial', 'incremental')
+    results = BenchmarkRunner(scales[options.scale], options.minSeconds, stages).Run()
+    results['scale'] = options.scale
+    exitCode = 0
+    if options.baseline is not None:
+        with open(options.baseline, 'rb') as baselineFile:
+            baseline = json.load(baselineFile)
+        if options.scale in baseline:
+            results['comparison'], results['regressions'] = CompareWithBaseline(results, baseline[options.scale], options.tolerance)
+            exitCode = 1 if len(results['regressions']) > 0 else 0
+        else:
+            logger.warning(u'Baseline has no results for scale %s' % options.scale)
+
+    resultsJson = json.dumps(results, indent = 2, separators = (',', ': '))
+    if options.output is not None:
+        with open(options.output, 'wb') as outputFile:
+            outputFile.write(resultsJson)
+    else:
+        print resultsJson
+    if options.saveBaseline is not None:
+        baseline = {}
+        if os.path.exists(options.saveBaseline):
+            with open(options.saveBaseline, 'rb') as baselineFile:
+                baseline = json.load(baselineFile)
+        baseline[options.scale] = OrderedDict((key, value) for key, value in results.iteritems() if key not in ['comparison', 'regressions'])
+        with open(options.saveBaseline, 'wb') as baselineFile:
+            baselineFile.write(json.dumps(baseline, indent = 2, sort_keys = True, separators = (',', ': ')))
+    for regression in results.get('regressions', []):
+        logger.warning(u'Regression: %s' % regression)
+    return exitCode
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
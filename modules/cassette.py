@@ -0,0 +1,94 @@
+import os
+import json
+import zlib
+import struct
+import time
+import logging
+import threading
+from base64 import b64encode, b64decode
+
+import common
+
+class Cassette:
+    """Keeps HTTP responses received by Connection in a file, so that a run against a real server can be repeated offline against identical traffic.
+        File is a sequence of records: fixed-width header (request key length, payload length, latency), request key and zlib-compressed JSON payload.
+        On replay only headers and keys are read to build an index, payloads are read when their request is made"""
+
+    def __init__(self, path, mode, replayLatency = False):
+        if mode not in ['record', 'replay']:
+            raise ValueError(u'Invalid cassette mode %s, only record and replay are allowed' % mode)
+        self.path = path
+        self.mode = mode
+        self.replayLatency = replayLatency
+        self.headerStruct = struct.Struct('<IIf') # request key length, payload length, latency in seconds
+        self.file = None
+        self.index = {} # request key -> list of (payload offset, payload length, latency) in recorded order
+        self.replayedCounts = {} # request key -> number of times it was replayed
+        self.lock = threading.Lock() # journals are processed in parallel with one connection
+        self.logger = logging.getLogger('log')
+
+    def Open(self):
+        """Opens cassette file, truncating it in record mode and indexing recorded requests in replay mode"""
+        if self.mode == 'record':
+            common.CreatePathIfNotExists(self.path)
+            self.file = open(self.path, 'wb')
+        else:
+            self.file = open(self.path, 'rb')
+            self.__buildIndex()
+
+    def Close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def IsReplaying(self):
+        return self.mode == 'replay'
+
+    def GetKey(self, method, url, params):
+        """Makes request key out of request method, url and parameters. Parameters should be stripped of sensitive info,
+            this way challenge responses that change every run don't change the key"""
+        return u'%s %s %s' % (method, url, json.dumps(sorted(params.items())))
+
+    def Record(self, method, url, params, headers, body, latencySeconds, contentType = None, errorCode = None):
+        """Appends request and its response to cassette. Body is a byte string, errorCode is HTTP error code for requests that failed without retries"""
+        key = self.GetKey(method, url, params).encode('utf-8')
+        payload = zlib.compress(json.dumps({'method': method, 'url': url, 'params': params, 'headers': headers, 'contentType': contentType,
+                                            'errorCode': errorCode, 'body': None if body is None else b64encode(body)}))
+        with self.lock:
+            self.file.write(self.headerStruct.pack(len(key), len(payload), latencySeconds))
+            self.file.write(key)
+            self.file.write(payload)
+            self.file.flush()
+
+    def Replay(self, method, url, params):
+        """Returns recorded response as dictionary with keys body, contentType and errorCode or None if request wasn't recorded.
+            Same request made several times gets its responses in recorded order, and the last one once they run out"""
+        key = self.GetKey(method, url, params)
+        with self.lock:
+            if key not in self.index:
+                return None
+            records = self.index[key]
+            replayedCount = self.replayedCounts.get(key, 0)
+            self.replayedCounts[key] = replayedCount + 1
+            if replayedCount >= len(records):
+                self.logger.debug(u'All %d recorded response(s) for %s were replayed, replaying the last one again' % (len(records), key))
+            offset, length, latencySeconds = records[min(replayedCount, len(records) - 1)]
+            self.file.seek(offset)
+            payload = json.loads(zlib.decompress(self.file.read(length)))
+        if self.replayLatency:
+            time.sleep(latencySeconds)
+        return {'body': None if payload['body'] is None else b64decode(payload['body']), 'contentType': payload['contentType'], 'errorCode': payload['errorCode']}
+
+    def __buildIndex(self):
+        fileSize = os.fstat(self.file.fileno()).st_size
+        offset = 0
+        while offset + self.headerStruct.size <= fileSize:
+            self.file.seek(offset)
+            keyLength, payloadLength, latencySeconds = self.headerStruct.unpack(self.file.read(self.headerStruct.size))
+            key = self.file.read(keyLength).decode('utf-8')
+            payloadOffset = offset + self.headerStruct.size + keyLength
+            if payloadOffset + payloadLength > fileSize: # record was cut short when recording run was interrupted
+                self.logger.warning(u'Cassette %s ends with an incomplete record, ignoring it' % self.path)
+                break
+            self.index.setdefault(key, []).append((payloadOffset, payloadLength, latencySeconds))
+            offset = payloadOffset + payloadLength
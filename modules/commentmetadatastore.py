@@ -0,0 +1,134 @@
+import os
+import mmap
+import struct
+import glob
+import calendar
+import datetime
+import logging
+from binascii import hexlify, unhexlify
+
+import common
+
+class CommentMetadataStore:
+    """Keeps comment metadata (id, state, date and subject + body hash) as fixed-width binary records in a memory-mapped file.
+        Record of comment with id N lives at offset N * record size, so checking a comment for changes is a single read
+        and saving new metadata is a single in-place write, nothing is parsed or rewritten as a whole.
+        File size follows the largest comment id, not the number of comments: 25 bytes per id, grown 4096 records at a time.
+        Comment ids are numbered per journal, so it's about 25 MB for a journal with a million comments"""
+
+    def __init__(self, path, dateFormatString):
+        self.path = path
+        self.dateFormatString = dateFormatString
+        # comment id, state char, date as unsigned epoch seconds (good until 2106), md5 digest of subject + body
+        self.recordStruct = struct.Struct('<IBI16s')
+        self.emptyRecord = '\0' * self.recordStruct.size
+        self.emptyDigest = '\0' * 16
+        self.noDate = 0
+        self.defaultState = 'A'
+        self.growthStepRecords = 4096
+        self.file = None
+        self.map = None
+        self.logger = logging.getLogger('log')
+
+    def Open(self):
+        """Opens store file creating it if necessary"""
+        common.CreatePathIfNotExists(self.path)
+        if not os.path.exists(self.path):
+            open(self.path, 'wb').close()
+        self.file = open(self.path, 'r+b')
+        self.__remap(max(self.__getFileSize(), self.growthStepRecords * self.recordStruct.size))
+
+    def Close(self):
+        """Flushes changes to disk and closes store file"""
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def Flush(self):
+        if self.map is not None:
+            self.map.flush()
+
+    def Get(self, commentId):
+        """Returns metadata of comment as dictionary with keys id, state, date, subjectbodyhash or None if there's no metadata for this comment"""
+        record = self.__readRecord(commentId)
+        if record is None:
+            return None
+        storedId, state, epochSeconds, digest = self.recordStruct.unpack(record)
+        date = None if epochSeconds == self.noDate else datetime.datetime.utcfromtimestamp(epochSeconds).strftime(self.dateFormatString)
+        subjectBodyHash = '' if digest == self.emptyDigest else hexlify(digest)
+        return {'id': storedId, 'state': chr(state), 'date': date, 'subjectbodyhash': subjectBodyHash}
+
+    def Update(self, commentId, state, date, subjectBodyHash):
+        """Compares comment metadata with stored record and overwrites the record if anything changed.
+            Returns 'new' if there was no record, 'updated' if record was different and None if nothing changed"""
+        record = self.Pack(commentId, state, date, subjectBodyHash)
+        storedRecord = self.__readRecord(commentId)
+        if storedRecord == record:
+            return None
+        self.__writeRecord(commentId, record)
+        return 'new' if storedRecord is None else 'updated'
+
+    def Pack(self, commentId, state, date, subjectBodyHash):
+        """Converts comment metadata to binary record"""
+        commentId = int(commentId)
+        stateChar = ord((state or self.defaultState)[0])
+        epochSeconds = self.noDate if date is None else calendar.timegm(datetime.datetime.strptime(date, self.dateFormatString).timetuple())
+        digest = self.emptyDigest if not subjectBodyHash else unhexlify(subjectBodyHash)
+        return self.recordStruct.pack(commentId, stateChar, epochSeconds, digest)
+
+    def RemoveDeletedCommentsMetadata(self, firstId, lastId, existingCommentIds):
+        """Removes records with ids between firstId and lastId (inclusive) that are not in existingCommentIds. Returns number of removed records"""
+        recordCount = len(self.map) / self.recordStruct.size
+        storedCommentIds = dict.fromkeys(commentId for commentId in xrange(max(int(firstId), 0), min(int(lastId) + 1, recordCount))
+                                         if self.__readRecord(commentId) is not None)
+        deletedCommentIds = common.GetReconciliationDelta(storedCommentIds, dict.fromkeys(int(commentId) for commentId in existingCommentIds))['deleted']
+        for commentId in deletedCommentIds:
+            self.__writeRecord(commentId, self.emptyRecord)
+        return len(deletedCommentIds)
+
+    def ImportXmlFiles(self, filePattern):
+        """Converts per-page xml metadata files matching filePattern (cachedcommentsmetadata_N.xml) into store records and deletes the files.
+            Returns number of imported records"""
+        importedCount = 0
+        for xmlFilePath in glob.glob(filePattern):
+            xmlFile = common.ReadXmlFileOrDefault(xmlFilePath, 'comments')
+            for comment in xmlFile.iterfind('comment'):
+                self.Update(comment.attrib['id'], comment.attrib.get('state'), comment.attrib.get('date'), comment.attrib.get('subjectbodyhash'))
+                importedCount += 1
+            self.Flush()
+            os.remove(xmlFilePath)
+            self.logger.debug(u'Converted comment metadata file %s', xmlFilePath)
+        return importedCount
+
+    def __readRecord(self, commentId):
+        offset = int(commentId) * self.recordStruct.size
+        if offset + self.recordStruct.size > len(self.map):
+            return None
+        record = self.map[offset:offset + self.recordStruct.size]
+        return None if record == self.emptyRecord else record
+
+    def __writeRecord(self, commentId, record):
+        offset = int(commentId) * self.recordStruct.size
+        if offset + self.recordStruct.size > len(self.map):
+            neededRecords = int(commentId) + 1
+            self.__remap((neededRecords / self.growthStepRecords + 1) * self.growthStepRecords * self.recordStruct.size)
+        self.map[offset:offset + self.recordStruct.size] = record
+
+    def __remap(self, size):
+        """(Re)creates memory map of store file, extending the file with empty records up to size bytes"""
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.map = None
+        if self.__getFileSize() < size:
+            self.file.seek(0, os.SEEK_END)
+            self.file.write('\0' * (size - self.__getFileSize()))
+            self.file.flush()
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+    def __getFileSize(self):
+        return os.path.getsize(self.path)
@@ -3,61 +3,157 @@ import time
 import os
 import re
 import datetime
-from xml.etree.ElementTree import SubElement, tostring, fromstring
-from itertools import takewhile
+from xml.etree.ElementTree import Element, SubElement, tostring, fromstring
+from bisect import bisect_left
+from collections import OrderedDict
 
 import common
+from commentmetadatastore import CommentMetadataStore
+from metrics import JournalMetrics
 
 class CommentProcessor:
     def __init__(self, environment):
         self.e = common.DotDict(environment)
         self.cachedUserIdsFileName = 'cacheduserids.xml'
         self.extUserRealNameRegex = re.compile('<title>([^<]+)</title>', re.I | re.M)
-        self.maxCommentBodiesOnPage = 1000
         self.commentDateFormatString = '%Y-%m-%dT%H:%M:%SZ' # comment dates are returned as yyyy-mm-ddThh:mm:ssZ
-        self.cachedEnrichedCommentsMetadataFileName = 'cachedcommentsmetadata_%d.xml'
+        self.cachedEnrichedCommentsMetadataFileName = 'cachedcommentsmetadata.dat'
+        self.legacyCachedEnrichedCommentsMetadataFilePattern = 'cachedcommentsmetadata_*.xml' # per-page xml files used before the binary store
+        self.metadataStore = None
+        self.sessionToken = None
+        self.sessionTokenDate = None
+        self.sessionTokenMaxAge = datetime.timedelta(hours = 12) # 'short' session lives for 24 hours
+        self.lastMaxCommentId = None
+        self.lastFullPassDate = None
+        self.checkpointFileName = 'commentscheckpoint.dat'
+        self.metrics = self.e.metrics if self.e.metrics is not None else JournalMetrics(self.e.sectionName, self.e.journal)
         self.logger = logging.getLogger('log')
         
-    def ProcessComments(self):
-        sessionToken = None
+    def ProcessComments(self, keepWarm = False):
+        """Archives new and changed comments. With keepWarm session token and metadata store stay open for the next call,
+            which only polls comments added after the last seen one unless full pass is due (see IsFullCommentPassDue).
+            Progress is checkpointed after every page, so interrupted sync resumes from the page it stopped on"""
         connParams = {'server': self.e.server, 'user': self.e.journal, 'pwdhash': self.e.passwordHash }
+        succeeded = False
+        isInterrupted = False
         try:
-            self.logger.info(u'%s: %s: getting session token for comments...' % (self.e.sectionName, self.e.journal))
-            sessionToken = self.e.cnn.GetSessionToken(connParams)
-            
-            self.logger.info(u'%s: %s: getting comments metadata...' % (self.e.sectionName, self.e.journal))
-            metadata = self.GetCommentsInfo(sessionToken, 'META', 0)
-            maxIdNode = metadata.find('maxid')
-            maxId = 0 if maxIdNode is None else int(maxIdNode.text)
-            if maxId > 0:
+            sessionToken = self.GetSessionToken(connParams)
+            if self.metadataStore is None:
+                self.OpenMetadataStore()
+
+            checkpointStartId = self.GetCommentsCheckpoint()
+            isFullPass = checkpointStartId is None and (not keepWarm or self.IsFullCommentPassDue())
+            if checkpointStartId is not None:
+                self.logger.info(u'%s: %s: resuming interrupted comment sync from comment id = %d' % (self.e.sectionName, self.e.journal, checkpointStartId))
+                metadataStartId = checkpointStartId
+            else:
+                metadataStartId = 0 if isFullPass else self.lastMaxCommentId + 1
+            self.logger.info(u'%s: %s: getting comments metadata starting with comment id = %d...' % (self.e.sectionName, self.e.journal, metadataStartId))
+            with self.metrics.Measure('stage.commentsMetadata', {'startId': metadataStartId}):
+                metadataInfo = self.GetCommentsMetadata(sessionToken, metadataStartId)
+            metadata = metadataInfo['metadata']
+            maxId = metadataInfo['maxId']
+            startId = metadataInfo['minId'] # useful if comment enumeration does not start with 1
+            if maxId > 0 and startId is not None:
                 # merge current user metadata with cached user metadata
+                # metadata read not from the very first comment has only the users of its own comments, so don't remove cached users missing in it
                 currentUsermaps = metadata.find('usermaps')
-                mergedUsermaps = self.MergeUserIdsMapXmlWithCache(metadata.find('usermaps'))
+                mergedUsermaps = self.MergeUserIdsMapXmlWithCache(currentUsermaps, isFullPass)
                 metadata.remove(currentUsermaps)
                 metadata.append(mergedUsermaps)
 
-                #get min comment id (useful if comment enumeration does not start with 1)
-                minIdKey = lambda cmt: int(cmt.attrib['id'])
-                minIdElement = min(metadata.findall('comments/comment'), key = minIdKey)
-                startId = int(minIdElement.attrib['id'])
-
                 self.logger.info(u'%s: %s: found %d comments, enumeration starts with %d and ends with %d' %
-                            (self.e.sectionName, self.e.journal, len(metadata.findall('comments/comment')), startId, maxId))
-                
-                #remove comments metadata (it's utterly useless, no need to waste memory on it)
-                metadata.remove(metadata.find('comments'))
+                            (self.e.sectionName, self.e.journal, metadataInfo['count'], startId, maxId))
 
-                while startId < maxId:
-                    time.sleep(self.e.delay) # sleeping so that we're not making calls too often
-                    maxCommentIdOnPage = self.ProcessCommentsPage(sessionToken, startId, metadata)
+                while startId <= maxId:
+                    if common.IsDeadlineNear(self.e.deadline):
+                        self.logger.info(u'%s: %s: run time is almost over, comments with ids from %d to %d are left for next run' % (self.e.sectionName, self.e.journal, startId, maxId))
+                        self.SaveCommentsCheckpoint(startId)
+                        isInterrupted = True
+                        break
+                    with self.metrics.Measure('sleep'):
+                        time.sleep(self.e.delay) # sleeping so that we're not making calls too often
+                    with self.metrics.Measure('stage.commentsPage', {'startId': startId}):
+                        maxCommentIdOnPage = self.ProcessCommentsPage(sessionToken, startId, metadata)
+                    if maxCommentIdOnPage < startId: # no bodies on page, nothing more to get
+                        break
                     startId = maxCommentIdOnPage + 1
-            else:
+                    self.SaveCommentsCheckpoint(startId) # page is committed, next run can start from the next one if this one gets interrupted
+            elif isFullPass:
                 self.logger.info(u'%s: %s: journal has no comments' % (self.e.sectionName, self.e.journal))
+            else:
+                self.logger.info(u'%s: %s: no new comments' % (self.e.sectionName, self.e.journal))
+            if not isInterrupted:
+                self.RemoveCommentsCheckpoint()
+                self.lastMaxCommentId = max(maxId, self.lastMaxCommentId or 0)
+                if isFullPass:
+                    self.lastFullPassDate = datetime.datetime.now()
+            succeeded = True
         finally:
+            if not keepWarm:
+                self.Close()
+            elif not succeeded: # session may be what went wrong, get a fresh one next time
+                self.ExpireSessionToken(connParams)
+
+    def Close(self):
+        """Closes metadata store and expires session token kept by ProcessComments"""
+        if self.metadataStore is not None:
+            self.metadataStore.Close()
+            self.metadataStore = None
+        self.ExpireSessionToken({'server': self.e.server, 'user': self.e.journal, 'pwdhash': self.e.passwordHash })
+
+    def GetSessionToken(self, connParams):
+        """Returns session token kept from previous call if it's not too old, gets a new one otherwise"""
+        if self.sessionToken is not None and datetime.datetime.now() - self.sessionTokenDate < self.sessionTokenMaxAge:
+            return self.sessionToken
+        self.ExpireSessionToken(connParams)
+        self.logger.info(u'%s: %s: getting session token for comments...' % (self.e.sectionName, self.e.journal))
+        self.sessionToken = self.e.cnn.GetSessionToken(connParams)
+        self.sessionTokenDate = datetime.datetime.now()
+        return self.sessionToken
+
+    def ExpireSessionToken(self, connParams):
+        if self.sessionToken is not None:
+            sessionToken = self.sessionToken
+            self.sessionToken = None
             self.logger.info(u'%s: %s: expiring created session token...' % (self.e.sectionName, self.e.journal))
             self.e.cnn.ExpireSession(connParams, sessionToken)
             self.logger.info(u'%s: %s: session token expired successfully' % (self.e.sectionName, self.e.journal))
-			
+
+    def IsFullCommentPassDue(self):
+        """Comment metadata is read from the very first comment if we haven't done it in this process yet or if fullSyncIntervalDays passed since we did,
+            otherwise only comments after the last seen one are read. Full pass is what finds edited, screened and deleted old comments"""
+        if self.lastMaxCommentId is None or self.lastFullPassDate is None:
+            return True
+        return datetime.datetime.now() - self.lastFullPassDate >= datetime.timedelta(days = self.e.fullSyncIntervalDays or 0)
+
+    def GetCommentsCheckpoint(self):
+        """Returns comment id to resume interrupted comment sync from or None if previous sync was completed"""
+        path = os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal, self.e.cachedDataFolder, self.checkpointFileName)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as checkpointFile:
+            checkpoint = checkpointFile.readline().strip()
+            return int(checkpoint) if checkpoint.isdigit() else None
+
+    def SaveCommentsCheckpoint(self, nextStartId):
+        path = os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal, self.e.cachedDataFolder, self.checkpointFileName)
+        common.WriteFileAtomically(path, str(nextStartId))
+
+    def RemoveCommentsCheckpoint(self):
+        path = os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal, self.e.cachedDataFolder, self.checkpointFileName)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def OpenMetadataStore(self):
+        """Opens binary comment metadata store, converting cached per-page xml metadata files into it if there are any left from older versions"""
+        cachedDataPath = os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal, self.e.cachedDataFolder)
+        self.metadataStore = CommentMetadataStore(os.path.join(cachedDataPath, self.cachedEnrichedCommentsMetadataFileName), self.e.dateFormatString)
+        self.metadataStore.Open()
+        importedCount = self.metadataStore.ImportXmlFiles(os.path.join(cachedDataPath, self.legacyCachedEnrichedCommentsMetadataFilePattern))
+        if importedCount > 0:
+            self.logger.info(u'%s: %s: converted %d cached comment metadata piece(s) to binary store' % (self.e.sectionName, self.e.journal, importedCount))
+
     def GetCommentsInfo(self, sessionToken, infoType, startId):
         """Gets comment metadata or bodies in xml format"""
         getInfoType = None
@@ -71,97 +167,139 @@ class CommentProcessor:
         params = {'get': getInfoType, 'startid': startId }
         headers = {'Cookie': 'ljsession=%s' % sessionToken }  
         xmlResult = self.e.cnn.MakeRequest(exportCommentsPage, params, headers, 'GET')
-        return fromstring(xmlResult.encode('utf-8'))
+        with self.metrics.Measure('parse.comments'):
+            return fromstring(xmlResult.encode('utf-8'))
+
 
+    def GetCommentsMetadata(self, sessionToken, startId):
+        """Gets comment metadata page by page starting with startId and following nextid until the server has no more pages.
+        Comment metadata itself is not kept, only usermaps are merged into one node, so memory use does not grow with comment count.
+        Returns dictionary with metadata xml (maxid and usermaps), min and max comment ids and comment count"""
+        metadata = Element('livejournal')
+        maxIdNode = SubElement(metadata, 'maxid')
+        usermapsNode = SubElement(metadata, 'usermaps')
+        knownUserIds = set()
+        minId = None
+        maxId = 0
+        count = 0
+        pageStartId = startId
+        while pageStartId is not None:
+            page = self.GetCommentsInfo(sessionToken, 'META', pageStartId)
+            pageMaxId = int(common.ReadXmlNodeOrDefault(page, 'maxid', 0))
+            maxId = pageMaxId if pageMaxId > maxId else maxId
+            for comment in page.iterfind('comments/comment'):
+                commentId = int(comment.attrib['id'])
+                minId = commentId if minId is None or commentId < minId else minId
+                count += 1
+            for usermap in page.iterfind('usermaps/usermap'):
+                if usermap.attrib['id'] not in knownUserIds:
+                    knownUserIds.add(usermap.attrib['id'])
+                    usermapsNode.append(usermap)
 
-    def MergeUserIdsMapXmlWithCache(self, userIdsMapXml):
+            nextId = common.ReadXmlNodeOrDefault(page, 'nextid', None)
+            if nextId is not None and int(nextId) > pageStartId:
+                pageStartId = int(nextId)
+                self.logger.info(u'%s: %s: getting comments metadata starting with comment id = %d', self.e.sectionName, self.e.journal, pageStartId)
+                with self.metrics.Measure('sleep'):
+                    time.sleep(self.e.delay)
+            else:
+                pageStartId = None
+        maxIdNode.text = str(maxId)
+        return {'metadata': metadata, 'minId': minId, 'maxId': maxId, 'count': count}
+
+    def MergeUserIdsMapXmlWithCache(self, userIdsMapXml, removeMissingUsers = True):
         path = os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal, self.e.cachedDataFolder, self.cachedUserIdsFileName)
         previouslyCachedIdsXml = common.ReadXmlFileOrDefault(path, 'usermaps')
         needCacheSaving = False
 
-        if len(previouslyCachedIdsXml) > 0: # we have some cached ids, let's check if we need to delete any users
-            previouslyCachedIds = list(previouslyCachedIdsXml)
-            for previouslyCachedId in previouslyCachedIds:
-                if userIdsMapXml.find('usermap[@id="%s"]' % previouslyCachedId.attrib['id']) is None: # didn't find anything like cached id in fresh user metadata
-                    previouslyCachedIdsXml.remove(previouslyCachedId)
-                    needCacheSaving = True
-        
-        if len(userIdsMapXml) > 0: # usermap has children
-            usermaps = list(userIdsMapXml) # get children
-            for usermap in usermaps:
-                if previouslyCachedIdsXml.find('usermap[@id="%s"]' % usermap.attrib['id']) is None: # didn't find anything cached with current id
-                    if usermap.attrib['user'].startswith('ext_'): # go and find real user name
-                        try:
-                            time.sleep(self.e.delay)
-                            profilePage = self.e.cnn.MakeRequest('%s/profile' % self.e.server, {'userid': usermap.attrib['id'], 't': 'I'}, type = 'GET')
-                            pageTitleMatches = self.extUserRealNameRegex.search(profilePage)
-                            if pageTitleMatches:
-                                title = pageTitleMatches.group(1)
-                                # finding last '-' in string, taking everything before it and trimming the result
-                                # if there's no '-', taking the whole string
-                                endPos = title.rfind('-')
-                                if endPos == -1:
-                                    endPos = len(title)
-                                usermap.attrib['real_name'] = title[0:endPos].strip()
-                            else:
-                                self.logger.warning(u'Got profile page of OpenID user %s but couldn\'t find its title to extract user\'s "real" name from it' % usermap.attrib['user'])
-                        except Exception as e:
-                            # if getting "real" name of ext_12345 user fails, log it but don't stop
-                            self.logger.warning(u'Couldn\'t get profile page of OpenID user %s' % usermap.attrib['user'], exc_info = True)
-                        
-                    previouslyCachedIdsXml.append(usermap)
-                    needCacheSaving = True
+        previouslyCachedUsermaps = OrderedDict((usermap.attrib['id'], usermap) for usermap in previouslyCachedIdsXml)
+        currentUsermaps = OrderedDict((usermap.attrib['id'], usermap) for usermap in userIdsMapXml)
+        usermapsDelta = common.GetReconciliationDelta(dict.fromkeys(previouslyCachedUsermaps), dict.fromkeys(currentUsermaps))
+
+        # remove cached users that are not in fresh user metadata anymore
+        if removeMissingUsers and len(usermapsDelta['deleted']) > 0:
+            common.RemoveChildren(previouslyCachedIdsXml, [previouslyCachedUsermaps[deletedUserId] for deletedUserId in usermapsDelta['deleted']])
+            needCacheSaving = True
+
+        # add users that are not cached yet
+        for addedUserId in usermapsDelta['added']:
+            usermap = currentUsermaps[addedUserId]
+            if usermap.attrib['user'].startswith('ext_'): # go and find real user name
+                try:
+                    with self.metrics.Measure('sleep'):
+                        time.sleep(self.e.delay)
+                    profilePage = self.e.cnn.MakeRequest('%s/profile' % self.e.server, {'userid': usermap.attrib['id'], 't': 'I'}, type = 'GET')
+                    pageTitleMatches = self.extUserRealNameRegex.search(profilePage)
+                    if pageTitleMatches:
+                        title = pageTitleMatches.group(1)
+                        # finding last '-' in string, taking everything before it and trimming the result
+                        # if there's no '-', taking the whole string
+                        endPos = title.rfind('-')
+                        if endPos == -1:
+                            endPos = len(title)
+                        usermap.attrib['real_name'] = title[0:endPos].strip()
+                    else:
+                        self.logger.warning(u'Got profile page of OpenID user %s but couldn\'t find its title to extract user\'s "real" name from it', usermap.attrib['user'])
+                except Exception as e:
+                    # if getting "real" name of ext_12345 user fails, log it but don't stop
+                    self.logger.warning(u'Couldn\'t get profile page of OpenID user %s', usermap.attrib['user'], exc_info = True)
+                
+            previouslyCachedIdsXml.append(usermap)
+            needCacheSaving = True
                     
         if needCacheSaving:     
             common.CreatePathIfNotExists(path)
-            with open(path, "w") as cachedIdsFile:
+            with self.metrics.Measure('write.userIds'), open(path, "w") as cachedIdsFile:
                 cachedIdsFile.write(tostring(previouslyCachedIdsXml, 'utf-8').encode('utf-8'))
         return previouslyCachedIdsXml
 
     def ProcessCommentsPage(self, sessionToken, startId, commentsMetadata):
-        self.logger.info(u'%s: %s: getting comment bodies starting with comment id = %d' % (self.e.sectionName, self.e.journal, startId))
+        self.logger.info(u'%s: %s: getting comment bodies starting with comment id = %d', self.e.sectionName, self.e.journal, startId)
         bodies = self.GetCommentsInfo(sessionToken, 'BODY', startId)
         combinationResult = self.CombineCommentBodiesWithMetadata(bodies, commentsMetadata)
-        exportPageNumber = int(startId / self.maxCommentBodiesOnPage)
-            
-        newOrUpdatedComments = self.GetNewOrUpdatedComments(exportPageNumber, combinationResult['enrichedComments'])
+
+        newOrUpdatedComments = self.GetNewOrUpdatedComments(startId, combinationResult['maxCommentId'], combinationResult['enrichedComments'])
         commentsByPostId = {}
         for comment in newOrUpdatedComments:
             postId = comment.attrib['jitemid']
             if postId not in commentsByPostId:
                 commentsByPostId[postId] = []
             commentsByPostId[postId].append(comment)
-        self.logger.info(u'%s: %s: found %d new or updated comments for %d posts on page #%d' %
-                    (self.e.sectionName, self.e.journal, len(newOrUpdatedComments), len(commentsByPostId), exportPageNumber))
+        self.logger.info(u'%s: %s: found %d new or updated comments for %d posts on page starting with comment id = %d',
+                    self.e.sectionName, self.e.journal, len(newOrUpdatedComments), len(commentsByPostId), startId)
+        self.metrics.Increment('commentsNewOrUpdated', len(newOrUpdatedComments))
 
         if len(commentsByPostId) > 0:
             cwd = common.GetUpperLevelDir()
             cachedPostIdsPath = os.path.join(cwd, self.e.sectionName, self.e.journal, self.e.cachedDataFolder, self.e.cachedPostIdsFile)
-            cachedPostIds = common.ReadXmlFileOrDefault(cachedPostIdsPath, 'posts')
-            if len(list(cachedPostIds)) > 0: # we have any cached post ids
+            publicIdsByPostId = dict((cachedPostIdItem.attrib['dbid'], cachedPostIdItem.attrib['publicid']) for cachedPostIdItem in common.ReadXmlFileOrDefault(cachedPostIdsPath, 'posts'))
+            if len(publicIdsByPostId) > 0: # we have any cached post ids
                 for postId in commentsByPostId:
-                    cachedPostIdItem = cachedPostIds.find('post[@dbid="%s"]' % postId)
-                    if cachedPostIdItem is not None:
-                        postFilePath = os.path.join(cwd, self.e.sectionName, self.e.journal, '%s.xml' % cachedPostIdItem.attrib['publicid'])
+                    publicId = publicIdsByPostId.get(postId)
+                    if publicId is not None:
+                        postFilePath = os.path.join(cwd, self.e.sectionName, self.e.journal, '%s.xml' % publicId)
                         doNotProcessTag = 'DoNotProcess' # if we end up having a document with this tag, it means we didn't open the actual file and have nowhere to write comments. Don't raise error because it's comments, but don't process further
-                        postXml = common.ReadXmlFileOrDefault(postFilePath, doNotProcessTag)
+                        with self.metrics.Measure('parse.postFile'):
+                            postXml = common.ReadXmlFileOrDefault(postFilePath, doNotProcessTag)
                         if postXml.tag != doNotProcessTag:
-                            self.AddUpdateCommentsInPostXml(postXml, commentsByPostId[postId])
-                            with open(postFilePath, "w") as postFile:
-                                xsltFile = self.e.xsltFile if self.e.applyXSLT else None
+                            with self.metrics.Measure('merge.comments'):
+                                self.AddUpdateCommentsInPostXml(postXml, commentsByPostId[postId])
+                            xsltFile = self.e.xsltFile if self.e.applyXSLT else None
+                            with self.metrics.Measure('serialize.post'):
                                 postXmlString = common.PrettyPrintXml(postXml, xsltFile)
+                            with self.metrics.Measure('write.post'), open(postFilePath, "w") as postFile:
                                 postFile.write(postXmlString.encode('utf-8'))
                         else:
-                            self.logger.debug(u'%s: %s: couldn\'t find file %s.xml required by comment chain attached to post dbId = %s' %
-                                      (self.e.sectionName, self.e.journal, cachedPostIdItem.attrib['publicid'], postId))
+                            self.logger.debug(u'%s: %s: couldn\'t find file %s.xml required by comment chain attached to post dbId = %s',
+                                              self.e.sectionName, self.e.journal, publicId, postId)
         return combinationResult['maxCommentId']
     
 
     def CombineCommentBodiesWithMetadata(self, bodies, metadata):
         metadataCommentsNode = metadata.find('comments')
         
-        #get user mappings
-        metadataUsermapsNode = metadata.find('usermaps')
+        #get user mappings by user id, so that finding poster of a comment doesn't search all of them
+        usermapsById = dict((usermap.attrib['id'], usermap) for usermap in metadata.iterfind('usermaps/usermap'))
 
         #while we're cycling through the list of comments, let's find max comment id for further processing
         maxCommentId = 0
@@ -172,7 +310,7 @@ class CommentProcessor:
         for commentBody in commentBodies:
             if commentBody.attrib['jitemid'] != '0': # export mechanism sometimes fails to properly attach comments to posts, we won't process anything that has post id equal to 0
                 # match poster id with poster name
-                userNode = metadataUsermapsNode.find('usermap[@id="%s"]' % commentBody.attrib['posterid'])
+                userNode = usermapsById.get(commentBody.attrib['posterid'])
                 commentBody.attrib['poster_name'] = userNode.attrib['real_name'] if 'real_name' in userNode.attrib else userNode.attrib['user']
                 if userNode.attrib['user'].startswith('ext_'):
                     commentBody.attrib['poster_url'] = common.CreateAuthorExtUrl(self.e.server, userNode.attrib['id'])
@@ -191,107 +329,85 @@ class CommentProcessor:
         return {'maxCommentId': maxCommentId, 'enrichedComments': enrichedComments}
 
 
-    def GetNewOrUpdatedComments(self, pageNumber, commentBodies):
+    def GetNewOrUpdatedComments(self, firstCommentId, lastCommentId, commentBodies):
+        """Checks comments from page with ids between firstCommentId and lastCommentId against metadata store and returns the ones that are new or were changed"""
         newOrUpdatedComments = []
         if len(commentBodies) > 0:
-            path = os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal, self.e.cachedDataFolder, self.cachedEnrichedCommentsMetadataFileName % pageNumber)
-            enrichedCommentsMetadataXml = common.ReadXmlFileOrDefault(path, 'comments')
-
             # first check if we have any metadata to remove on the current page
             existingCommentIds = [elem.attrib['id'] for elem in commentBodies]
-            removedCommentMetadataCount = self.RemoveDeletedCommentsMetadata(enrichedCommentsMetadataXml, existingCommentIds)
-            self.logger.info(u'%s: %s: found %d comment metadata piece(s) to remove on page #%d' % (self.e.sectionName, self.e.journal, removedCommentMetadataCount, pageNumber))
-            
+            removedCommentMetadataCount = self.metadataStore.RemoveDeletedCommentsMetadata(firstCommentId, lastCommentId, existingCommentIds)
+            self.logger.info(u'%s: %s: found %d comment metadata piece(s) to remove on page starting with comment id = %d', self.e.sectionName, self.e.journal, removedCommentMetadataCount, firstCommentId)
+
             for commentBody in commentBodies:
-                commentId = commentBody.attrib['id']
                 commentState = commentBody.attrib['state'] if 'state' in commentBody.attrib else 'A' # it's python's ternary operator. If comment has state, so be it, else assign 'A'(ctive)
                 commentDate = common.ReadXmlNodeOrDefault(commentBody, 'date', None)
                 commentSubjectAndText = '%s%s' % (common.ReadXmlNodeOrDefault(commentBody, 'subject', ''), common.ReadXmlNodeOrDefault(commentBody, 'body', ''))
                 subjectBodyHash = common.MD5(commentSubjectAndText) if commentSubjectAndText != '' else ''
-                    
-                commentFromMetadata = enrichedCommentsMetadataXml.find('comment[@id="%s"]' % commentId)
-                if commentFromMetadata is None: # didn't find anything cached with current comment id
-                    commentBody.attrib['processingstate'] = 'new'
-                    newOrUpdatedComments.append(commentBody) # add comment to new comments list
-                    newCommentMetadata = SubElement(enrichedCommentsMetadataXml, 'comment') # create new comment metadata entry
-                    newCommentMetadata.attrib['id'] = commentId
-                    newCommentMetadata.attrib['state'] = commentState
-                    self.WriteNodeAttribIfNotDefault(newCommentMetadata, 'date', commentDate, None)
-                    self.WriteNodeAttribIfNotDefault(newCommentMetadata, 'subjectbodyhash', subjectBodyHash, '')
+
+                processingState = self.metadataStore.Update(commentBody.attrib['id'], commentState, commentDate, subjectBodyHash) # 'new', 'updated' or None if nothing changed
+                if processingState is not None:
+                    commentBody.attrib['processingstate'] = processingState
+                    newOrUpdatedComments.append(commentBody)
+                    self.metrics.Increment('commentMetadataMisses')
                 else:
-                    commentFromMetadataState = commentFromMetadata.attrib['state'] if 'state' in commentFromMetadata.attrib else 'A'
-                    commentFromMetadataDate = commentFromMetadata.attrib['date'] if 'date' in commentFromMetadata.attrib else None
-                    commentFromMetadataSubjectBodyHash = commentFromMetadata.attrib['subjectbodyhash'] if 'subjectbodyhash' in commentFromMetadata.attrib else ''
-                    if commentFromMetadataDate != commentDate or commentFromMetadataState != commentState or commentFromMetadataSubjectBodyHash != subjectBodyHash: # date or state or body or subject changed
-                        commentBody.attrib['processingstate'] = 'updated'
-                        newOrUpdatedComments.append(commentBody) # add comment to updated comments list
-                        commentFromMetadata.attrib['state'] = commentState
-                        self.WriteNodeAttribIfNotDefault(commentFromMetadata, 'date', commentDate, None)
-                        self.WriteNodeAttribIfNotDefault(commentFromMetadata, 'subjectbodyhash', subjectBodyHash, '')
-                                            
-            # write updated data back to file            
-            common.CreatePathIfNotExists(path)
-            with open(path, "w") as cachedEnrichedCommentsMetadataFile:
-                cachedEnrichedCommentsMetadataFile.write(tostring(enrichedCommentsMetadataXml, 'utf-8').encode('utf-8'))
+                    self.metrics.Increment('commentMetadataHits')
+
+            # write updated data to disk
+            self.metadataStore.Flush()
         # return new and updated comments
         return newOrUpdatedComments
-		
-    def RemoveDeletedCommentsMetadata(self, cachedCommentsMetadataXml, existingCommentIds):
-        removedCommentMetadataCount = 0
-        if len(cachedCommentsMetadataXml) > 0: # we have some cached comments metadata, let's see if we need to delete anything
-            enrichedCommentsMetadata = list(cachedCommentsMetadataXml)
-            for cachedCM in enrichedCommentsMetadata:
-                if cachedCM.attrib['id'] not in existingCommentIds:
-                    cachedCommentsMetadataXml.remove(cachedCM)
-                    removedCommentMetadataCount += 1
-        return removedCommentMetadataCount
 
 
     def AddUpdateCommentsInPostXml(self, postXml, newOrUpdatedComments):
         commentsNode = postXml.find('comments')
         if commentsNode is None:
             commentsNode = SubElement(postXml, 'comments')
-        parent_map = {c: p for p in commentsNode.getiterator() for c in p} # searches for parent nodes
-            
+        # index comments of the post once, so that finding a parent or an updated comment doesn't search the whole comment tree every time
+        commentsById = {}
+        parentMap = {} # comment -> comments node it belongs to
+        for sameLevelCommentsNode in commentsNode.iter('comments'):
+            for existingComment in sameLevelCommentsNode.iterfind('comment'):
+                commentsById[existingComment.attrib['id']] = existingComment
+                parentMap[existingComment] = sameLevelCommentsNode
+        commentIdsByNode = {} # comments node -> ids of its comments in document order, made when the node is first needed
+
+        def GetSameLevelCommentIds(sameLevelCommentsNode):
+            if sameLevelCommentsNode not in commentIdsByNode:
+                commentIdsByNode[sameLevelCommentsNode] = [int(sameLevelComment.attrib['id']) for sameLevelComment in sameLevelCommentsNode.iterfind('comment')]
+            return commentIdsByNode[sameLevelCommentsNode]
+
         for comment in newOrUpdatedComments:
             if comment.attrib['processingstate'] == 'new':
                 if 'parentid' not in comment.attrib: # top-level comment
-                    indexToInsertAt = self.GetCommentIndexToInsertAt(comment, list(commentsNode))
-                    commentsNode.insert(indexToInsertAt, comment)
+                    sameLevelCommentsNode = commentsNode
                 else:
-                    # recursively search comments
-                    parentComment = commentsNode.find('.//comment[@id="%s"]' % comment.attrib['parentid'])
+                    parentComment = commentsById.get(comment.attrib['parentid'])
                     if parentComment is None:
                         raise RuntimeError(u'Found no parent comment for comment with id = %s and parentid = %s in post with url = %s' % (comment.attrib['id'], comment.attrib['parentid'], postXml.find('url').text))
-                    childCommentsNode = parentComment.find('comments')
-                    if childCommentsNode is None:
-                        childCommentsNode = SubElement(parentComment, 'comments')
-                    indexToInsertAt = self.GetCommentIndexToInsertAt(comment, childCommentsNode.findall('comment'))
-                    childCommentsNode.insert(indexToInsertAt, comment)
+                    sameLevelCommentsNode = parentComment.find('comments')
+                    if sameLevelCommentsNode is None:
+                        sameLevelCommentsNode = SubElement(parentComment, 'comments')
+                sameLevelCommentIds = GetSameLevelCommentIds(sameLevelCommentsNode)
+                indexToInsertAt = self.GetCommentIndexToInsertAt(comment, sameLevelCommentIds)
+                sameLevelCommentsNode.insert(indexToInsertAt, comment)
+                sameLevelCommentIds.insert(indexToInsertAt, int(comment.attrib['id']))
             else: # processingstate == 'updated'
-                existingComment = commentsNode.find('.//comment[@id="%s"]' % comment.attrib['id'])
+                existingComment = commentsById.get(comment.attrib['id'])
                 if existingComment is None:
                     raise RuntimeError(u'Found no comment with id = %s to update in post with url = %s' % (comment.attrib['id'], postXml.find('url').text))
                 # we will never have a situation where a comment having child comments is updated (it's prohibited in LJ), 
                 #so we won't care about keeping child comments of the edited comment
-                existingCommentIndex = list(parent_map[existingComment]).index(existingComment)
-                existingCommentParent = parent_map[existingComment]
-                existingCommentParent.insert(existingCommentIndex, comment)
-                existingCommentParent.remove(existingComment)
-                            
+                sameLevelCommentsNode = parentMap[existingComment]
+                existingCommentIndex = self.GetCommentIndexToInsertAt(comment, GetSameLevelCommentIds(sameLevelCommentsNode))
+                if existingCommentIndex >= len(sameLevelCommentsNode) or sameLevelCommentsNode[existingCommentIndex] is not existingComment:
+                    existingCommentIndex = list(sameLevelCommentsNode).index(existingComment) # comments are out of id order somehow
+                sameLevelCommentsNode[existingCommentIndex] = comment
+            commentsById[comment.attrib['id']] = comment
+            parentMap[comment] = sameLevelCommentsNode
             comment.attrib.pop('processingstate', None) #deleting the temporary processing key
 
-    def GetCommentIndexToInsertAt(self, comment, sameLevelComments):
+    def GetCommentIndexToInsertAt(self, comment, sameLevelCommentIds):
         """Gets index at which to insert new comment under its parent node. The order is determined by comment id: the greater the id, the newer the comment ->
-		old comments go to the top, new comments go to the bottom"""
-        commentId = int(comment.attrib['id'])
-        idLessThanCommentId = lambda cmt: int(cmt.attrib['id']) < commentId
-        #takewhile takes elements until the first False in lambda, so if there were 3 comments with ids 1, 2, 4, and we have one that has id = 3, len(list(takewhile))) will return 2 as index to insert comment with id = 3
-        return len(list(takewhile(idLessThanCommentId, sameLevelComments)))
-		
-    def WriteNodeAttribIfNotDefault(self, node, attribName, attribValue, attribValueDefault):
-        """Write attribute with given name to given node if provided attribute value is not default, else remove the attribute"""
-        if attribValue != attribValueDefault:
-            node.attrib[attribName] = attribValue
-        else:
-            node.attrib.pop(attribName, None)
\ No newline at end of file
+		old comments go to the top, new comments go to the bottom. sameLevelCommentIds are ids of comments under the parent node in ascending order"""
+        #if there were 3 comments with ids 1, 2, 4, and we have one that has id = 3, bisect_left returns 2 as index to insert comment with id = 3
+        return bisect_left(sameLevelCommentIds, int(comment.attrib['id']))
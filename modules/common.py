@@ -1,5 +1,6 @@
 import re
 from hashlib import md5
+import shutil
 from xml.etree.ElementTree import tostring, fromstring, Element, SubElement, ParseError
 from xml.dom.minidom import parseString
 import os
@@ -7,6 +8,8 @@ import urllib
 from urlparse import urlparse
 import glob
 import logging
+import datetime
+import time
 
 def MergeDicts(a, b):
     """Merges two dictionaries and returns result"""
@@ -68,6 +71,28 @@ def CreatePathIfNotExists(path):
         logger = logging.getLogger('log')
         logger.debug(u'Created missing directories for path %s' % path)
 		
+def WriteFileAtomically(path, content):
+    """Writes content to a temporary file next to path and then renames it to path, so that interrupted write never leaves half-written file behind"""
+    CreatePathIfNotExists(path)
+    temporaryPath = u'%s.tmp' % path
+    with open(temporaryPath, 'wb') as temporaryFile:
+        temporaryFile.write(content)
+        temporaryFile.flush()
+        os.fsync(temporaryFile.fileno())
+    if os.name == 'nt' and os.path.exists(path): # rename can't overwrite files on Windows
+        os.remove(path)
+    os.rename(temporaryPath, path)
+
+def RemoveChildren(parent, children):
+    """Removes children from parent element in one pass. Element.remove looks through all children for every removed one, which is quadratic for many removals"""
+    childIdsToRemove = set(id(child) for child in children)
+    if len(childIdsToRemove) > 0:
+        parent[:] = [child for child in parent if id(child) not in childIdsToRemove]
+
+def IsDeadlineNear(deadline, marginSeconds = 30):
+    """Checks if less than marginSeconds is left until deadline (seconds since epoch). None deadline is never near"""
+    return deadline is not None and time.time() + marginSeconds >= deadline
+
 def IsNullOrWhiteSpace(string):
     """Checks if a string is None or whitespace"""
     return not string or string.isspace()
@@ -80,6 +105,23 @@ def FindDictValueByKeyRegex(d, regex):
     else:
         return None
 		
+def GetReconciliationDelta(cachedItems, currentItems):
+    """Compares cached items with current items, both given as dictionaries of key -> version (use dict.fromkeys(keys) if there are no versions).
+    Returns dictionary with lists of 'added', 'updated' and 'deleted' keys in the order they come in their dictionaries. Runs in linear time"""
+    added = []
+    updated = []
+    for key, version in currentItems.iteritems():
+        if key not in cachedItems:
+            added.append(key)
+        elif cachedItems[key] != version:
+            updated.append(key)
+    deleted = [key for key in cachedItems if key not in currentItems]
+    return {'added': added, 'updated': updated, 'deleted': deleted}
+		
+def ParseServerDateTime(s):
+    """Parses server date like 2000-12-12 09:00:00 or 2000-12-12 09:00:00.00000 by fixed positions, which is several times faster than strptime"""
+    return datetime.datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]), int(s[11:13]), int(s[14:16]), int(s[17:19]))
+
 def ReadXmlNodeOrDefault(parentNode, nodeName, defaultValue):
     """Reads value of child XML node with nodeName from parentNode. If there is no child node with nodeName under parentNode, returns defaultValue"""
     if parentNode is None:
@@ -162,6 +204,14 @@ def RenameFile(oldPath, newPath):
                 logger.debug(u'Couldn\'t rename %s to %s' % (oldPath, oldFileNameWithNewExtension), exc_info = True)
         return oldPath
 		
+def LinkOrCopyFile(sourcePath, targetPath):
+    """Hardlinks file to target path, so that both names share the same data on disk. Copies it where hardlinks can't be made:
+        no os.link on Windows in Python 2.7, file systems without hardlinks, paths on different drives"""
+    try:
+        os.link(sourcePath, targetPath)
+    except (AttributeError, OSError):
+        shutil.copyfile(sourcePath, targetPath)
+
 def GetUpperLevelDir():
     """Gets full path to a directory 1 level up from current execution path"""
     return os.path.abspath(os.path.join(os.getcwdu(), os.pardir))
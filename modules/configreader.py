@@ -2,6 +2,10 @@ import re
 from urlparse import urlparse
 from modules.common import IsNullOrWhiteSpace, ReadXmlFileOrDefault, ReadXmlNodeOrDefault
 
+defaultMaxConcurrentJournals = 1 # how many journals of one server are processed at once
+defaultFullSyncIntervalDays = 7 # how often whole post history is fetched from server to find deleted posts
+defaultSyncIntervalMinutes = 60 # how often journal is synced in daemon mode
+
 def GetConfig(configFilePath):
     noConfigFile = 'NoConfigFile'
     configFileXml = ReadXmlFileOrDefault(configFilePath, noConfigFile)
@@ -23,6 +27,9 @@ def GetConfig(configFilePath):
             raise ValueError(u'No export comments page specified for config section with name %s' % configSection.attrib['name'])
         eventPropertiesToExclude = [elem.text for elem in configSection.findall('eventPropertiesToExclude/eventPropertyToExclude')]
         propPropertiesToExclude = [elem.text for elem in configSection.findall('propPropertiesToExclude/propPropertyToExclude')]
+        maxConcurrentJournals = ReadXmlNodeOrDefault(configSection, 'maxConcurrentJournals', str(defaultMaxConcurrentJournals))
+        if not maxConcurrentJournals.strip().isdigit() or int(maxConcurrentJournals) < 1:
+            raise ValueError(u'Max concurrent journals in config section with name %s should be a whole number greater than 0' % configSection.attrib['name'])
         
         users = configSection.findall('users/user')
         for user in users:
@@ -37,15 +44,26 @@ def GetConfig(configFilePath):
             sectionProperties['exportCommentsPage'] = exportCommentsPage
             sectionProperties['eventPropertiesToExclude'] = eventPropertiesToExclude
             sectionProperties['propPropertiesToExclude'] = propPropertiesToExclude
+            sectionProperties['maxConcurrentJournals'] = int(maxConcurrentJournals)
             
             journal = ReadXmlNodeOrDefault(user, 'name', None)
             if journal is None:
                 raise ValueError(u'No user name specified for one of the users in config section with name %s' % configSection.attrib['name'])
             sectionProperties['journal'] = journal
                 
-            userExportProps = ['applyXSLT', 'archiveComments', 'archiveImages']
+            userExportProps = ['applyXSLT', 'archiveComments', 'archiveImages', 'shareImages']
             for prop in userExportProps:
                 value = ReadXmlNodeOrDefault(user, prop, None)
                 sectionProperties[prop] = True if value == '1' else False
+
+            fullSyncIntervalDays = ReadXmlNodeOrDefault(user, 'fullSyncIntervalDays', str(defaultFullSyncIntervalDays))
+            if not fullSyncIntervalDays.strip().isdigit():
+                raise ValueError(u'Full sync interval for user %s in config section with name %s should be a whole number of days' % (journal, configSection.attrib['name']))
+            sectionProperties['fullSyncIntervalDays'] = int(fullSyncIntervalDays)
+
+            syncIntervalMinutes = ReadXmlNodeOrDefault(user, 'syncIntervalMinutes', str(defaultSyncIntervalMinutes))
+            if not syncIntervalMinutes.strip().isdigit() or int(syncIntervalMinutes) < 1:
+                raise ValueError(u'Sync interval for user %s in config section with name %s should be a whole number of minutes greater than 0' % (journal, configSection.attrib['name']))
+            sectionProperties['syncIntervalMinutes'] = int(syncIntervalMinutes)
             configSettings.append(sectionProperties)
     return configSettings
@@ -1,18 +1,25 @@
 import urllib, urllib2
+import urlparse
+import copy
 import logging
 import re
 from contextlib import closing
+from hashlib import sha1
 from collections import OrderedDict
 import os
-from uuid import uuid4
 import ssl
+import time
+from cStringIO import StringIO
 
 import common
+from metrics import JournalMetrics
 
 class Connection:
 
-    def __init__(self, timeoutSeconds, userAgent):
+    def __init__(self, timeoutSeconds, userAgent, cassette = None, metrics = None):
         self.timeoutSeconds = timeoutSeconds
+        self.cassette = cassette # records responses to or replays them from cassette file if set
+        self.metrics = metrics if metrics is not None else JournalMetrics()
         self.onExceptionRepeatCount = 3
         self.userAgent = userAgent
         self.excludeParametersFromLog = ['auth_challenge', 'auth_response']
@@ -35,27 +42,56 @@ class Connection:
         else:
             raise ValueError(u'Invalid request type %s, only POST and GET are allowed' % type)
         hdrs['User-Agent'] = self.userAgent
+        requestName = 'request.%s' % self.GetEndpointName(url, params)
+        if self.cassette is not None and self.cassette.IsReplaying():
+            with self.metrics.Measure(requestName, self.__stripSensitiveInfoFromParams(params)):
+                recording = self.cassette.Replay(type, url, self.__stripSensitiveInfoFromParams(params))
+            if recording is None or recording['body'] is None:
+                self.metrics.Increment('requestErrors')
+                raise IOError(u'No recorded response from %s with params = %s in cassette' % (url, str(self.__stripSensitiveInfoFromParams(params))))
+            self.metrics.Increment('bytesReceived', len(recording['body']))
+            return recording['body'].decode("utf8")
 
         request = urllib2.Request(requestUrl, data = requestParameters, headers = hdrs)
         result = None
         repeatCount = 0
         while repeatCount < self.onExceptionRepeatCount:
             try:
+                startTime = time.time()
                 ctx = ssl.create_default_context(purpose = ssl.Purpose.SERVER_AUTH) # in case we're connecting to https
                 with closing(urllib2.urlopen(request, timeout = self.timeoutSeconds, context = ctx)) as response:
                     result = response.read()
+                self.metrics.AddTime(requestName, time.time() - startTime, self.__stripSensitiveInfoFromParams(params), startTime)
+                self.metrics.Increment('bytesReceived', len(result))
+                if self.cassette is not None:
+                    self.cassette.Record(type, url, self.__stripSensitiveInfoFromParams(params), self.__stripSensitiveInfoFromHeaders(hdrs), result, time.time() - startTime)
                 break
             except Exception as e:
                 filteredParams = self.__stripSensitiveInfoFromParams(params)
                 filteredHeaders = self.__stripSensitiveInfoFromHeaders(hdrs)
-                self.logger.debug(u'Exception on connect attempt #%d to %s with params = %s and headers %s' % ((repeatCount + 1), url, str(filteredParams), str(filteredHeaders)), exc_info = True)
+                self.logger.debug(u'Exception on connect attempt #%d to %s with params = %s and headers %s', repeatCount + 1, url, filteredParams, filteredHeaders, exc_info = True)
                 repeatCount = repeatCount + 1
+                if repeatCount < self.onExceptionRepeatCount:
+                    self.metrics.Increment('retries')
                     
         if repeatCount == self.onExceptionRepeatCount:
+            self.metrics.Increment('requestErrors')
             raise IOError(u'Could not read response from %s after %d attempts' % (url, repeatCount))
                     
         return result.decode("utf8")
 
+    def GetEndpointName(self, url, params):
+        """Names request for metrics by url path and API mode or kind of exported info, like interface/flat.getevents or export_comments.bml.comment_body"""
+        path = urlparse.urlsplit(url).path.strip('/') or '/'
+        mode = params.get('mode') or params.get('get')
+        return path if mode is None else '%s.%s' % (path, mode)
+
+    def WithMetrics(self, metrics):
+        """Returns a copy of connection that counts its requests in metrics, so that journals processed in parallel get metrics of their own"""
+        journalConnection = copy.copy(self)
+        journalConnection.metrics = metrics
+        return journalConnection
+
     def ReadServerAnswer(self, answer):
         """Reads result of API call by flat protocol and returns properties and values as dictionary.
             Raises an exception in case server response contains error information
@@ -102,7 +138,9 @@ class Connection:
 
     def GetServerAuthResponse(self, interfaceUrl, md5Password):
         """Gets server challenge token and returns a pair of challenge token and password hashed using this token as salt"""
-        challengeData = self.ReadServerAnswer(self.MakeRequest(interfaceUrl, {'mode': 'getchallenge', 'ver': 1}))
+        answer = self.MakeRequest(interfaceUrl, {'mode': 'getchallenge', 'ver': 1})
+        with self.metrics.Measure('parse.flat'):
+            challengeData = self.ReadServerAnswer(answer)
         return {'auth_challenge': challengeData['challenge'], 'auth_response': common.MD5(challengeData['challenge'] + md5Password)}
 
     def MakeServerRequestWithAuthentication(self, connParams, mode, modeParams):
@@ -110,7 +148,9 @@ class Connection:
         interfaceUrl = connParams['server'] + self.interfacePath
         challengeAndResponse = self.GetServerAuthResponse(interfaceUrl, connParams['pwdhash'])
         params = common.MergeDicts({'mode': mode, 'auth_method': 'challenge', 'user': connParams['user'], 'ver': 1}, modeParams)
-        return self.ReadServerAnswer(self.MakeRequest(interfaceUrl, common.MergeDicts(params, challengeAndResponse)))
+        answer = self.MakeRequest(interfaceUrl, common.MergeDicts(params, challengeAndResponse))
+        with self.metrics.Measure('parse.flat'):
+            return self.ReadServerAnswer(answer)
 
     def GetSessionToken(self, connParams):
         """Get session token to use in cookies"""
@@ -127,46 +167,113 @@ class Connection:
                 params = {'expire_id_%s' % sessionId: 1}
                 self.MakeServerRequestWithAuthentication(connParams, 'sessionexpire', params)
 				
-    def DownloadImage(self, url, filePath, fromLink = False):
-        """Downloads image into file with provided path & name, assigns proper extension to it and returns full path with extension or None if download fails"""
+    def DownloadImage(self, url, filePath, fromLink = False, sharedImagesPath = None):
+        """Downloads image into file with provided path & name, assigns proper extension to it and returns full path with extension or None if download fails.
+            If sharedImagesPath is set, image is stored there under its content hash and file in filePath is a hardlink to it"""
+        if self.cassette is not None and self.cassette.IsReplaying():
+            with self.metrics.Measure('request.image', {'url': url}):
+                return self.__replayImage(url, filePath, fromLink, sharedImagesPath)
         fileFullPathWithExtension = None
         request = urllib2.Request(url)
         repeatCount = 0
         while repeatCount < self.onExceptionRepeatCount:
             try:
+                startTime = time.time()
                 ctx = ssl.create_default_context(purpose = ssl.Purpose.SERVER_AUTH)
                 with closing(urllib2.urlopen(request, timeout = self.timeoutSeconds, context = ctx)) as response:
                     responseLowercaseHeaders = {k.lower():v for k, v in response.info().items()}
-                    if 'content-type' in responseLowercaseHeaders:
-                        matches = self.imageContentTypeRegex.search(responseLowercaseHeaders['content-type'])
-                        if matches:
-                            contentType = matches.group(1) # I'd use Python's imghdr, but is't very unreliable on jpegs, so let's rely on what server gives us
-                            fileFullPath = os.path.join(filePath, '%s.tmp' % uuid4())
-                            common.CreatePathIfNotExists(fileFullPath)
-                            with open(fileFullPath, 'wb') as imageFile:
-                                while True:
-                                    chunk = response.read(self.largeFilesChunkSize)
-                                    if not chunk:
-                                        break
-                                    imageFile.write(chunk)
-                            trueFileName = common.GetUnicodeFileNameFromUrl(url, contentType, 'linked') if fromLink else common.GetUnicodeFileNameFromUrl(url, contentType) 
-                            fileFullPathWithExtension = common.RenameFile(fileFullPath, os.path.join(filePath, trueFileName))
-                        else:
-                            self.logger.debug(u'Content-type header %s for url %s is not one of an image' % (responseLowercaseHeaders['content-type'], url))
+                    contentTypeHeader = responseLowercaseHeaders.get('content-type')
+                    if self.cassette is None:
+                        fileFullPathWithExtension = self.__saveImage(url, filePath, fromLink, contentTypeHeader, response.read, sharedImagesPath)
                     else:
-                        self.logger.debug(u'No content-type header for url %s' % url)
+                        chunks = []
+                        def ReadAndRecordChunk(size):
+                            chunk = response.read(size)
+                            chunks.append(chunk)
+                            return chunk
+                        fileFullPathWithExtension = self.__saveImage(url, filePath, fromLink, contentTypeHeader, ReadAndRecordChunk, sharedImagesPath)
+                        self.cassette.Record('GET', url, {}, {}, ''.join(chunks), time.time() - startTime, contentTypeHeader)
+                self.metrics.AddTime('request.image', time.time() - startTime, {'url': url}, startTime)
                 break # break the WHILE cycle
             except Exception as e:
                 codes400 = [403, 404, 410]
                 if isinstance(e, urllib2.HTTPError) and e.code in codes400:
-                    self.logger.debug(u'Error %d on downloading from url %s, stopping download attempts' % (e.code, url))
+                    self.logger.debug(u'Error %d on downloading from url %s, stopping download attempts', e.code, url)
+                    self.metrics.Increment('imageErrors')
+                    if self.cassette is not None:
+                        self.cassette.Record('GET', url, {}, {}, None, time.time() - startTime, errorCode = e.code)
                     break # break the WHILE cycle
-                self.logger.debug(u'Exception on downloading attempt #%d from url %s' % ((repeatCount + 1), url), exc_info = True)
+                self.logger.debug(u'Exception on downloading attempt #%d from url %s', repeatCount + 1, url, exc_info = True)
                 repeatCount = repeatCount + 1
+                if repeatCount < self.onExceptionRepeatCount:
+                    self.metrics.Increment('retries')
 
         if repeatCount == self.onExceptionRepeatCount:
-            self.logger.warning(u'Couldn\'t download image from url %s after %d attempts' % (url, repeatCount))
+            self.metrics.Increment('imageErrors')
+            self.logger.warning(u'Couldn\'t download image from url %s after %d attempts', url, repeatCount)
         return fileFullPathWithExtension
+
+    def __saveImage(self, url, filePath, fromLink, contentTypeHeader, readChunk, sharedImagesPath = None):
+        """Saves image read by readChunk(size) into file named after url and content type, returns full path of the file or None if content is not an image"""
+        if contentTypeHeader is None:
+            self.logger.debug(u'No content-type header for url %s', url)
+            return None
+        matches = self.imageContentTypeRegex.search(contentTypeHeader)
+        if not matches:
+            self.logger.debug(u'Content-type header %s for url %s is not one of an image', contentTypeHeader, url)
+            return None
+        contentType = matches.group(1) # I'd use Python's imghdr, but is't very unreliable on jpegs, so let's rely on what server gives us
+        from uuid import uuid4 # uuid loads ctypes, deferred so that runs that download no images don't pay for it
+        # shared image is downloaded right into shared images folder, so that it's moved to its hash named file without copying
+        fileFullPath = os.path.join(sharedImagesPath if sharedImagesPath is not None else filePath, '%s.tmp' % uuid4())
+        contentHash = sha1() if sharedImagesPath is not None else None
+        common.CreatePathIfNotExists(fileFullPath)
+        with open(fileFullPath, 'wb') as imageFile:
+            while True:
+                chunk = readChunk(self.largeFilesChunkSize)
+                if not chunk:
+                    break
+                imageFile.write(chunk)
+                if contentHash is not None:
+                    contentHash.update(chunk)
+                self.metrics.Increment('bytesReceived', len(chunk))
+        if contentHash is not None:
+            fileFullPath = self.__linkSharedImage(fileFullPath, contentHash.hexdigest(), contentType, sharedImagesPath, filePath)
+        trueFileName = common.GetUnicodeFileNameFromUrl(url, contentType, 'linked') if fromLink else common.GetUnicodeFileNameFromUrl(url, contentType) 
+        return common.RenameFile(fileFullPath, os.path.join(filePath, trueFileName))
+
+    def __linkSharedImage(self, downloadedFilePath, contentHash, contentType, sharedImagesPath, filePath):
+        """Moves downloaded image into shared images folder under its content hash unless the same image is already there, then links it into filePath.
+            Returns path of the link, which is a temporary name for the caller to rename"""
+        extension = 'jpg' if contentType.lower() == 'jpeg' else contentType.lower()
+        sharedFilePath = os.path.join(sharedImagesPath, contentHash[:2], '%s.%s' % (contentHash, extension))
+        if os.path.isfile(sharedFilePath):
+            os.remove(downloadedFilePath)
+            self.metrics.Increment('sharedImagesReused')
+        else:
+            common.CreatePathIfNotExists(sharedFilePath)
+            try:
+                os.rename(downloadedFilePath, sharedFilePath)
+            except OSError:
+                if not os.path.isfile(sharedFilePath): # otherwise another journal has just stored the same image
+                    raise
+                os.remove(downloadedFilePath)
+        linkPath = os.path.join(filePath, os.path.basename(downloadedFilePath))
+        common.CreatePathIfNotExists(linkPath)
+        common.LinkOrCopyFile(sharedFilePath, linkPath)
+        return linkPath
+
+    def __replayImage(self, url, filePath, fromLink, sharedImagesPath = None):
+        """Saves image recorded in cassette the same way DownloadImage saves downloaded one"""
+        recording = self.cassette.Replay('GET', url, {})
+        if recording is None:
+            self.logger.warning(u'Couldn\'t find image from url %s in cassette', url)
+            return None
+        if recording['errorCode'] is not None:
+            self.logger.debug(u'Error %d on downloading from url %s, stopping download attempts', recording['errorCode'], url)
+            self.metrics.Increment('imageErrors')
+            return None
+        return self.__saveImage(url, filePath, fromLink, recording['contentType'], StringIO(recording['body']).read, sharedImagesPath)
 		
     def UrlEncode(self, params):
         """The urlencode library expects data in str format, and doesn't deal well with Unicode data since it doesn't provide a way to specify an encoding"""
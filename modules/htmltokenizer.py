@@ -0,0 +1,125 @@
+import re
+from HTMLParser import HTMLParser
+from collections import OrderedDict
+
+tagRegex = re.compile(r'''<!--.*?-->|<![^>]*>|<\?[^>]*>|<(/?)([a-zA-Z][^\s/>]*)((?:[^>"']|"[^"]*"|'[^']*')*)>''', re.S)
+attributeRegex = re.compile(r'''([^\s"'>/=]+)(?:\s*=\s*("[^"]*"|'[^']*'|(?!["'])[^\s>]*))?''')
+rawTextEndRegexes = {'script': re.compile(r'</script\s*>', re.I), 'style': re.compile(r'</style\s*>', re.I)}
+# tags that never have content, the same ones BeautifulSoup closes right away
+voidTagNames = frozenset(['area', 'base', 'basefont', 'bgsound', 'br', 'col', 'command', 'embed', 'frame', 'hr', 'image', 'img', 'input', 'isindex',
+                          'keygen', 'link', 'menuitem', 'meta', 'nextid', 'param', 'source', 'spacer', 'track', 'wbr'])
+htmlParser = HTMLParser() # only its unescape is used, it decodes entities in attribute values the way html.parser does
+
+class HtmlTag:
+    """Start tag found in markup. Reads like BeautifulSoup's tag: lowercase name, get() returns unescaped attribute value, parent is the enclosing open tag.
+        Attributes set with tag[name] = value are written into markup by PatchTags, the rest of markup stays as it was"""
+
+    def __init__(self, name, parent, attributesText, attributesOffset):
+        self.name = name
+        self.parent = parent
+        self.attributesText = attributesText
+        self.attributesOffset = attributesOffset
+        self.attributes = None # name -> (unescaped value, offset of raw value or None if attribute has no value, offset after attribute), parsed when asked for
+        self.newAttributesOffset = None # new attributes go right after the last one
+        self.changes = None # attribute name -> value set on tag, made on first change
+
+    def get(self, name, default = None):
+        if self.changes is not None and name in self.changes:
+            return self.changes[name]
+        attribute = self.GetAttributes().get(name)
+        return attribute[0] if attribute is not None else default
+
+    def __setitem__(self, name, value):
+        if self.changes is None:
+            self.changes = OrderedDict()
+        self.changes[name] = value
+
+    def GetAttributes(self):
+        if self.attributes is None:
+            self.attributes = {}
+            self.newAttributesOffset = self.attributesOffset
+            for attributeMatch in attributeRegex.finditer(self.attributesText):
+                rawValue = attributeMatch.group(2)
+                value, valueOffset = u'', None
+                if rawValue is not None:
+                    value = htmlParser.unescape(rawValue[1:-1] if rawValue[:1] in ['"', "'"] else rawValue)
+                    valueOffset = self.attributesOffset + attributeMatch.start(2)
+                self.newAttributesOffset = self.attributesOffset + attributeMatch.end()
+                self.attributes[attributeMatch.group(1).lower()] = (value, valueOffset, self.newAttributesOffset)
+        return self.attributes
+
+    def IsSelfClosing(self):
+        """Slash of <tag/> closes the tag, slash at the end of unquoted value like <a href=/path/> doesn't"""
+        trimmedAttributesText = self.attributesText.rstrip()
+        if not trimmedAttributesText.endswith('/'):
+            return False
+        self.GetAttributes()
+        return self.attributesOffset + len(trimmedAttributesText) - 1 >= self.newAttributesOffset
+
+class RootTag:
+    """Parent of top level tags"""
+    name = None
+    parent = None
+
+    def get(self, name, default = None):
+        return default
+
+def ParseTags(markup, names = None):
+    """Returns start tags of markup in document order, only the ones named in names if they are given. Parents are found the way
+        BeautifulSoup with html.parser finds them: end tag closes the last open tag with its name and everything opened after it"""
+    result = []
+    openTags = [RootTag()]
+    position = 0
+    length = len(markup)
+    while position < length:
+        match = tagRegex.search(markup, position)
+        if match is None:
+            break
+        position = match.end()
+        name = match.group(2)
+        if name is None: # comment, doctype or processing instruction
+            continue
+        name = name.lower()
+        if match.group(1): # end tag
+            for i in xrange(len(openTags) - 1, 0, -1):
+                if openTags[i].name == name:
+                    del openTags[i:]
+                    break
+            continue
+        tag = HtmlTag(name, openTags[-1], match.group(3), match.start(3))
+        if names is None or name in names:
+            result.append(tag)
+        if name in rawTextEndRegexes: # tags in script or style are just text
+            rawTextEnd = rawTextEndRegexes[name].search(markup, position)
+            position = rawTextEnd.end() if rawTextEnd is not None else length
+        elif name not in voidTagNames and not tag.IsSelfClosing():
+            openTags.append(tag)
+    return result
+
+def EscapeAttributeValue(value):
+    return value.replace(u'&', u'&amp;').replace(u'<', u'&lt;').replace(u'>', u'&gt;').replace(u'"', u'&quot;')
+
+def PatchTags(markup, tags):
+    """Returns markup with attributes set on tags written into it: existing attribute gets new value in place, new one is added after the last attribute"""
+    edits = [] # (start, end, replacement)
+    for tag in tags:
+        for name, value in (tag.changes or {}).iteritems():
+            quotedValue = u'"%s"' % EscapeAttributeValue(value)
+            attribute = tag.GetAttributes().get(name)
+            if attribute is None:
+                edits.append((tag.newAttributesOffset, tag.newAttributesOffset, u' %s=%s' % (name, quotedValue)))
+            elif attribute[1] is None: # attribute without value
+                edits.append((attribute[2], attribute[2], u'=%s' % quotedValue))
+            else:
+                edits.append((attribute[1], attribute[2], quotedValue))
+    if len(edits) == 0:
+        return markup
+    edits.sort(key = lambda edit: edit[0])
+    parts = []
+    position = 0
+    for start, end, replacement in edits:
+        parts.append(markup[position:start])
+        parts.append(replacement)
+        position = end
+    parts.append(markup[position:])
+    return u''.join(parts)
@@ -1,10 +1,11 @@
-from bs4 import BeautifulSoup
 import os
 import time
 import logging
 import re
 
 import common
+from htmltokenizer import ParseTags, PatchTags
+from metrics import JournalMetrics
 
 class ImageScraper():
     def __init__(self, environment):
@@ -13,80 +14,99 @@ class ImageScraper():
         self.sectionName = environment['sectionName']
         self.journal = environment['journal']
         self.cachedImagesXml = environment['cachedImagesXml']
+        # image cache indexed by remote url, kept up to date by the caller between posts or made here if the caller doesn't have it
+        self.cachedImagesByRemote = environment.get('cachedImagesByRemote')
+        if self.cachedImagesByRemote is None:
+            self.cachedImagesByRemote = dict((imageInfo.attrib['remote'], imageInfo) for imageInfo in self.cachedImagesXml.iterfind('image'))
         self.imagesFolder = environment['imagesFolder']
+        self.sharedImagesPath = environment.get('sharedImagesPath') # images are stored by content hash in this folder shared by journals if it's set
+        self.metrics = environment.get('metrics') or JournalMetrics(self.sectionName, self.journal)
         self.logger = logging.getLogger('log')
-        self.selfClosingTagRegex = re.compile('<\/(lj|user)>', re.I)
+        self.imgTagRegex = re.compile('<img', re.I)
 
-    def loadLinkedImage(self, soup, imgTag, keyDict, pathToSaveFile, addSleepTime = False):
+    def loadLinkedImage(self, imgTags, imgTag, keyDict, pathToSaveFile, addSleepTime = False):
         if 'linkedRemote' not in keyDict and imgTag.parent.name == u'a':
             # there's a link surrounding an image that potentially links to the larger version of the image. Let's download it
             a = imgTag.parent
             parentLinkHref = a.get('href')
             if parentLinkHref and not parentLinkHref.isspace():
                 if addSleepTime:
-                    time.sleep(self.httpRequestDelaySeconds)
-                downloadedLinkedImagePath = self.cnn.DownloadImage(parentLinkHref, pathToSaveFile, True)
+                    with self.metrics.Measure('sleep'):
+                        time.sleep(self.httpRequestDelaySeconds)
+                downloadedLinkedImagePath = self.cnn.DownloadImage(parentLinkHref, pathToSaveFile, True, sharedImagesPath = self.sharedImagesPath)
                 if downloadedLinkedImagePath is not None:
                     keyDict['linkedRemote'] = parentLinkHref
                     keyDict['linkedLocal'] = downloadedLinkedImagePath
                     path, filename = os.path.split(downloadedLinkedImagePath)
                     a['data-local-src'] = u'%s/%s' % (self.imagesFolder, filename)
-                    self.logger.info(u'Downloaded linked image from %s' % parentLinkHref)
+                    self.logger.info(u'Downloaded linked image from %s', parentLinkHref)
+                    self.metrics.Increment('imagesDownloaded')
         elif 'linkedRemote' in keyDict and imgTag.parent.name != u'a':
             # there's information about a larger version of the image in the link, but no actual link. Let's remove the information
             imagesWithSameLinkedRemoteCount = len(filter(lambda img:
+                                             img.get('src') == keyDict['remote'] and
                                              img.parent.name == u'a' and
                                              img.parent.get('href') == keyDict['linkedRemote'],
-                                             soup.find_all('img', attrs={'src': keyDict['remote']})))
+                                             imgTags))
             if imagesWithSameLinkedRemoteCount == 0:
                 keyDict.pop('linkedRemote', None)
                 keyDict.pop('linkedLocal', None)
 
     def scrape(self, markup):
-        """The main magic is done here. HTML tags are checked for being img and having scr. If there's info about this src in either image cache that comes
+        """The main magic is done here. HTML tags are checked for being img and having scr. Markup is only tokenized, not parsed into a tree,
+            data-local-src attributes are written into it in place and the rest of it comes back exactly as it was. If there's info about this src in either image cache that comes
             in XML form or in the array of already downloaded images that didn't make it to cache yet (these are the ones that were downloaded while parsing the same
             piece of HTML, say, we have 2 links to the same image in one post), then the image is downloaded, and its remote and local links are put into 
             downloadedImageInfos. If the image is in cache, cached info is used, and its remote and local links are put into existingImageInfos."""
-        soup = BeautifulSoup(markup, 'html.parser')
+        if isinstance(markup, str):
+            markup = markup.decode('utf-8')
         downloadedImageInfos = []
+        downloadedImageInfosByRemote = {}
         existingImageInfos = []
-        for img in soup.find_all('img'):
+        failedImageRemotes = []
+        if self.imgTagRegex.search(markup) is None: # most posts have no images
+            return {'updatedMarkup': markup, 'downloadedImageInfos': downloadedImageInfos, 'existingImageInfos': existingImageInfos, 'failedImageRemotes': failedImageRemotes }
+        with self.metrics.Measure('parse.html'):
+            tags = ParseTags(markup, ['img', 'a'])
+        imgTags = [tag for tag in tags if tag.name == u'img']
+        for img in imgTags:
             src = img.get('src')
             if src and not src.isspace():
                 try:
-                    cachedImageInfo = self.cachedImagesXml.find('image[@remote="%s"]' % src)
-                    freshlyDownloadedImageInfo = list(filter(lambda elem: elem['remote'] == src, downloadedImageInfos))
+                    cachedImageInfo = self.cachedImagesByRemote.get(src)
+                    freshImgInfo = downloadedImageInfosByRemote.get(src)
                     pathToSaveFile = os.path.join(common.GetUpperLevelDir(), self.sectionName, self.journal, self.imagesFolder)
+                    self.metrics.Increment('imageCacheMisses' if cachedImageInfo is None and freshImgInfo is None else 'imageCacheHits')
                     if cachedImageInfo is not None:
                         img['data-local-src'] = u'%s/%s' % (self.imagesFolder, cachedImageInfo.attrib['local'])
                         existingImgInfo = {k: v for k, v in cachedImageInfo.attrib.items() if k in ['local', 'remote', 'linkedLocal', 'linkedRemote']}
-                        self.loadLinkedImage(soup, img, existingImgInfo, pathToSaveFile)
+                        self.loadLinkedImage(imgTags, img, existingImgInfo, pathToSaveFile)
                         existingImageInfos.append(existingImgInfo)
-                    elif len(freshlyDownloadedImageInfo) > 0:
-                        freshImgInfo = freshlyDownloadedImageInfo[0]
+                    elif freshImgInfo is not None:
                         img['data-local-src'] = u'%s/%s' % (self.imagesFolder, freshImgInfo['local'])
-                        self.loadLinkedImage(soup, img, freshImgInfo, pathToSaveFile)
+                        self.loadLinkedImage(imgTags, img, freshImgInfo, pathToSaveFile)
                     else:
-                        downloadedImagePath = self.cnn.DownloadImage(src, pathToSaveFile)
+                        downloadedImagePath = self.cnn.DownloadImage(src, pathToSaveFile, sharedImagesPath = self.sharedImagesPath)
                         if downloadedImagePath is not None:
                             path, filename = os.path.split(downloadedImagePath)
                             img['data-local-src'] = u'%s/%s' % (self.imagesFolder, filename)
-                            self.logger.info(u'Downloaded image from %s' % src)
+                            self.logger.info(u'Downloaded image from %s', src)
                             imgInfo = {'remote': src, 'local': filename}
-                            self.loadLinkedImage(soup, img, imgInfo, pathToSaveFile, True)
+                            self.loadLinkedImage(imgTags, img, imgInfo, pathToSaveFile, True)
                             downloadedImageInfos.append(imgInfo)
-                            time.sleep(self.httpRequestDelaySeconds)
+                            downloadedImageInfosByRemote[src] = imgInfo
+                            self.metrics.Increment('imagesDownloaded')
+                            with self.metrics.Measure('sleep'):
+                                time.sleep(self.httpRequestDelaySeconds)
+                        else:
+                            failedImageRemotes.append(src)
                 except:
-                    self.logger.debug(u'%s: %s: Exception on trying to process image path %s in markup "%s"' % (self.sectionName, self.journal, src, markup), exc_info = True)
+                    failedImageRemotes.append(src)
+                    self.logger.debug(u'%s: %s: Exception on trying to process image path %s in markup "%s"', self.sectionName, self.journal, src, markup, exc_info = True)
 
-        updatedMarkup = self.fixSelfClosingTags(unicode(soup))
-        return {'updatedMarkup': updatedMarkup, 'downloadedImageInfos': downloadedImageInfos, 'existingImageInfos': existingImageInfos }
-
-    def fixSelfClosingTags(self, stringifiedSoup):
-        """ An unfortunate known issue of html.parser in BeautifulSoup is that it adds unnecessary closing tags for custom tags
-        that do not need it, like "this is <user name="foo"> user Foo" turns into "this is <user name="foo"> user Foo</user>"
-        This method aims to take care of this discrepancy."""
-        return self.selfClosingTagRegex.sub('', stringifiedSoup)
+        with self.metrics.Measure('serialize.html'):
+            updatedMarkup = PatchTags(markup, tags)
+        return {'updatedMarkup': updatedMarkup, 'downloadedImageInfos': downloadedImageInfos, 'existingImageInfos': existingImageInfos, 'failedImageRemotes': failedImageRemotes }
 
     @classmethod
     def ScrapeImages(cls, markup, environment):
@@ -1,24 +1,81 @@
+import atexit
 import logging
+import threading
+import Queue
 from logging import handlers
 from modules.common import CreatePathIfNotExists
 
+class QueueHandler(logging.Handler):
+    """Puts log records into queue for QueueListener to write them, backport of Python 3 logging.handlers.QueueHandler.
+        Unlike Python 3 one, it doesn't format records, so that messages logged with arguments are formatted on listener's thread as well;
+        arguments are expected not to change after they are logged"""
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Exception:
+            self.handleError(record)
+
+class QueueListener:
+    """Passes log records from queue to handlers on its own thread, backport of Python 3 logging.handlers.QueueListener
+        that respects handlers' levels"""
+    sentinel = None
+
+    def __init__(self, queue, *handlers):
+        self.queue = queue
+        self.handlers = handlers
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target = self.__monitor, name = 'LogListener')
+        self.thread.daemon = True # doesn't keep the application from exiting, stop() flushes what's left
+        self.thread.start()
+
+    def stop(self):
+        """Handles records that are still in queue and stops the thread"""
+        if self.thread is not None:
+            self.queue.put(self.sentinel)
+            self.thread.join()
+            self.thread = None
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def __monitor(self):
+        while True:
+            record = self.queue.get()
+            if record is self.sentinel:
+                break
+            self.handle(record)
+
 def SetupLogger(logFilePath, dateFormatString):
     logger = logging.getLogger('log')
-    
+
     if not len(logger.handlers):
         logger.setLevel(logging.DEBUG)
         logger.propagate = False
-        
+
         # create a console handler
         consoleHandler = logging.StreamHandler()
         consoleHandler.setLevel(logging.INFO)
         consoleHandler.setFormatter(logging.Formatter('%(message)s'))
-        logger.addHandler(consoleHandler)
-                
+
         # create a file handler
         CreatePathIfNotExists(logFilePath)
         fileHandler = logging.handlers.TimedRotatingFileHandler(logFilePath, when = 'midnight', backupCount = 10, encoding = 'utf-8')
         fileHandler.setLevel(logging.DEBUG)
         fileHandler.setFormatter(logging.Formatter('[%(levelname)-8s: %(asctime)s - %(filename)s:%(lineno)s - %(funcName)s()] - %(message)s', dateFormatString))
-        logger.addHandler(fileHandler)
+
+        # handlers write on listener's thread, so that logging in download and parsing loops doesn't wait for console and disk
+        logQueue = Queue.Queue()
+        logger.addHandler(QueueHandler(logQueue))
+        listener = QueueListener(logQueue, consoleHandler, fileHandler)
+        listener.start()
+        atexit.register(listener.stop)
     return logger
@@ -0,0 +1,127 @@
+import time
+import json
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+
+import common
+
+class JournalMetrics:
+    """Counters and timings of one journal's run. Timings are named by what was being done: request.<endpoint>, sleep, parse.*, serialize.*, write.*,
+        so that a slow run can be told apart into network, sleeps, XML and disk. Journal's connection may be used from several threads, so updates are locked"""
+
+    def __init__(self, sectionName = None, journal = None):
+        self.sectionName = sectionName
+        self.journal = journal
+        self.lock = threading.Lock()
+        self.lastSuccessTime = None # kept between runs
+        self.lastFinishedReport = None # report of the last finished run, kept while the next one goes
+        self.Reset()
+
+    def Reset(self, tracer = None):
+        """Forgets everything counted so far and starts counting a new run. If tracer is given, every timing of the run is also added to it as span"""
+        with self.lock:
+            self.tracer = tracer
+            self.startTime = time.time()
+            self.durationSeconds = None
+            self.succeeded = None
+            self.counters = {}
+            self.timings = {} # name -> [count, total seconds, max seconds]
+
+    def Finish(self, succeeded):
+        """Marks the run as finished"""
+        with self.lock:
+            self.durationSeconds = time.time() - self.startTime
+            self.succeeded = succeeded
+            if succeeded:
+                self.lastSuccessTime = self.startTime + self.durationSeconds
+        self.lastFinishedReport = self.GetReport()
+
+    def Increment(self, name, value = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def AddTime(self, name, seconds, details = None, startTime = None):
+        """Adds seconds to timing name. details are only kept in the span of tracer, startTime defaults to seconds ago"""
+        if self.tracer is not None:
+            self.tracer.AddSpan(name, startTime if startTime is not None else time.time() - seconds, seconds, details)
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                self.timings[name] = [1, seconds, seconds]
+            else:
+                timing[0] += 1
+                timing[1] += seconds
+                timing[2] = max(timing[2], seconds)
+
+    @contextmanager
+    def Measure(self, name, details = None):
+        """Times the code inside with statement as name"""
+        startTime = time.time()
+        try:
+            yield
+        finally:
+            self.AddTime(name, time.time() - startTime, details, startTime)
+
+    def GetCounter(self, name):
+        return self.counters.get(name, 0)
+
+    def GetTotalSeconds(self, prefix):
+        """Sums timings whose names are prefix or start with prefix followed by a dot"""
+        with self.lock:
+            return sum(timing[1] for name, timing in self.timings.iteritems() if name == prefix or name.startswith(prefix + '.'))
+
+    def GetTotalCount(self, prefix):
+        with self.lock:
+            return sum(timing[0] for name, timing in self.timings.iteritems() if name == prefix or name.startswith(prefix + '.'))
+
+    def GetReport(self):
+        """Returns the run's metrics as dictionary fit for JSON"""
+        with self.lock:
+            return {'sectionName': self.sectionName,
+                    'journal': self.journal,
+                    'startTime': self.startTime,
+                    'durationSeconds': self.durationSeconds,
+                    'succeeded': self.succeeded,
+                    'lastSuccessTime': self.lastSuccessTime,
+                    'counters': dict(self.counters),
+                    'timings': dict((name, {'count': timing[0], 'seconds': timing[1], 'maxSeconds': timing[2]}) for name, timing in self.timings.iteritems())}
+
+    def GetLastReport(self):
+        """Returns report of the last finished run or of the current one if no run has finished yet"""
+        return self.lastFinishedReport if self.lastFinishedReport is not None and self.durationSeconds is None else self.GetReport()
+
+    def FormatSummary(self):
+        """Returns one line summary of the run for log"""
+        durationSeconds = self.durationSeconds if self.durationSeconds is not None else time.time() - self.startTime
+        counters = ', '.join('%s = %d' % (name, value) for name, value in sorted(self.counters.iteritems()))
+        return (u'%s: %s: run took %.1fs: %.1fs in %d request(s), %.1fs sleeping, %.1fs parsing, %.1fs serializing, %.1fs writing files; %s' %
+                (self.sectionName, self.journal, durationSeconds, self.GetTotalSeconds('request'), self.GetTotalCount('request'), self.GetTotalSeconds('sleep'),
+                 self.GetTotalSeconds('parse'), self.GetTotalSeconds('serialize'), self.GetTotalSeconds('write'), counters or 'nothing counted'))
+
+class MetricsRegistry:
+    """Keeps metrics of every journal of the application run"""
+
+    def __init__(self):
+        self.journals = OrderedDict() # (section name, journal) -> JournalMetrics
+        self.lock = threading.Lock()
+
+    def GetJournalMetrics(self, sectionName, journal):
+        """Returns metrics of the journal, the same object every time"""
+        with self.lock:
+            key = (sectionName, journal)
+            if key not in self.journals:
+                self.journals[key] = JournalMetrics(sectionName, journal)
+            return self.journals[key]
+
+    def GetReport(self):
+        with self.lock:
+            journalMetrics = self.journals.values()
+        return {'generatedAt': time.time(), 'journals': [metrics.GetLastReport() for metrics in journalMetrics]}
+
+    def SaveReport(self, path, formatReport = None):
+        """Writes report of all journals to path as JSON or as formatReport(report) returns it"""
+        report = self.GetReport()
+        content = json.dumps(report, indent = 2, sort_keys = True) if formatReport is None else formatReport(report)
+        with self.lock: # journals finishing at once in parallel threads shouldn't write the same temporary file
+            common.WriteFileAtomically(path, content)
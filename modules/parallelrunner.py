@@ -0,0 +1,60 @@
+import logging
+import threading
+from Queue import Queue, Empty
+from collections import OrderedDict
+
+import common
+
+def GroupJournalsByServer(configSections):
+    """Groups journal settings by server host keeping config order"""
+    groups = OrderedDict()
+    for configSection in configSections:
+        groups.setdefault(configSection.get('serverNetloc'), []).append(configSection)
+    return groups
+
+def GetServerEnvironments(configSections, globalSettings):
+    """Creates environments for journals on one server. Up to maxConcurrentJournals of them run at once,
+        so delay between requests is multiplied by that number to keep the request rate the server sees the same as with one journal"""
+    concurrency = max(1, min(min(configSection.get('maxConcurrentJournals', 1) for configSection in configSections), len(configSections)))
+    serverSettings = common.MergeDicts(globalSettings, {'delay': globalSettings['delay'] * concurrency})
+    return concurrency, [common.MergeDicts(configSection, serverSettings) for configSection in configSections]
+
+def RunJournals(configSections, globalSettings, processJournal):
+    """Calls processJournal(environment) for every journal. Different servers are processed in parallel,
+        journals on the same server are processed by maxConcurrentJournals worker threads"""
+    RunServerQueues([GetServerEnvironments(serverConfigSections, globalSettings) for serverConfigSections in GroupJournalsByServer(configSections).itervalues()],
+                    processJournal)
+
+def RunServerQueues(serverItems, processItem):
+    """Calls processItem(item) for every item of serverItems, which is a list of (concurrency, items) pairs, one per server.
+        Every server gets concurrency worker threads of its own"""
+    workers = []
+    for concurrency, items in serverItems:
+        itemQueue = Queue()
+        for item in items:
+            itemQueue.put(item)
+        workers.extend([itemQueue] * concurrency)
+
+    if len(workers) == 1: # nothing to run in parallel, stay in current thread
+        ProcessJournalQueue(workers[0], processItem)
+        return
+
+    threads = [threading.Thread(target = ProcessJournalQueue, args = (itemQueue, processItem)) for itemQueue in workers]
+    for thread in threads:
+        thread.daemon = True # so that Ctrl+C stops the application
+        thread.start()
+    for thread in threads:
+        while thread.isAlive():
+            thread.join(1)
+
+def ProcessJournalQueue(journalQueue, processJournal):
+    """Takes journals from journalQueue and processes them until the queue is empty"""
+    while True:
+        try:
+            journal = journalQueue.get_nowait()
+        except Empty:
+            return
+        try:
+            processJournal(journal)
+        except Exception:
+            logging.getLogger('log').debug(u'Unhandled error in processing journal', exc_info = True)
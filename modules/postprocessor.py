@@ -4,28 +4,63 @@ import re
 import time
 import os
 import datetime
+from collections import OrderedDict
 from xml.etree.ElementTree import Element, SubElement, fromstring, tostring
 
 import common
 from imagescraper import ImageScraper
+from metrics import JournalMetrics
+
+class SyncItem(object):
+    """Post db id and time post was created or last edited. Uses slots because old journals have tens of thousands of these"""
+    __slots__ = ('id', 'time')
+
+    def __init__(self, postId, postTime):
+        self.id = postId
+        self.time = postTime
+
+class PostRecord(object):
+    """getevents answer classified by key: event fields (name -> value), props (name -> value), itemid and anum"""
+    __slots__ = ('events', 'props', 'itemId', 'anum')
+
+    def __init__(self):
+        self.events = OrderedDict()
+        self.props = OrderedDict()
+        self.itemId = None
+        self.anum = None
+
+class MarkupDigest(object):
+    """Digests of post markup and of markup with images scraped into it, plus remote urls of images markup resolved to"""
+    __slots__ = ('markup', 'scrapedMarkup', 'imageRemotes')
+
+    def __init__(self, markup, scrapedMarkup, imageRemotes):
+        self.markup = markup
+        self.scrapedMarkup = scrapedMarkup
+        self.imageRemotes = imageRemotes
 
 class PostProcessor:
     def __init__(self, generatorName, environment):
         self.generatorName = generatorName
         self.e = common.DotDict(environment)
 
-        self.eventKeyRegex = re.compile('^events_\d+_(\w+)$', re.I) # matches something like events_1_(title)
-        self.propKeyNameRegex = re.compile('^(prop_\d+_)name$', re.I) # matches something like (prop_1_)name
-        self.propValueNamePattern = '%svalue'
         self.propertyHandlers = { 'event': [self.UnquotePlus, self.ScrapeImages], 'taglist': [self.TransformTaglist] }
-        self.itemKeyRegex = re.compile('^sync_(\d+)_item$', re.I)
+        self.syncItemKeyPattern = 'sync_%d_item'
+        self.syncTimeKeyPattern = 'sync_%d_time'
         self.postIdRegex = re.compile('^L-(\d+)$', re.I)
         self.lastSyncFileName = 'lastsync.dat'
+        self.metrics = self.e.metrics if self.e.metrics is not None else JournalMetrics(self.e.sectionName, self.e.journal)
+        self.lastFullSyncFileName = 'lastfullsync.dat'
+        self.syncItemsIndexFileName = 'cachedsyncitems.dat'
+        self.syncItems = None
+        self.failedPostIdsFileName = 'failedposts.dat'
+        self.progressLogFileName = 'postprogress.dat'
+        self.dayCountKeyRegex = re.compile('^\d{4}-\d{2}-\d{2}$') # getdaycounts returns post counts keyed by dates like 2016-12-06
         self.minSyncDate = datetime.datetime(1999, 3, 18, 0, 0, 0) # on this day LJ started working
-        self.postItemIdRegex = re.compile('^events_\d+_itemid$', re.I)
-        self.postAnumRegex = re.compile('^events_\d+_anum$', re.I)
         self.cachedImagePathsFileName = 'cachedimagepaths.xml'
         self.imagesFolder = 'images'
+        self.markupDigestsFileName = 'cachedmarkupdigests.xml'
+        self.markupDigests = None # post db id -> MarkupDigest of the last scraping, read when the first post is scraped
+        self.markupDigestsChanged = False
 
         # exclude properties like events_1_count from post export
         self.__defaultEventPropertiesToExclude = ['logtime', 'count']
@@ -33,6 +68,8 @@ class PostProcessor:
         self.__defaultPropPropertiesToExclude = ['useragent', 'commentalter', 'current_moodid', 'interface', 'give_features', 'langs', 'personifi_tags', 'revtime',
                                           'revnum', 'picture_mapid', 'import_source', 'opt_backdated', 'allowmask', 'opt_nocomments', 'opt_preformatted', 'hasscreened',
                                           'used_rte', 'personifi_lang', 'personifi_word_count', 'reading_time', 'spam_counter']
+        self.eventPropertiesToExclude = frozenset(self.__defaultEventPropertiesToExclude + list(self.e.eventPropertiesToExclude or []))
+        self.propPropertiesToExclude = frozenset(self.__defaultPropPropertiesToExclude + list(self.e.propPropertiesToExclude or []))
 
         # create image scraper settings. Ugly configuration, but it ensures we only take one pass through post HTML to download pics and change tags accordingly,
 	# and also don't constantly open & close image mapping file
@@ -42,94 +79,259 @@ class PostProcessor:
                                     'journal': self.e.journal,
                                     'cachedImagesXml': common.ReadXmlFileOrDefault(os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal,
                                                                                                 self.e.cachedDataFolder, self.cachedImagePathsFileName), 'images'),
-                                    'imagesFolder': self.imagesFolder
+                                    'imagesFolder': self.imagesFolder,
+                                    'sharedImagesPath': os.path.join(common.GetUpperLevelDir(), self.e.sharedImagesFolder) if self.e.shareImages else None,
+                                    'metrics': self.metrics
                                     }
+        if self.imageScraperSettings is not None:
+            # indexes over image cache, so that we don't have to search through the whole of it for every image of every post
+            cachedImagesXml = self.imageScraperSettings['cachedImagesXml']
+            self.imageScraperSettings['cachedImagesByRemote'] = dict((imageInfo.attrib['remote'], imageInfo) for imageInfo in cachedImagesXml.iterfind('image'))
+            self.imageScraperSettings['cachedImagesByPostId'] = self.GetCachedImagesByPostId(cachedImagesXml)
         self.logger = logging.getLogger('log')
 		
     def ProcessPosts(self):	
-        #getting all available sync items because we'll use it to determine whether we need to delete local posts
-        allSyncItems = self.GetSyncItems(self.minSyncDate)
+        #if previous run was interrupted, saving its progress first
+        recentlySavedPostTimes = self.FoldProgressLog()
         #getting last synchronization date 
         lastSyncDate = self.GetLastSyncDate()
+        #getting all available sync items because we'll use them to determine whether we need to delete local posts.
+        #usually it's local post index plus items changed since last sync, full post history is fetched from server only from time to time
+        isFullSync = self.IsFullSyncDue()
+        if isFullSync:
+            allSyncItems = self.GetSyncItems(self.minSyncDate)
+        else:
+            cachedSyncItems = self.syncItems if self.syncItems is not None else self.ReadSyncItemsIndex()
+            allSyncItems = self.MergeSyncItems(cachedSyncItems, self.GetSyncItems(lastSyncDate))
+            with self.metrics.Measure('sleep'):
+                time.sleep(self.e.delay)
+            serverPostCount = self.GetServerPostCount()
+            if serverPostCount is not None and serverPostCount != len(allSyncItems):
+                # some posts were deleted (or index got out of sync somehow), let's fetch full post history
+                self.logger.info(u'%s: %s: server has %d post(s) while local post index has %d, getting full post history' %
+                                 (self.e.sectionName, self.e.journal, serverPostCount, len(allSyncItems)))
+                with self.metrics.Measure('sleep'):
+                    time.sleep(self.e.delay)
+                allSyncItems = self.GetSyncItems(self.minSyncDate)
+                isFullSync = True
+                if serverPostCount != len(allSyncItems):
+                    # counts still differ, so it isn't the index: every next run is going to get full post history again
+                    self.logger.warning(u'%s: %s: server has %d post(s) while full post history has %d, post count check will keep failing' %
+                                        (self.e.sectionName, self.e.journal, serverPostCount, len(allSyncItems)))
+        self.SaveSyncItemsIndex(allSyncItems)
+        self.syncItems = allSyncItems # kept in memory in case the same processor is asked to process posts again
 
-        # getting sync items that are new or modified since last sync date
-        syncItemsToUpdate = filter(lambda elem: elem['time'] > lastSyncDate, allSyncItems)
+        # getting sync items that are new or modified since last sync date, plus the ones that failed on previous runs.
+        # posts saved by interrupted run are skipped unless they were edited since
+        previouslyFailedPostIds = self.ReadFailedPostIds()
+        syncItemsToUpdate = filter(lambda elem: (elem.time > lastSyncDate and recentlySavedPostTimes.get(elem.id) != elem.time) or elem.id in previouslyFailedPostIds, allSyncItems)
+        failedPostIds = set(syncItem.id for syncItem in syncItemsToUpdate if syncItem.id in previouslyFailedPostIds) # failed posts deleted on server are forgotten
         lenSyncItems = len(syncItemsToUpdate)
-        self.logger.info(u'%s: %s: got %d post info(s) to add or update' % (self.e.sectionName, self.e.journal, lenSyncItems))
+        self.logger.info(u'%s: %s: got %d post info(s) to add or update, %d of them failed before' % (self.e.sectionName, self.e.journal, lenSyncItems, len(failedPostIds)))
 		
         if self.e.applyXSLT: # copy stylesheet to journal folder
             self.CopyStylesheetToJournalFolder()
                     
-        #retrieving posts
+        #retrieving posts. Post that fails is skipped and remembered to be retried on next run,
+        #every processed post is appended to progress log, so interrupted run doesn't fetch saved posts again
         postIdsMap = {} # saves database post ids and public post ids
-        exception = None
-        currentI = -1
+        newSyncDate = lastSyncDate
         for i, postInfo in enumerate(syncItemsToUpdate):
+            if common.IsDeadlineNear(self.e.deadline):
+                self.logger.info(u'%s: %s: run time is almost over, %d post(s) left for next run' % (self.e.sectionName, self.e.journal, lenSyncItems - i))
+                newSyncDate = self.GetSyncDateBefore(syncItemsToUpdate, i, newSyncDate)
+                break
             try:
-                time.sleep(self.e.delay) # sleeping so that we're not making calls too often
-                currentI = i
-                self.logger.info(u'%s: %s: %d of %d: getting post with id = %d modified on %s' %
-                            (self.e.sectionName, self.e.journal, i + 1, lenSyncItems, postInfo['id'], postInfo['time'].strftime(self.e.dateFormatString)))
-                post = self.GetPost(postInfo['id'])
-                publicPostId = self.GetPublicPostId(post)
-                postFileName = u'%d.xml' % publicPostId
-                self.SavePostToFile(post, postFileName)
-                self.logger.info(u'%s: %s: post with id = %d saved as %s' % (self.e.sectionName, self.e.journal, postInfo['id'], postFileName))
-                postIdsMap[postInfo['id']] = publicPostId
+                with self.metrics.Measure('sleep'):
+                    time.sleep(self.e.delay) # sleeping so that we're not making calls too often
+                self.logger.info(u'%s: %s: %d of %d: getting post with id = %d modified on %s',
+                            self.e.sectionName, self.e.journal, i + 1, lenSyncItems, postInfo.id, postInfo.time.strftime(self.e.dateFormatString))
+                with self.metrics.Measure('stage.post', {'postId': postInfo.id}):
+                    postData = self.GetPost(postInfo.id)
+                    with self.metrics.Measure('parse.post'):
+                        post = self.DecodePostData(postData)
+                    publicPostId = self.GetPublicPostId(post)
+                    postFileName = u'%d.xml' % publicPostId
+                    self.SavePostToFile(post, postFileName)
+                self.logger.info(u'%s: %s: post with id = %d saved as %s', self.e.sectionName, self.e.journal, postInfo.id, postFileName)
+                postIdsMap[postInfo.id] = publicPostId
+                failedPostIds.discard(postInfo.id)
+                self.metrics.Increment('postsSaved')
             except Exception as e:
-                self.logger.debug(u'%s: %s: exception on retrieving or saving post with id = %d' % (self.e.sectionName, self.e.journal, syncItemsToUpdate[i]['id']), exc_info = True)
-                exception = e
-                break
-        self.RemoveDeletedPosts(allSyncItems) # if any posts were deleted on server, let's delete them in our copy
+                self.logger.debug(u'%s: %s: exception on retrieving or saving post with id = %d', self.e.sectionName, self.e.journal, postInfo.id, exc_info = True)
+                self.logger.warning(u'%s: %s: could not retrieve or save post with id = %d, it will be retried on next run: %s', self.e.sectionName, self.e.journal, postInfo.id, e)
+                failedPostIds.add(postInfo.id)
+                self.metrics.Increment('postsFailed')
+            newSyncDate = max(newSyncDate, postInfo.time) # syncItems are sorted by time ASC
+            self.AppendToProgressLog(postInfo, postIdsMap.get(postInfo.id), self.GetSyncDateBefore(syncItemsToUpdate, i + 1, newSyncDate))
+
+        if isFullSync:
+            self.RemoveDeletedPosts(allSyncItems) # if any posts were deleted on server, let's delete them in our copy
+            self.SaveLastFullSyncDate(datetime.datetime.now())
+        self.SaveProgress(postIdsMap, failedPostIds, newSyncDate)
+
+        if len(failedPostIds) > 0:
+            self.logger.error(u'%s: %s: %d post(s) could not be retrieved or saved and will be retried on next run, their ids are %s' %
+                              (self.e.sectionName, self.e.journal, len(failedPostIds), u', '.join(str(postId) for postId in sorted(failedPostIds))))
+
+    def GetSyncDateBefore(self, syncItems, nextIndex, syncDate):
+        """Returns syncDate if sync item at nextIndex (which is not processed yet) is newer than it, otherwise the second before that item,
+            so that saving returned date as last sync date never skips unprocessed items that have the same time as processed ones"""
+        if nextIndex < len(syncItems) and syncItems[nextIndex].time <= syncDate:
+            return syncItems[nextIndex].time - datetime.timedelta(seconds = 1)
+        return syncDate
+
+    def SaveProgress(self, postIdsMap, failedPostIds, syncDate):
+        """Saves db id -> public id mapping of saved posts, ids of failed posts and new sync date in this order,
+            then removes progress log, so that a run interrupted in between never loses a post"""
         self.SavePostIdsMap(postIdsMap)
+        self.SaveMarkupDigests()
+        self.SaveFailedPostIds(failedPostIds)
+        if syncDate > self.minSyncDate:
+            self.SaveLastSyncDate(syncDate)
+        progressLogPath = os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal, self.e.cachedDataFolder, self.progressLogFileName)
+        if os.path.exists(progressLogPath):
+            os.remove(progressLogPath)
 
-        if len(syncItemsToUpdate) > 0:
-            if exception is None:
-                # syncItems is sorted by time ASC, so we can just take the last element of the array as new sync date
-                self.SaveLastSyncDate(syncItemsToUpdate[len(syncItemsToUpdate) - 1]['time'])
-            else:
-                # if there's a exception, take last processed post datetime as new sync date
-                lastProcessedI = currentI - 1
-                if lastProcessedI >= 0:
-                    self.SaveLastSyncDate(syncItemsToUpdate[lastProcessedI]['time'])
-                raise exception
+    def AppendToProgressLog(self, syncItem, publicPostId, syncDate):
+        """Appends post db id, public id (empty if post failed), time post was last edited and sync date that is safe to save after it
+            to progress log. Line goes to disk right away, so interrupted run loses at most the post it was working on"""
+        path = os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal, self.e.cachedDataFolder, self.progressLogFileName)
+        common.CreatePathIfNotExists(path)
+        with self.metrics.Measure('write.progressLog'), open(path, "a") as progressLogFile:
+            progressLogFile.write('%d\t%s\t%s\t%s\n' % (syncItem.id, publicPostId if publicPostId is not None else '',
+                                                       syncItem.time.strftime(self.e.dateFormatString), syncDate.strftime(self.e.dateFormatString)))
+            progressLogFile.flush()
+            os.fsync(progressLogFile.fileno())
+
+    def FoldProgressLog(self):
+        """Saves progress log left by interrupted run into post ids map, failed posts and last sync date.
+            Returns db id -> time of posts that run saved, so that they aren't fetched again"""
+        path = os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal, self.e.cachedDataFolder, self.progressLogFileName)
+        savedPostTimes = {}
+        if not os.path.exists(path):
+            return savedPostTimes
+        postIdsMap = {}
+        failedPostIds = self.ReadFailedPostIds()
+        syncDate = self.minSyncDate
+        with open(path, "r") as progressLogFile:
+            for line in progressLogFile:
+                if not line.endswith('\n'): # run was killed while writing this line
+                    continue
+                try:
+                    postId, publicPostId, postTime, lineSyncDate = line.rstrip('\n').split('\t')
+                    postId = int(postId)
+                    publicPostId = int(publicPostId) if publicPostId else None
+                    postTime = datetime.datetime.strptime(postTime, self.e.dateFormatString)
+                    lineSyncDate = datetime.datetime.strptime(lineSyncDate, self.e.dateFormatString)
+                except ValueError:
+                    continue
+                if publicPostId is None:
+                    failedPostIds.add(postId)
+                else:
+                    postIdsMap[postId] = publicPostId
+                    savedPostTimes[postId] = postTime
+                    failedPostIds.discard(postId)
+                syncDate = max(syncDate, lineSyncDate)
+        self.logger.info(u'%s: %s: previous run was interrupted, saving its progress: %d post(s) saved, %d post(s) to retry' %
+                         (self.e.sectionName, self.e.journal, len(postIdsMap), len(failedPostIds)))
+        self.SaveProgress(postIdsMap, failedPostIds, syncDate)
+        return savedPostTimes
 
+    def ReadFailedPostIds(self):
+        """Reads db ids of posts that couldn't be retrieved or saved on previous runs, one per line"""
+        path = os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal, self.e.cachedDataFolder, self.failedPostIdsFileName)
+        if not os.path.exists(path):
+            return set()
+        with open(path, "r") as failedPostIdsFile:
+            return set(int(line) for line in failedPostIdsFile if line.strip().isdigit())
+
+    def SaveFailedPostIds(self, failedPostIds):
+        path = os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal, self.e.cachedDataFolder, self.failedPostIdsFileName)
+        if len(failedPostIds) > 0:
+            common.WriteFileAtomically(path, ''.join('%d\n' % postId for postId in sorted(failedPostIds)))
+        elif os.path.exists(path):
+            os.remove(path)
 
-    def GetSyncItems(self, startDate, result = None):
+    def GetSyncItems(self, startDate):
         """Gets post db ids and times they were created or last edited starting from startDate"""
-        if result == None:
+        with self.metrics.Measure('stage.syncItems'):
             result = []
-        params = {'lastsync': startDate.strftime(self.e.dateFormatString)}
-        self.logger.info(u'%s: %s: getting post info for syncronization starting from = %s...' % (self.e.sectionName, self.e.journal, params['lastsync']))
+            connParams = {'server': self.e.server, 'user': self.e.journal, 'pwdhash': self.e.passwordHash }
+            pageStartDate = startDate
+            while True:
+                params = {'lastsync': pageStartDate.strftime(self.e.dateFormatString)}
+                self.logger.info(u'%s: %s: getting post info for syncronization starting from = %s...', self.e.sectionName, self.e.journal, params['lastsync'])
 
-        #returns Array ( [sync_1_action] => create [sync_1_item] => L-1234 [sync_1_time] => 2016-12-06 03:25:00
-        # [sync_2_action] => create [sync_2_item] => L-1235 [sync_2_time] => 2016-12-06 03:27:33 [sync_count] => 2 [sync_total] => 2 )
-        connParams = {'server': self.e.server, 'user': self.e.journal, 'pwdhash': self.e.passwordHash }		
-        syncItems = self.e.cnn.MakeServerRequestWithAuthentication(connParams, 'syncitems', params)
+                #returns Array ( [sync_1_action] => create [sync_1_item] => L-1234 [sync_1_time] => 2016-12-06 03:25:00
+                # [sync_2_action] => create [sync_2_item] => L-1235 [sync_2_time] => 2016-12-06 03:27:33 [sync_count] => 2 [sync_total] => 2 )
+                syncItems = self.e.cnn.MakeServerRequestWithAuthentication(connParams, 'syncitems', params)
+                syncCount = int(syncItems['sync_count'])
+                maxDateFound = pageStartDate
+                for i in xrange(1, syncCount + 1):
+                    itemDateTime = common.ParseServerDateTime(syncItems[self.syncTimeKeyPattern % i])
+                    postIdMatches = self.postIdRegex.search(syncItems[self.syncItemKeyPattern % i])
+                    if postIdMatches:
+                        result.append(SyncItem(int(postIdMatches.group(1)), itemDateTime)) # postIdRegex.group(1) matches (\d+) in ^L-(\d+)$'
+                    if itemDateTime > maxDateFound:
+                        maxDateFound = itemDateTime
 
-        timeKeyPattern = 'sync_%s_time'
-        syncItemKeys = syncItems.keys()
-        maxDateFound = startDate
-            
-        for key in syncItemKeys:
-            numberMatches = self.itemKeyRegex.search(key)
-            if numberMatches:
-                timeKey = timeKeyPattern % (numberMatches.group(1))
-                normalizedDateTimeString = re.sub('\.\d+$', '', syncItems[timeKey]) #chops off .00000 in dates like 2000-12-12 09:00:00.00000
-                itemDateTime = datetime.datetime.strptime(normalizedDateTimeString, self.e.dateFormatString)
-
-                postIdMatches = self.postIdRegex.search(syncItems[key])
-                if postIdMatches:
-                    result.append({'id': int(postIdMatches.group(1)), 'time': itemDateTime}) # postIdRegex.group(1) matches (\d+) in ^L-(\d+)$'
-
-                if itemDateTime > maxDateFound:
-                    maxDateFound = itemDateTime
-        
-        if int(syncItems['sync_count']) < int(syncItems['sync_total']):
-            time.sleep(self.e.delay)
-            self.GetSyncItems(maxDateFound, result)
-
-        return sorted(result, key=lambda elem: elem['time']) # sort by time asc
+                if syncCount >= int(syncItems['sync_total']) or maxDateFound == pageStartDate:
+                    break
+                pageStartDate = maxDateFound
+                with self.metrics.Measure('sleep'):
+                    time.sleep(self.e.delay)
+
+            result.sort(key=lambda elem: elem.time) # sort by time asc
+        return result
+
+    def MergeSyncItems(self, cachedSyncItems, newSyncItems):
+        """Updates cached sync items with new ones by post db id, returns merged sync items sorted by time asc"""
+        mergedSyncItems = OrderedDict((syncItem.id, syncItem) for syncItem in cachedSyncItems)
+        for syncItem in newSyncItems:
+            mergedSyncItems[syncItem.id] = syncItem
+        return sorted(mergedSyncItems.itervalues(), key=lambda elem: elem.time)
+
+    def GetServerPostCount(self):
+        """Gets number of posts in journal from server with one getdaycounts call. Returns None if server can't tell"""
+        #returns Array ( [2016-12-06] => 2 [2016-12-07] => 1 )
+        connParams = {'server': self.e.server, 'user': self.e.journal, 'pwdhash': self.e.passwordHash }
+        try:
+            dayCounts = self.e.cnn.MakeServerRequestWithAuthentication(connParams, 'getdaycounts', {})
+        except (RuntimeError, IOError): # server error or no response after all retries
+            self.logger.debug(u'%s: %s: could not get post counts from server' % (self.e.sectionName, self.e.journal), exc_info = True)
+            return None
+        return sum(int(count) for day, count in dayCounts.iteritems() if self.dayCountKeyRegex.search(day))
+
+    def IsFullSyncDue(self):
+        """Full post history should be fetched if there's no local post index yet or if fullSyncIntervalDays passed since last full sync"""
+        if not os.path.exists(os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal, self.e.cachedDataFolder, self.syncItemsIndexFileName)):
+            return True
+        lastFullSyncDate = self.GetLastFullSyncDate()
+        return lastFullSyncDate is None or datetime.datetime.now() - lastFullSyncDate >= datetime.timedelta(days = self.e.fullSyncIntervalDays)
+
+    def ReadSyncItemsIndex(self):
+        """Reads local post index: lines of post db id and time it was created or last edited separated by tab.
+            Index that can't be read is returned empty, post count then doesn't match server's and full post history is fetched"""
+        path = os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal, self.e.cachedDataFolder, self.syncItemsIndexFileName)
+        result = []
+        if not os.path.exists(path):
+            self.logger.debug(u'Didn\'t find file %s, returning empty post index' % path)
+            return result
+        with open(path, "r") as syncItemsIndexFile:
+            for line in syncItemsIndexFile:
+                if line.strip():
+                    try:
+                        postId, postTime = line.strip().split('\t')
+                        result.append(SyncItem(int(postId), datetime.datetime.strptime(postTime, self.e.dateFormatString)))
+                    except ValueError:
+                        self.logger.warning(u'%s: %s: post index %s is damaged, it will be rebuilt' % (self.e.sectionName, self.e.journal, path))
+                        return []
+        return result
+
+    def SaveSyncItemsIndex(self, syncItems):
+        path = os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal, self.e.cachedDataFolder, self.syncItemsIndexFileName)
+        common.WriteFileAtomically(path, ''.join('%d\t%s\n' % (syncItem.id, syncItem.time.strftime(self.e.dateFormatString)) for syncItem in syncItems))
 
     def GetPost(self, postId):
         """Loads individual post data by its db id"""
@@ -138,7 +340,30 @@ class PostProcessor:
         postData = self.e.cnn.MakeServerRequestWithAuthentication(connParams, 'getevents', params)
         return postData
 
-    def FlatPostDataToXmlObject(self, postData):
+    def DecodePostData(self, postData):
+        """Classifies keys of getevents answer like events_1_subject, prop_1_name and prop_1_value into PostRecord in one pass"""
+        postRecord = PostRecord()
+        propNames = OrderedDict() # prop number -> prop name
+        propValues = {} # prop number -> prop value
+        for key, value in postData.iteritems():
+            keyParts = key.split('_', 2) # events_1_subject -> events, 1, subject
+            if len(keyParts) != 3:
+                continue
+            keyType, number, name = keyParts
+            if keyType == 'events':
+                postRecord.events[name] = value
+            elif keyType == 'prop':
+                if name == 'name':
+                    propNames[number] = value
+                elif name == 'value':
+                    propValues[number] = value
+        for number, propName in propNames.iteritems():
+            postRecord.props[propName] = propValues.get(number)
+        postRecord.itemId = postRecord.events.get('itemid')
+        postRecord.anum = postRecord.events.get('anum')
+        return postRecord
+
+    def FlatPostDataToXmlObject(self, postRecord, previousPostXml = None):
         xmlRoot = Element('post')
 
         # create mandatory default properties
@@ -148,77 +373,62 @@ class PostProcessor:
         common.CreateXmlElement('source_shortname', self.e.sectionName, xmlRoot)
         common.CreateXmlElement('author', self.e.journal, xmlRoot)
         common.CreateXmlElement('author_url', common.CreateAuthorUrl(self.e.serverSchema, self.e.serverNetloc, self.e.journal), xmlRoot)
-            
-        postDataKeys = postData.keys()
-        for key in postDataKeys:
-            eventKeyNameMatches = self.eventKeyRegex.search(key)
-            propKeyNameMatches = self.propKeyNameRegex.search(key)
-
-            xmlSubElement = None
-            xmlSubElementValue = None
-            xmlSubElementName = None
-            xmlPostDataKey = None
-            
-            if eventKeyNameMatches:
-                eventKeyName = eventKeyNameMatches.group(1)
-                if not (eventKeyName in self.e.eventPropertiesToExclude or eventKeyName in self.__defaultEventPropertiesToExclude):
-                    xmlSubElementName = eventKeyName
-                    xmlPostDataKey = key
-            elif propKeyNameMatches:
-                propKeyName = postData[key]
-                if not (propKeyName in self.e.propPropertiesToExclude or propKeyName in self.__defaultPropPropertiesToExclude):
-                    xmlSubElementName = propKeyName
-                    xmlPostDataKey = self.propValueNamePattern % propKeyNameMatches.group(1) # produces something like prop_1_value
-
-            if xmlSubElementName:
-                xmlSubElementValue = postData[xmlPostDataKey]
-                if xmlSubElementName in self.propertyHandlers:
-                    for handler in self.propertyHandlers[xmlSubElementName]:
-                        xmlSubElementValue = handler(xmlSubElementValue, postId = common.FindDictValueByKeyRegex(postData, self.postItemIdRegex))
-                common.CreateXmlElement(xmlSubElementName, xmlSubElementValue, xmlRoot)           
-        
+
+        for properties, propertiesToExclude in [(postRecord.events, self.eventPropertiesToExclude), (postRecord.props, self.propPropertiesToExclude)]:
+            for xmlSubElementName, xmlSubElementValue in properties.iteritems():
+                if xmlSubElementName in propertiesToExclude:
+                    continue
+                for handler in self.propertyHandlers.get(xmlSubElementName, []):
+                    xmlSubElementValue = handler(xmlSubElementValue, postId = postRecord.itemId, previousPostXml = previousPostXml)
+                common.CreateXmlElement(xmlSubElementName, xmlSubElementValue, xmlRoot)
+
         return xmlRoot
 
 
-    def SavePostToFile(self, postData, fileName):
+    def SavePostToFile(self, postRecord, fileName):
+        postXml = None
         try:
-            postXml = self.FlatPostDataToXmlObject(postData)
             path = os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal, fileName)
-            # if file with this name already exists, pick up its comments first before rewriting it
+            # if file with this name already exists, pick up its comments before rewriting it, its markup may be reused too
             fileDoesNotExistTag = 'FileDoesNotExist'
-            oldPostXml = common.ReadXmlFileOrDefault(path, fileDoesNotExistTag)
+            with self.metrics.Measure('parse.postFile'):
+                oldPostXml = common.ReadXmlFileOrDefault(path, fileDoesNotExistTag)
+            postXml = self.FlatPostDataToXmlObject(postRecord, oldPostXml if oldPostXml.tag != fileDoesNotExistTag else None)
             if oldPostXml.tag != fileDoesNotExistTag:
                 oldCommentsXml = oldPostXml.find('comments')
                 if oldCommentsXml is not None:
                     common.CreateXmlElement('comments', oldCommentsXml, postXml)
             # convert post xml to string
             xsltFile = self.e.xsltFile if self.e.applyXSLT else None
-            postXmlString = common.PrettyPrintXml(postXml, xsltFile)
+            with self.metrics.Measure('serialize.post'):
+                postXmlString = common.PrettyPrintXml(postXml, xsltFile)
             # write post xml string to file
             common.CreatePathIfNotExists(path)
-            with open(path, "w") as postFile:
+            with self.metrics.Measure('write.post'), open(path, "w") as postFile:
                 postFile.write(postXmlString.encode('utf-8'))
         except:
-            self.logger.debug('Post data: %s' % postData)
-            for node in postXml:
-                self.logger.debug('PostXml: tag: %s' % node.tag)
-                self.logger.debug('PostXml: textType: %s' % type(node.text))
-                self.logger.debug('PostXml: text: %s' % node.text)
+            self.logger.debug('Post data: %s %s', postRecord.events, postRecord.props)
+            if postXml is not None:
+                for node in postXml:
+                    self.logger.debug('PostXml: tag: %s', node.tag)
+                    self.logger.debug('PostXml: textType: %s', type(node.text))
+                    self.logger.debug('PostXml: text: %s', node.text)
             raise
                     
     def SavePostIdsMap(self, postIdsMap):
         if len(postIdsMap) > 0:
             path = os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal, self.e.cachedDataFolder, self.e.cachedPostIdsFile)
             previouslyCachedIds = common.ReadXmlFileOrDefault(path, 'posts')
+            cachedDbIds = set(cachedId.attrib['dbid'] for cachedId in previouslyCachedIds.iterfind('post'))
             
             for dbId in postIdsMap:
-                if previouslyCachedIds.find('post[@dbid="%d"]' % dbId) is None: # didn't find anything cached with current dbId
+                if str(dbId) not in cachedDbIds: # didn't find anything cached with current dbId
                       newlyCachedId = SubElement(previouslyCachedIds, 'post')
                       newlyCachedId.attrib['dbid'] = str(dbId)
                       newlyCachedId.attrib['publicid'] = str(postIdsMap[dbId])
 
             common.CreatePathIfNotExists(path)
-            with open(path, "w") as cachedIdsFile:
+            with self.metrics.Measure('write.postIds'), open(path, "w") as cachedIdsFile:
                 cachedIdsFile.write(tostring(previouslyCachedIds, 'utf-8').encode('utf-8'))
 				
     def RemoveDeletedPosts(self, syncItemsToCheckForDeletion):
@@ -227,38 +437,58 @@ class PostProcessor:
         cachedImagePathsPath = os.path.join(journalPath, self.e.cachedDataFolder, self.cachedImagePathsFileName)
         noCachedInfoTag = 'NoCachedInfo'
         cachedPostIdsXml = common.ReadXmlFileOrDefault(cachedPostIdsPath, noCachedInfoTag)
-        cachedImagePathsXml = common.ReadXmlFileOrDefault(cachedImagePathsPath, noCachedInfoTag)
+        # image scraping keeps image cache in memory, in daemon mode between runs too, so deleted images are removed from it and its indexes rather than from a fresh copy
+        cachedImagesByRemote = None
+        if self.imageScraperSettings is not None:
+            cachedImagePathsXml = self.imageScraperSettings['cachedImagesXml']
+            cachedImagesByRemote = self.imageScraperSettings['cachedImagesByRemote']
+        else:
+            cachedImagePathsXml = common.ReadXmlFileOrDefault(cachedImagePathsPath, noCachedInfoTag)
         filesToDelete = []
         imagesToDelete = []
         forceImagesMapRewrite = False
         if len(syncItemsToCheckForDeletion) > 0 and cachedPostIdsXml.tag != noCachedInfoTag:
-            existingPostIds = [syncItem['id'] for syncItem in syncItemsToCheckForDeletion]
-            cachedPostIds = list(cachedPostIdsXml)
-            filesToDelete = []
-            for cachedPostInfo in cachedPostIds:
-                if int(cachedPostInfo.attrib['dbid']) not in existingPostIds:
-                    filesToDelete.append('%s.xml' % cachedPostInfo.attrib['publicid'])
-                    cachedPostIdsXml.remove(cachedPostInfo)
-                    if cachedImagePathsXml.tag != noCachedInfoTag:
-                        imagesRelatedToPost = cachedImagePathsXml.findall('.//post[@dbid="%s"]../..' % cachedPostInfo.attrib['dbid']) # find parent of parent of 'post' with dbid
-                        for imageInfo in imagesRelatedToPost:
-                            if len(imageInfo.findall('posts/post')) == 1: # image is related only to this post, delete it
-                                imagesToDelete.append(imageInfo.attrib['local'])
-                                cachedImagePathsXml.remove(imageInfo)
-                            else: # image is related to other posts, don't touch it but remove post reference from it
-                                postNode = imageInfo.find('posts/post[@dbid="%s"]' % cachedPostInfo.attrib['dbid'])
-                                imageInfo.find('posts').remove(postNode)
-                            forceImagesMapRewrite = True
-                            
+            cachedPostInfos = OrderedDict((int(cachedPostInfo.attrib['dbid']), cachedPostInfo) for cachedPostInfo in cachedPostIdsXml)
+            existingPostIds = dict.fromkeys(syncItem.id for syncItem in syncItemsToCheckForDeletion)
+            deletedPostIds = common.GetReconciliationDelta(dict.fromkeys(cachedPostInfos), existingPostIds)['deleted']
+            if self.imageScraperSettings is not None:
+                imagesByPostId = self.imageScraperSettings['cachedImagesByPostId']
+            else:
+                imagesByPostId = self.GetCachedImagesByPostId(cachedImagePathsXml) if len(deletedPostIds) > 0 and cachedImagePathsXml.tag != noCachedInfoTag else {}
+            deletedImageInfos = []
+            for deletedPostId in deletedPostIds:
+                cachedPostInfo = cachedPostInfos[deletedPostId]
+                filesToDelete.append('%s.xml' % cachedPostInfo.attrib['publicid'])
+                for imageInfo in imagesByPostId.pop(cachedPostInfo.attrib['dbid'], []):
+                    if len(imageInfo.findall('posts/post')) == 1: # image is related only to this post, delete it
+                        imagesToDelete.append(imageInfo.attrib['local'])
+                        deletedImageInfos.append(imageInfo)
+                        if cachedImagesByRemote is not None:
+                            cachedImagesByRemote.pop(imageInfo.attrib['remote'], None)
+                    else: # image is related to other posts, don't touch it but remove post reference from it
+                        postNode = imageInfo.find('posts/post[@dbid="%s"]' % cachedPostInfo.attrib['dbid'])
+                        imageInfo.find('posts').remove(postNode)
+                    forceImagesMapRewrite = True
+            common.RemoveChildren(cachedPostIdsXml, [cachedPostInfos[deletedPostId] for deletedPostId in deletedPostIds])
+            common.RemoveChildren(cachedImagePathsXml, deletedImageInfos)
+
         self.logger.info(u'%s: %s: found %d post file(s) to delete and %d image(s) related to these post(s)...' %
                          (self.e.sectionName, self.e.journal, len(filesToDelete), len(imagesToDelete)))
         self.UpdateFilesMapping(cachedPostIdsPath, cachedPostIdsXml, filesToDelete, journalPath, 'post')
         self.UpdateFilesMapping(cachedImagePathsPath, cachedImagePathsXml, imagesToDelete, os.path.join(journalPath, self.imagesFolder), 'image', forceImagesMapRewrite)
 					
+    def GetCachedImagesByPostId(self, cachedImagePathsXml):
+        """Indexes cached image infos by db ids of posts they are related to in one pass over image cache"""
+        imagesByPostId = {}
+        for imageInfo in cachedImagePathsXml.iterfind('image'):
+            for postNode in imageInfo.iterfind('posts/post'):
+                imagesByPostId.setdefault(postNode.attrib['dbid'], []).append(imageInfo)
+        return imagesByPostId
+
     def UpdateFilesMapping(self, itemCacheFilePath, itemCacheXml, itemsToDelete, pathToItems, itemName, forceMapRewrite = False):
         if len(itemsToDelete) > 0 or forceMapRewrite:
             common.CreatePathIfNotExists(itemCacheFilePath)
-            with open(itemCacheFilePath, "w") as itemCacheFile:
+            with self.metrics.Measure('write.%sCache' % itemName), open(itemCacheFilePath, "w") as itemCacheFile:
                 itemCacheFile.write(tostring(itemCacheXml, 'utf-8').encode('utf-8'))
 
             for itemToDelete in itemsToDelete:
@@ -266,8 +496,8 @@ class PostProcessor:
                 try:
                     os.remove(itemToDeletePath)
                 except OSError:
-                    self.logger.debug(u'%s: %s: couldn\'t delete %s file %s because it does not exist' % (self.e.sectionName, self.e.journal, itemName, itemToDeletePath))
-                self.logger.info(u'%s: %s: deleted %s file %s' % (self.e.sectionName, self.e.journal, itemName, itemToDeletePath))
+                    self.logger.debug(u'%s: %s: couldn\'t delete %s file %s because it does not exist', self.e.sectionName, self.e.journal, itemName, itemToDeletePath)
+                self.logger.info(u'%s: %s: deleted %s file %s', self.e.sectionName, self.e.journal, itemName, itemToDeletePath)
 
     def GetLastSyncDate(self):
         path = os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal, self.e.cachedDataFolder, self.lastSyncFileName)
@@ -285,6 +515,20 @@ class PostProcessor:
         with open(path, "w") as lastSyncFile:
             lastSyncFile.write(date.strftime(self.e.dateFormatString))
 
+    def GetLastFullSyncDate(self):
+        path = os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal, self.e.cachedDataFolder, self.lastFullSyncFileName)
+        if not os.path.exists(path):
+            self.logger.debug(u'Didn\'t find file %s, full sync was never done' % path)
+            return None
+        with open(path, "r") as lastFullSyncFile:
+            return datetime.datetime.strptime(lastFullSyncFile.readline().strip(), self.e.dateFormatString)
+
+    def SaveLastFullSyncDate(self, date):
+        path = os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal, self.e.cachedDataFolder, self.lastFullSyncFileName)
+        common.CreatePathIfNotExists(path)
+        with open(path, "w") as lastFullSyncFile:
+            lastFullSyncFile.write(date.strftime(self.e.dateFormatString))
+
     def CopyStylesheetToJournalFolder(self):
         copyToFolder = os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal)
         copyFromPath = os.path.join(os.getcwdu(), self.e.xsltFile)
@@ -298,14 +542,12 @@ class PostProcessor:
                 with open(copyToPath, "w") as destFile:
                     destFile.write(sourceFileContent)
 
-    def GetPublicPostId(self, postData):
-        itemId = common.FindDictValueByKeyRegex(postData, self.postItemIdRegex)
-        anum = common.FindDictValueByKeyRegex(postData, self.postAnumRegex)
-        if itemId is None:
+    def GetPublicPostId(self, postRecord):
+        if postRecord.itemId is None:
             raise ValueError(u'Could not get itemid from post data')
-        if anum is None:
+        if postRecord.anum is None:
             raise ValueError(u'Could not get anum from post data')
-        return int(itemId) * 256 + int(anum)
+        return int(postRecord.itemId) * 256 + int(postRecord.anum)
     
     def UnquotePlus(self, s, **kwargs):
         """Unquotes the quoted string"""
@@ -313,12 +555,19 @@ class PostProcessor:
 
     def ScrapeImages(self, markup, **kwargs):
         if self.imageScraperSettings is not None:
-            result = ImageScraper.ScrapeImages(markup, self.imageScraperSettings)
-            imagesToDelete = []
-            
             if 'postId' not in kwargs:
                 raise ValueError(u'Parameter postId not present in arguments list')
             postId = kwargs['postId']
+            markupDigest = self.GetMarkupDigest(markup)
+            previouslyScrapedMarkup = self.GetPreviouslyScrapedMarkup(postId, markupDigest, kwargs.get('previousPostXml'))
+            if previouslyScrapedMarkup is not None: # only tags, subject or the like were edited, images are as they were
+                self.metrics.Increment('imageScrapingSkipped')
+                return previouslyScrapedMarkup
+            result = ImageScraper.ScrapeImages(markup, self.imageScraperSettings)
+            imagesToDelete = []
+
+            cachedImagesByRemote = self.imageScraperSettings['cachedImagesByRemote']
+            postImages = self.imageScraperSettings['cachedImagesByPostId'].setdefault(postId, [])
             needCacheSaving = False
             if len(result['downloadedImageInfos']) > 0:
                 for imageInfo in result['downloadedImageInfos']:
@@ -327,10 +576,12 @@ class PostProcessor:
                     postsXml = SubElement(imgXml, 'posts')
                     postXml = SubElement(postsXml, 'post')
                     postXml.attrib['dbid'] = postId
+                    cachedImagesByRemote[imageInfo['remote']] = imgXml
+                    postImages.append(imgXml)
                 needCacheSaving = True
             if len(result['existingImageInfos']) > 0:
                 for imageInfo in result['existingImageInfos']:
-                    imgXml = self.imageScraperSettings['cachedImagesXml'].find('image[@remote="%s"]' % imageInfo['remote'])
+                    imgXml = cachedImagesByRemote.get(imageInfo['remote'])
                     if imgXml is None:
                         raise RuntimeError(u'Couldn\'t find any cached info about image %s when it should be present' % imageInfo['remote'])
                     if len(imgXml.attrib) != len(imageInfo):
@@ -339,25 +590,27 @@ class PostProcessor:
                             imagesToDelete.append(imgXml.attrib['linkedLocal'])
                         imgXml.attrib = {k: v for k, v in imageInfo.items() if k in ['local', 'remote', 'linkedLocal', 'linkedRemote']}
                         needCacheSaving = True
-                    postsXml = imgXml.find('posts')
-                    if postsXml.find('post[@dbid="%s"]' % postId) is None:
-                        postXml = SubElement(postsXml, 'post')
+                    if imgXml not in postImages:
+                        postXml = SubElement(imgXml.find('posts'), 'post')
                         postXml.attrib['dbid'] = postId
+                        postImages.append(imgXml)
                         needCacheSaving = True
 
             # if there was an image in the post and the post got edited so that the image was deleted - delete it
-            cachedImagesRelatedToPost = self.imageScraperSettings['cachedImagesXml'].findall('.//post[@dbid="%s"]../..' % postId)
-            realPostImageInfos = result['downloadedImageInfos'] + result['existingImageInfos']
-            for cachedImageInfo in cachedImagesRelatedToPost:
-                # cached image info not found in actual images belonging to post...
-                if len(list(filter(lambda elem: elem['remote'] == cachedImageInfo.attrib['remote'], realPostImageInfos))) == 0:
-                    if len(cachedImageInfo.findall('posts/post')) == 1: #  and related to only one post: delete it
-                        imagesToDelete.extend([v for k, v in cachedImageInfo.attrib.items() if k in ['local', 'linkedLocal']])
-                        self.imageScraperSettings['cachedImagesXml'].remove(cachedImageInfo)
-                    else: # and related to other posts: remove reference to this post from it
-                        postNode = cachedImageInfo.find('posts/post[@dbid="%s"]' % postId)
-                        cachedImageInfo.find('posts').remove(postNode)
-                    needCacheSaving = True
+            cachedImagesRelatedToPost = OrderedDict((imageInfo.attrib['remote'], imageInfo) for imageInfo in postImages)
+            realPostImageRemotes = dict.fromkeys(imageInfo['remote'] for imageInfo in result['downloadedImageInfos'] + result['existingImageInfos'])
+            # cached image info not found in actual images belonging to post...
+            for deletedImageRemote in common.GetReconciliationDelta(dict.fromkeys(cachedImagesRelatedToPost), realPostImageRemotes)['deleted']:
+                cachedImageInfo = cachedImagesRelatedToPost[deletedImageRemote]
+                if len(cachedImageInfo.findall('posts/post')) == 1: #  and related to only one post: delete it
+                    imagesToDelete.extend([v for k, v in cachedImageInfo.attrib.items() if k in ['local', 'linkedLocal']])
+                    self.imageScraperSettings['cachedImagesXml'].remove(cachedImageInfo)
+                    del cachedImagesByRemote[deletedImageRemote]
+                else: # and related to other posts: remove reference to this post from it
+                    postNode = cachedImageInfo.find('posts/post[@dbid="%s"]' % postId)
+                    cachedImageInfo.find('posts').remove(postNode)
+                postImages.remove(cachedImageInfo)
+                needCacheSaving = True
                     
             # let's save updated image mappings to file every time we have something new in them
             # it's slower, but this way there's less chance that script is interrupted somewhere up the line
@@ -367,9 +620,63 @@ class PostProcessor:
                 cachedImagePathsPath = os.path.join(cacheDir, self.e.sectionName, self.e.journal, self.e.cachedDataFolder, self.cachedImagePathsFileName)
                 savedImagesFolderPath = os.path.join(cacheDir, self.e.sectionName, self.e.journal, self.imagesFolder)
                 self.UpdateFilesMapping(cachedImagePathsPath, self.imageScraperSettings['cachedImagesXml'], imagesToDelete, savedImagesFolderPath, 'image', True)
-                
+
+            # images that failed to download are retried next time, so their post's markup is scraped again even if it didn't change
+            if len(result['failedImageRemotes']) > 0:
+                self.markupDigests.pop(postId, None)
+            else:
+                self.markupDigests[postId] = MarkupDigest(markupDigest, self.GetMarkupDigest(result['updatedMarkup']),
+                                                          [imageInfo['remote'] for imageInfo in result['downloadedImageInfos'] + result['existingImageInfos']])
+            self.markupDigestsChanged = True
             return result['updatedMarkup']
         return markup
+
+    def GetMarkupDigest(self, markup):
+        """Digest of markup that doesn't depend on its line endings, XML files it's saved in don't keep them"""
+        return common.MD5(markup.replace(u'\r\n', u'\n').replace(u'\r', u'\n'))
+
+    def GetPreviouslyScrapedMarkup(self, postId, markupDigest, previousPostXml):
+        """Returns markup from post's file if the same markup was scraped into it before and all of its images are still cached for the post, otherwise None"""
+        if self.markupDigests is None:
+            self.ReadMarkupDigests()
+        digest = self.markupDigests.get(postId)
+        if digest is None or digest.markup != markupDigest or previousPostXml is None:
+            return None
+        previousMarkup = previousPostXml.findtext('event')
+        if previousMarkup is None or self.GetMarkupDigest(previousMarkup) != digest.scrapedMarkup: # file was changed since
+            return None
+        cachedImagesByRemote = self.imageScraperSettings['cachedImagesByRemote']
+        postImages = self.imageScraperSettings['cachedImagesByPostId'].get(postId, [])
+        for imageRemote in digest.imageRemotes:
+            if cachedImagesByRemote.get(imageRemote) not in postImages:
+                return None
+        return previousMarkup
+
+    def ReadMarkupDigests(self):
+        path = os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal, self.e.cachedDataFolder, self.markupDigestsFileName)
+        self.markupDigests = {}
+        for postNode in common.ReadXmlFileOrDefault(path, 'posts').iterfind('post'):
+            self.markupDigests[postNode.attrib['dbid']] = MarkupDigest(postNode.attrib['markup'], postNode.attrib['scrapedmarkup'],
+                                                                       [imageNode.attrib['remote'] for imageNode in postNode.iterfind('image')])
+
+    def SaveMarkupDigests(self):
+        """Saves markup digests if they changed, forgetting posts that are no longer in journal"""
+        if not self.markupDigestsChanged:
+            return
+        if self.syncItems is not None:
+            existingPostIds = set(str(syncItem.id) for syncItem in self.syncItems)
+            for postId in [postId for postId in self.markupDigests if postId not in existingPostIds]:
+                del self.markupDigests[postId]
+        digestsXml = Element('posts')
+        for postId in sorted(self.markupDigests, key = int):
+            digest = self.markupDigests[postId]
+            postNode = SubElement(digestsXml, 'post', OrderedDict([('dbid', postId), ('markup', digest.markup), ('scrapedmarkup', digest.scrapedMarkup)]))
+            for imageRemote in digest.imageRemotes:
+                SubElement(postNode, 'image').attrib['remote'] = imageRemote
+        path = os.path.join(common.GetUpperLevelDir(), self.e.sectionName, self.e.journal, self.e.cachedDataFolder, self.markupDigestsFileName)
+        with self.metrics.Measure('write.markupDigests'):
+            common.WriteFileAtomically(path, tostring(digestsXml, 'utf-8'))
+        self.markupDigestsChanged = False
 		
     def TransformTaglist(self, taglist, **kwargs):
         """Transforms comma-separated string of tags "tag1, tag2, tag3" into xml Element object: <root><tag>tag1</tag><tag>tag2</tag><tag>tag3</tag></root>"""
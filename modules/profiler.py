@@ -0,0 +1,90 @@
+import os
+import cProfile
+import pstats
+import random
+import datetime
+import logging
+import threading
+from cStringIO import StringIO
+
+import common
+
+try:
+    import tracemalloc # not in Python 2.7 standard library, comes with pytracemalloc on a patched Python
+except ImportError:
+    tracemalloc = None
+
+class JournalProfiler:
+    """Profiles journal runs with cProfile ('cpu' mode) and/or tracemalloc ('memory' mode) and saves results to outputFolder.
+        cProfile slows down the run it's attached to, so only sampleRate share of runs is profiled, which lets profiling stay enabled in production"""
+
+    def __init__(self, outputFolder, modes, sampleRate = 1.0):
+        for mode in modes:
+            if mode not in ['cpu', 'memory']:
+                raise ValueError(u'Invalid profiling mode %s, only cpu and memory are allowed' % mode)
+        self.outputFolder = outputFolder
+        self.modes = modes
+        self.sampleRate = sampleRate
+        self.fileDateFormatString = '%Y%m%d-%H%M%S'
+        self.topFunctionsCount = 40
+        self.topAllocationsCount = 25
+        self.tracingJournalsCount = 0 # tracemalloc traces the whole process, it's started by the first profiled journal and stopped by the last one
+        self.lock = threading.Lock()
+        self.random = random.Random()
+        self.logger = logging.getLogger('log')
+        if 'memory' in self.modes and tracemalloc is None:
+            self.logger.warning(u'Memory profiling needs tracemalloc module, which is not available, only cpu will be profiled')
+
+    def Profile(self, sectionName, journal, function):
+        """Calls function, profiling it if this run falls into the sample. Returns what function returns"""
+        if self.random.random() >= self.sampleRate:
+            return function()
+        filePathPrefix = os.path.join(self.outputFolder, u'profile_%s_%s_%s' % (sectionName, journal, datetime.datetime.now().strftime(self.fileDateFormatString)))
+        profile = cProfile.Profile() if 'cpu' in self.modes else None
+        isTracingMemory = 'memory' in self.modes and tracemalloc is not None
+        if isTracingMemory:
+            self.__startTracing()
+        try:
+            if profile is not None:
+                return profile.runcall(function)
+            return function()
+        finally:
+            try:
+                if profile is not None:
+                    self.SaveCpuProfile(profile, filePathPrefix)
+                if isTracingMemory:
+                    self.SaveMemorySnapshot(tracemalloc.take_snapshot(), filePathPrefix)
+            except Exception:
+                self.logger.warning(u'%s: %s: couldn\'t save profiling results' % (sectionName, journal), exc_info = True)
+            finally:
+                if isTracingMemory:
+                    self.__stopTracing()
+
+    def SaveCpuProfile(self, profile, filePathPrefix):
+        """Saves pstats file to load into pstats/snakeviz and text file with functions that took most cumulative time"""
+        common.CreatePathIfNotExists(filePathPrefix)
+        profile.dump_stats(u'%s.pstats' % filePathPrefix)
+        report = StringIO()
+        pstats.Stats(profile, stream = report).sort_stats('cumulative').print_stats(self.topFunctionsCount)
+        common.WriteFileAtomically(u'%s_cpu.txt' % filePathPrefix, report.getvalue())
+        self.logger.info(u'Saved cpu profile to %s.pstats' % filePathPrefix)
+
+    def SaveMemorySnapshot(self, snapshot, filePathPrefix):
+        """Saves text file with code lines that allocated most memory still held at the end of the run"""
+        statistics = snapshot.statistics('lineno')
+        lines = [u'Top %d allocation sites of %d, allocations of journals profiled at the same time are mixed in' % (min(self.topAllocationsCount, len(statistics)), len(statistics))]
+        lines.extend(unicode(statistic) for statistic in statistics[:self.topAllocationsCount])
+        common.WriteFileAtomically(u'%s_memory.txt' % filePathPrefix, (u'\n'.join(lines) + u'\n').encode('utf-8'))
+        self.logger.info(u'Saved top memory allocation sites to %s_memory.txt' % filePathPrefix)
+
+    def __startTracing(self):
+        with self.lock:
+            if self.tracingJournalsCount == 0:
+                tracemalloc.start()
+            self.tracingJournalsCount += 1
+
+    def __stopTracing(self):
+        with self.lock:
+            self.tracingJournalsCount -= 1
+            if self.tracingJournalsCount == 0:
+                tracemalloc.stop()
@@ -0,0 +1,35 @@
+"""Formats metrics report of MetricsRegistry in Prometheus text exposition format for node_exporter's textfile collector"""
+
+# metric name, help, getter of value out of journal report; values that are None are not written
+journalMetricDefinitions = [
+    ('ljarch_journal_run_start_timestamp_seconds', 'Time the last journal run started, seconds since epoch', lambda journal: journal['startTime']),
+    ('ljarch_journal_run_duration_seconds', 'Duration of the last journal run', lambda journal: journal['durationSeconds']),
+    ('ljarch_journal_run_succeeded', 'Whether the last journal run ended without errors, 1 or 0', lambda journal: None if journal['succeeded'] is None else int(journal['succeeded'])),
+    ('ljarch_journal_last_success_timestamp_seconds', 'Time the last successful journal run ended, seconds since epoch', lambda journal: journal['lastSuccessTime']),
+    ('ljarch_journal_posts_saved', 'Posts saved by the last journal run', lambda journal: journal['counters'].get('postsSaved', 0)),
+    ('ljarch_journal_posts_failed', 'Posts that the last journal run failed to get or save', lambda journal: journal['counters'].get('postsFailed', 0)),
+    ('ljarch_journal_comments_processed', 'New or updated comments saved by the last journal run', lambda journal: journal['counters'].get('commentsNewOrUpdated', 0)),
+    ('ljarch_journal_images_downloaded', 'Images downloaded by the last journal run', lambda journal: journal['counters'].get('imagesDownloaded', 0)),
+    ('ljarch_journal_errors', 'Journal, request and image download errors of the last journal run',
+     lambda journal: sum(journal['counters'].get(name, 0) for name in ['errors', 'requestErrors', 'imageErrors'])),
+    ('ljarch_journal_bytes_received', 'Bytes received from server by the last journal run', lambda journal: journal['counters'].get('bytesReceived', 0)),
+    ]
+
+def EscapeLabelValue(value):
+    return unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def FormatSampleValue(value):
+    """Integers (longs too, repr of which ends with L) are written as they are, floats with all their digits"""
+    return '%d' % value if isinstance(value, (int, long)) else repr(float(value))
+
+def FormatPrometheusText(report):
+    """Returns report as gauges labeled with section and journal, encoded in utf-8"""
+    lines = []
+    for name, help, getValue in journalMetricDefinitions:
+        lines.append(u'# HELP %s %s' % (name, help))
+        lines.append(u'# TYPE %s gauge' % name)
+        for journal in report['journals']:
+            value = getValue(journal)
+            if value is not None:
+                lines.append(u'%s{section="%s",journal="%s"} %s' % (name, EscapeLabelValue(journal['sectionName']), EscapeLabelValue(journal['journal']), FormatSampleValue(value)))
+    return (u'\n'.join(lines) + u'\n').encode('utf-8')
@@ -0,0 +1,62 @@
+import time
+import datetime
+import logging
+
+import parallelrunner
+
+class JournalScheduler:
+    """Keeps processing journals, each one every syncIntervalMinutes. Processors created for a journal are kept between its runs,
+        so indexes, caches and sessions inside them stay in memory"""
+
+    def __init__(self, configSections, globalSettings, processJournal):
+        self.processJournal = processJournal # called as processJournal(environment, processors), processors is a dictionary to keep processors in
+        self.dateFormatString = globalSettings['dateFormatString']
+        self.deadline = globalSettings.get('deadline') # seconds since epoch or None
+        self.servers = [] # (concurrency, journals) pair per server
+        for serverConfigSections in parallelrunner.GroupJournalsByServer(configSections).itervalues():
+            concurrency, environments = parallelrunner.GetServerEnvironments(serverConfigSections, globalSettings)
+            self.servers.append((concurrency, [{'environment': environment, 'processors': {}, 'nextRunTime': 0} for environment in environments]))
+        self.logger = logging.getLogger('log')
+
+    def Run(self, maxCycles = None):
+        """Runs journals that are due, then sleeps until the next one is due. Never returns unless maxCycles or run deadline is set"""
+        cycle = 0
+        try:
+            while len(self.servers) > 0 and (maxCycles is None or cycle < maxCycles):
+                self.RunDueJournals(time.time())
+                cycle += 1
+                if maxCycles is None or cycle < maxCycles:
+                    nextRunTime = self.GetNextRunTime()
+                    if self.deadline is not None and nextRunTime >= self.deadline:
+                        self.logger.info(u'Run time is over, next journal sync would be at %s' % datetime.datetime.fromtimestamp(nextRunTime).strftime(self.dateFormatString))
+                        break
+                    self.logger.info(u'Next journal sync is at %s' % datetime.datetime.fromtimestamp(nextRunTime).strftime(self.dateFormatString))
+                    time.sleep(max(0, nextRunTime - time.time()))
+        finally:
+            self.Close()
+
+    def RunDueJournals(self, now):
+        """Processes journals whose next run time has come, servers in parallel. Returns number of processed journals"""
+        serverItems = []
+        for concurrency, journals in self.servers:
+            dueJournals = [journal for journal in journals if journal['nextRunTime'] <= now]
+            for journal in dueJournals:
+                journal['nextRunTime'] = now + journal['environment']['syncIntervalMinutes'] * 60
+            if len(dueJournals) > 0:
+                serverItems.append((min(concurrency, len(dueJournals)), dueJournals))
+        parallelrunner.RunServerQueues(serverItems, lambda journal: self.processJournal(journal['environment'], journal['processors']))
+        return sum(len(dueJournals) for concurrency, dueJournals in serverItems)
+
+    def GetNextRunTime(self):
+        return min(journal['nextRunTime'] for concurrency, journals in self.servers for journal in journals)
+
+    def Close(self):
+        """Lets kept processors release what they hold, like comment session tokens and metadata stores"""
+        for concurrency, journals in self.servers:
+            for journal in journals:
+                for processor in journal['processors'].itervalues():
+                    if hasattr(processor, 'Close'):
+                        try:
+                            processor.Close()
+                        except Exception:
+                            self.logger.debug(u'%s: %s: error on closing processor' % (journal['environment']['sectionName'], journal['environment']['journal']), exc_info = True)
@@ -0,0 +1,40 @@
+import os
+import json
+import threading
+
+import common
+
+class Tracer:
+    """Collects spans of one journal run and saves them as Chrome trace event JSON, which chrome://tracing and Perfetto UI open.
+        Spans come from JournalMetrics timings, so requests, sleeps, parsing, merges and file writes all show up on the timeline"""
+
+    def __init__(self, maxSpanCount = 500000):
+        self.maxSpanCount = maxSpanCount # keeps trace of a huge journal from eating all memory, later spans are dropped
+        self.events = []
+        self.droppedSpanCount = 0
+        self.processId = os.getpid()
+        self.lock = threading.Lock()
+
+    def AddSpan(self, name, startTime, durationSeconds, details = None):
+        """Adds complete event for span named name that started at startTime (seconds since epoch) and lasted durationSeconds"""
+        event = {'name': name,
+                 'cat': name.split('.', 1)[0],
+                 'ph': 'X',
+                 'ts': int(startTime * 1000000),
+                 'dur': int(durationSeconds * 1000000),
+                 'pid': self.processId,
+                 'tid': threading.current_thread().ident}
+        if details:
+            event['args'] = details
+        with self.lock:
+            if len(self.events) < self.maxSpanCount:
+                self.events.append(event)
+            else:
+                self.droppedSpanCount += 1
+
+    def Save(self, path):
+        with self.lock:
+            events = sorted(self.events, key = lambda event: event['ts'])
+            droppedSpanCount = self.droppedSpanCount
+        trace = {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'droppedSpanCount': droppedSpanCount}}
+        common.WriteFileAtomically(path, json.dumps(trace, separators = (',', ':')))
@@ -1,7 +1,10 @@
 import os
 import sys
+import json
 import unittest
 import mock
+import tempfile
+import shutil
 
 mainPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(mainPath)
@@ -53,6 +56,48 @@ class ArchiverTestCase(unittest.TestCase):
         self.assertEqual(logger.critical.call_count, 0)
 
 
+    @mock.patch('archiver.SetupLogger', autospec=True)
+    @mock.patch('archiver.GetConfig', autospec=True)
+    @mock.patch('archiver.ReadPasswordHash', autospec=True)
+    @mock.patch('archiver.JournalScheduler', autospec=True)
+    def test_main_daemon(self, mock_scheduler, mock_readpwd, mock_config, mock_logger):
+        # Arrange
+        logger = mock.Mock()
+        mock_logger.return_value = logger
+        mock_config.return_value = [{'journal': 'user1', 'sectionName': 'server1', 'archiveComments': False}]
+        mock_readpwd.return_value = '44C7BE48226EBAD5DCA8216674CAD62B'
+
+        # Act
+        archiver.main(['--daemon'])
+
+        # Assert
+        self.assertEqual(mock_scheduler.call_count, 1)
+        mock_scheduler.return_value.Run.assert_called_once_with()
+        self.assertEqual(mock_readpwd.call_count, 1)
+        self.assertEqual(logger.critical.call_count, 0)
+
+
+    @mock.patch('archiver.SetupLogger', autospec=True)
+    @mock.patch('archiver.GetConfig', autospec=True)
+    @mock.patch('archiver.ReadPasswordHash', autospec=True)
+    @mock.patch('archiver.PostProcessor', autospec=True)
+    @mock.patch('archiver.time.time', autospec=True)
+    def test_main_maxRuntimeIsOver(self, mock_time, mock_postproc, mock_readpwd, mock_config, mock_logger):
+        # Arrange
+        logger = mock.Mock()
+        mock_logger.return_value = logger
+        mock_time.side_effect = [1000, 1000 + 10 * 60 - 1]
+        mock_config.return_value = [{'journal': 'user1', 'sectionName': 'server1', 'archiveComments': False}]
+        mock_readpwd.return_value = '44C7BE48226EBAD5DCA8216674CAD62B'
+
+        # Act
+        archiver.main(['--max-runtime', '10'])
+
+        # Assert
+        self.assertEqual(mock_postproc.call_count, 0)
+        self.assertEqual(logger.critical.call_count, 0)
+
+
     @mock.patch('archiver.SetupLogger', autospec=True)
     @mock.patch('archiver.GetConfig', autospec=True)
     @mock.patch('archiver.ReadPasswordHash', autospec=True)
@@ -90,5 +135,85 @@ class ArchiverTestCase(unittest.TestCase):
         self.assertEqual(logger.error.call_count, 0)
         self.assertEqual(logger.critical.call_count, 1)
 
+
+    @mock.patch('archiver.SetupLogger', autospec=True)
+    @mock.patch('archiver.GetConfig', autospec=True)
+    @mock.patch('archiver.ReadPasswordHash', autospec=True)
+    @mock.patch('archiver.PostProcessor', autospec=True)
+    def test_main_writesMetricsReports(self, mock_postproc, mock_readpwd, mock_config, mock_logger):
+        # Arrange
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir, True)
+        reportPath = os.path.join(tempDir, 'metrics.json')
+        promPath = os.path.join(tempDir, 'ljarch.prom')
+        logger = mock.Mock()
+        mock_logger.return_value = logger
+        mock_config.return_value = [{'journal': 'user1', 'sectionName': 'server1', 'archiveComments': False},
+                                    {'journal': 'user2', 'sectionName': 'server1'}] # no 'archiveComments' causes an exception
+        mock_readpwd.return_value = '44C7BE48226EBAD5DCA8216674CAD62B'
+
+        # Act
+        archiver.main(['--metrics-report', reportPath, '--prom-file', promPath])
+
+        # Assert
+        with open(reportPath, 'r') as reportFile:
+            report = json.load(reportFile)
+        self.assertEqual([(journal['journal'], journal['succeeded'], journal['counters']) for journal in report['journals']],
+                         [('user1', True, {}), ('user2', False, {'errors': 1})])
+        environment = mock_postproc.call_args_list[0][0][1]
+        self.assertTrue(environment['cnn'].metrics is environment['metrics'])
+        with open(promPath, 'r') as promFile:
+            promLines = promFile.read().splitlines()
+        self.assertTrue('ljarch_journal_run_succeeded{section="server1",journal="user2"} 0' in promLines)
+        self.assertEqual(logger.critical.call_count, 0)
+
+    @mock.patch('archiver.SetupLogger', autospec=True)
+    @mock.patch('archiver.GetConfig', autospec=True)
+    @mock.patch('archiver.ReadPasswordHash', autospec=True)
+    @mock.patch('archiver.PostProcessor', autospec=True)
+    @mock.patch('archiver.JournalProfiler', autospec=True)
+    def test_main_profile(self, mock_profiler, mock_postproc, mock_readpwd, mock_config, mock_logger):
+        # Arrange
+        logger = mock.Mock()
+        mock_logger.return_value = logger
+        mock_config.return_value = [{'journal': 'user1', 'sectionName': 'server1', 'archiveComments': False}]
+        mock_readpwd.return_value = '44C7BE48226EBAD5DCA8216674CAD62B'
+        mock_profiler.return_value.Profile.side_effect = lambda sectionName, journal, function: function()
+
+        # Act
+        archiver.main(['--profile', 'all', '--profile-sample-rate', '0.1'])
+
+        # Assert
+        name, args, kwargs = mock_profiler.mock_calls[0]
+        self.assertEqual(args[1:], (['cpu', 'memory'], 0.1))
+        self.assertEqual(mock_profiler.return_value.Profile.call_args[0][:2], ('server1', 'user1'))
+        self.assertEqual(mock_postproc.return_value.ProcessPosts.call_count, 1)
+        self.assertEqual(logger.critical.call_count, 0)
+
+    @mock.patch('archiver.SetupLogger', autospec=True)
+    @mock.patch('archiver.GetConfig', autospec=True)
+    @mock.patch('archiver.ReadPasswordHash', autospec=True)
+    @mock.patch('archiver.PostProcessor', autospec=True)
+    def test_main_trace(self, mock_postproc, mock_readpwd, mock_config, mock_logger):
+        # Arrange
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir, True)
+        logger = mock.Mock()
+        mock_logger.return_value = logger
+        mock_config.return_value = [{'journal': 'user1', 'sectionName': 'server1', 'archiveComments': False}]
+        mock_readpwd.return_value = '44C7BE48226EBAD5DCA8216674CAD62B'
+
+        # Act
+        archiver.main(['--trace', tempDir])
+
+        # Assert
+        fileNames = os.listdir(tempDir)
+        self.assertEqual(len(fileNames), 1)
+        self.assertTrue(fileNames[0].startswith('trace_server1_user1_') and fileNames[0].endswith('.json'))
+        with open(os.path.join(tempDir, fileNames[0]), 'r') as traceFile:
+            trace = json.load(traceFile)
+        self.assertEqual([event['name'] for event in trace['traceEvents']], ['stage.posts'])
+        self.assertEqual(logger.critical.call_count, 0)
+
 if __name__ == '__main__':    
     unittest.main()
\ No newline at end of file
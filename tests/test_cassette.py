@@ -0,0 +1,129 @@
+import os
+import sys
+import unittest
+import mock
+import tempfile
+import shutil
+import filecmp
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modules'))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cassette
+import common
+import connection
+import postprocessor
+import commentprocessor
+from benchmarks import fakeljserver, journalgenerator
+
+class CassetteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempDir, 'cassette.dat')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, ignore_errors = True)
+
+    def test_Init_ExceptionOnMode(self):
+        # Act
+        with self.assertRaises(ValueError) as assertEx:
+            cassette.Cassette(self.path, 'rewind')
+
+        # Assert
+        self.assertEqual(u'%s' % str(assertEx.exception), u'Invalid cassette mode rewind, only record and replay are allowed')
+
+    @mock.patch('cassette.logging.getLogger', autospec=True)
+    def test_Replay(self, mock_logging):
+        # Arrange
+        self.__record([('POST', 'http://a.bcd/interface/flat', {'mode': 'getchallenge', 'ver': 1}, 'challenge\nc1\nsuccess\nOK', None, None),
+                       ('POST', 'http://a.bcd/interface/flat', {'mode': 'getchallenge', 'ver': 1}, 'challenge\nc2\nsuccess\nOK', None, None),
+                       ('GET', 'http://a.bcd/i.png', {}, '\x89PNG\x00', 'image/png', None),
+                       ('GET', 'http://a.bcd/missing.png', {}, None, None, 404)])
+        replayingCassette = cassette.Cassette(self.path, 'replay')
+        replayingCassette.Open()
+        self.addCleanup(replayingCassette.Close)
+
+        # Act
+        challenges = [replayingCassette.Replay('POST', 'http://a.bcd/interface/flat', {'ver': 1, 'mode': 'getchallenge'})['body'] for i in xrange(3)]
+        image = replayingCassette.Replay('GET', 'http://a.bcd/i.png', {})
+        missingImage = replayingCassette.Replay('GET', 'http://a.bcd/missing.png', {})
+        notRecorded = replayingCassette.Replay('GET', 'http://a.bcd/other.png', {})
+
+        # Assert
+        self.assertEqual(challenges, ['challenge\nc1\nsuccess\nOK', 'challenge\nc2\nsuccess\nOK', 'challenge\nc2\nsuccess\nOK'])
+        self.assertEqual(image, {'body': '\x89PNG\x00', 'contentType': 'image/png', 'errorCode': None})
+        self.assertEqual(missingImage, {'body': None, 'contentType': None, 'errorCode': 404})
+        self.assertEqual(notRecorded, None)
+
+    @mock.patch('cassette.logging.getLogger', autospec=True)
+    @mock.patch('cassette.time.sleep', autospec=True)
+    def test_Replay_WithLatency(self, mock_sleep, mock_logging):
+        # Arrange
+        self.__record([('GET', 'http://a.bcd/i.png', {}, 'image', 'image/png', None)], 0.5)
+        replayingCassette = cassette.Cassette(self.path, 'replay', replayLatency = True)
+        replayingCassette.Open()
+        self.addCleanup(replayingCassette.Close)
+
+        # Act
+        replayingCassette.Replay('GET', 'http://a.bcd/i.png', {})
+
+        # Assert
+        mock_sleep.assert_called_once_with(0.5)
+
+    @mock.patch('cassette.logging.getLogger', autospec=True)
+    def test_Open_IncompleteRecordIsIgnored(self, mock_logging):
+        # Arrange
+        self.__record([('GET', 'http://a.bcd/1.png', {}, 'image 1', 'image/png', None), ('GET', 'http://a.bcd/2.png', {}, 'image 2', 'image/png', None)])
+        with open(self.path, 'r+b') as cassetteFile:
+            cassetteFile.truncate(os.path.getsize(self.path) - 1)
+        replayingCassette = cassette.Cassette(self.path, 'replay')
+
+        # Act
+        replayingCassette.Open()
+        self.addCleanup(replayingCassette.Close)
+
+        # Assert
+        self.assertEqual(replayingCassette.Replay('GET', 'http://a.bcd/1.png', {})['body'], 'image 1')
+        self.assertEqual(replayingCassette.Replay('GET', 'http://a.bcd/2.png', {}), None)
+        self.assertEqual(replayingCassette.logger.warning.call_count, 1)
+
+    def test_RecordAndReplayJournalSync(self):
+        # Arrange
+        fixture = journalgenerator.JournalGenerator(2).GenerateFixture(postCount = 10, commentCount = 100)
+        server = fakeljserver.FakeLjServer(fixture)
+        url = server.Start()
+        recordedArchivePath = os.path.join(self.tempDir, 'recorded')
+        replayedArchivePath = os.path.join(self.tempDir, 'replayed')
+
+        # Act
+        with mock.patch('postprocessor.logging.getLogger', autospec=True):
+            self.__syncJournal(recordedArchivePath, url, 'record')
+            server.Stop()
+            self.__syncJournal(replayedArchivePath, url, 'replay')
+
+        # Assert
+        comparison = filecmp.dircmp(os.path.join(recordedArchivePath, 'LiveJournal', 'test_account'), os.path.join(replayedArchivePath, 'LiveJournal', 'test_account'))
+        self.assertEqual((comparison.left_only, comparison.right_only, comparison.diff_files), ([], [], []))
+
+    def __record(self, requests, latencySeconds = 0.0):
+        recordingCassette = cassette.Cassette(self.path, 'record')
+        recordingCassette.Open()
+        for method, url, params, body, contentType, errorCode in requests:
+            recordingCassette.Record(method, url, params, {}, body, latencySeconds, contentType, errorCode)
+        recordingCassette.Close()
+
+    def __syncJournal(self, archivePath, url, mode):
+        syncCassette = cassette.Cassette(self.path, mode)
+        syncCassette.Open()
+        environment = {'cnn': connection.Connection(5, 'Test', syncCassette), 'delay': 0, 'cachedDataFolder': 'cached data', 'cachedPostIdsFile': 'cachedpostids.xml',
+                       'xsltFile': 'stylesheet.xsl', 'dateFormatString': '%Y-%m-%d %H:%M:%S', 'applyXSLT': False, 'archiveImages': False, 'archiveComments': True,
+                       'fullSyncIntervalDays': 7, 'sectionName': 'LiveJournal', 'journal': 'test_account', 'server': url, 'serverSchema': 'http',
+                       'serverNetloc': url.split('://')[1], 'exportCommentsPage': 'export_comments.bml', 'passwordHash': common.MD5('pwd')}
+        try:
+            with mock.patch('common.GetUpperLevelDir', return_value = archivePath):
+                postprocessor.PostProcessor('Archiver', environment).ProcessPosts()
+                commentprocessor.CommentProcessor(environment).ProcessComments()
+        finally:
+            syncCassette.Close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import os
+import sys
+import unittest
+import mock
+import tempfile
+import shutil
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modules'))
+import commentmetadatastore
+import common
+
+class CommentMetadataStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.dateFormatString = '%Y-%m-%d %H:%M:%S'
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, ignore_errors = True)
+
+    def test_Update_NewRecord(self):
+        # Arrange
+        store = self.__getStore()
+        subjectBodyHash = common.MD5('Text.')
+
+        # Act
+        result = store.Update('12', 'A', '2015-01-09 23:51:22', subjectBodyHash)
+
+        # Assert
+        self.assertEqual(result, 'new')
+        self.assertEqual(store.Get(12), {'id': 12, 'state': 'A', 'date': '2015-01-09 23:51:22', 'subjectbodyhash': subjectBodyHash})
+
+    def test_Update_DateAfter2038(self):
+        # Arrange
+        store = self.__getStore()
+
+        # Act
+        store.Update(12, 'A', '2040-05-01 10:00:00', '')
+
+        # Assert
+        self.assertEqual(store.Get(12)['date'], '2040-05-01 10:00:00')
+
+    def test_Update_ChangedRecord(self):
+        # Arrange
+        store = self.__getStore()
+        store.Update(12, 'A', '2015-01-09 23:51:22', '')
+
+        # Act
+        result = store.Update(12, 'S', '2015-01-09 23:51:22', '')
+
+        # Assert
+        self.assertEqual(result, 'updated')
+        self.assertEqual(store.Get(12)['state'], 'S')
+
+    def test_Update_UnchangedRecord(self):
+        # Arrange
+        store = self.__getStore()
+        store.Update(12, 'A', None, common.MD5('Text.'))
+
+        # Act
+        result = store.Update(12, 'A', None, common.MD5('Text.'))
+
+        # Assert
+        self.assertEqual(result, None)
+
+    def test_Get_NoRecord(self):
+        # Arrange
+        store = self.__getStore()
+
+        # Act
+        result = store.Get(100000)
+
+        # Assert
+        self.assertEqual(result, None)
+
+    def test_Update_GrowsFileAndKeepsRecordsAfterReopening(self):
+        # Arrange
+        path = os.path.join(self.tempDir, 'metadata.dat')
+        store = commentmetadatastore.CommentMetadataStore(path, self.dateFormatString)
+        store.Open()
+        commentId = store.growthStepRecords * 3 + 5
+
+        # Act
+        store.Update(1, 'A', None, '')
+        store.Update(commentId, 'D', None, '')
+        store.Close()
+        reopenedStore = self.__getStore()
+
+        # Assert
+        self.assertEqual(reopenedStore.Get(1)['state'], 'A')
+        self.assertEqual(reopenedStore.Get(commentId)['state'], 'D')
+        self.assertEqual(os.path.getsize(path) % reopenedStore.recordStruct.size, 0)
+
+    def test_RemoveDeletedCommentsMetadata(self):
+        # Arrange
+        store = self.__getStore()
+        for commentId in [1, 2, 3, 4]:
+            store.Update(commentId, 'A', None, '')
+
+        # Act
+        result = store.RemoveDeletedCommentsMetadata(2, 3, ['3'])
+
+        # Assert
+        self.assertEqual(result, 1)
+        self.assertTrue(store.Get(1) is not None)
+        self.assertTrue(store.Get(2) is None)
+        self.assertTrue(store.Get(3) is not None)
+        self.assertTrue(store.Get(4) is not None)
+
+    def test_RemoveDeletedCommentsMetadata_AllIdsPresent(self):
+        # Arrange
+        store = self.__getStore()
+        store.Update(1, 'A', None, '')
+        store.Update(2, 'A', None, '')
+
+        # Act
+        result = store.RemoveDeletedCommentsMetadata(1, 2, ['2', '1'])
+
+        # Assert
+        self.assertEqual(result, 0)
+
+    @mock.patch('commentmetadatastore.logging.getLogger', autospec=True)
+    def test_ImportXmlFiles(self, mock_logging):
+        # Arrange
+        subjectBodyHash = common.MD5('Text.')
+        xmlFilePath = os.path.join(self.tempDir, 'cachedcommentsmetadata_0.xml')
+        with open(xmlFilePath, 'w') as xmlFile:
+            xmlFile.write('<comments><comment subjectbodyhash="%s" id="12" state="A" date="2015-01-09 23:51:22"/><comment id="13" state="D"/></comments>' % subjectBodyHash)
+        store = self.__getStore()
+
+        # Act
+        result = store.ImportXmlFiles(os.path.join(self.tempDir, 'cachedcommentsmetadata_*.xml'))
+
+        # Assert
+        self.assertEqual(result, 2)
+        self.assertEqual(store.Get(12), {'id': 12, 'state': 'A', 'date': '2015-01-09 23:51:22', 'subjectbodyhash': subjectBodyHash})
+        self.assertEqual(store.Get(13), {'id': 13, 'state': 'D', 'date': None, 'subjectbodyhash': ''})
+        self.assertFalse(os.path.exists(xmlFilePath))
+
+    def __getStore(self):
+        store = commentmetadatastore.CommentMetadataStore(os.path.join(self.tempDir, 'metadata.dat'), self.dateFormatString)
+        store.Open()
+        self.addCleanup(store.Close)
+        return store
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,22 +7,31 @@ from xml.etree.ElementTree import fromstring, Element, tostring
 import unittest
 import mock
 import datetime
+import tempfile
+import shutil
 
 sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modules'))
 import commentprocessor
+import commentmetadatastore
 import connection
 import common
 
 class CommentProcessorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, ignore_errors = True)
+
     def test_GetCommentIndexToInsertAt_ReturnIndexZeroIfNoCommentsYet(self):
         # Arrange
         comment = fromstring('<comment id="1"/>')
-        sameLevelComments = []
+        sameLevelCommentIds = []
         settings = self.__getEnvironment(False)
         commPrc = commentprocessor.CommentProcessor(settings)
 
         # Act
-        result = commPrc.GetCommentIndexToInsertAt(comment, sameLevelComments)
+        result = commPrc.GetCommentIndexToInsertAt(comment, sameLevelCommentIds)
 
         # Assert
         self.assertEqual(result, 0)
@@ -30,14 +39,12 @@ class CommentProcessorTestCase(unittest.TestCase):
     def test_GetCommentIndexToInsertAt_ReturnIndexBetweenOtherComments(self):
         # Arrange
         comment = fromstring('<comment id="3" />')
-        sameLevelComments = [ fromstring('<comment id="1"/>'),
-                              fromstring('<comment id="2"/>'),
-                              fromstring('<comment id="18"/>')]
+        sameLevelCommentIds = [1, 2, 18]
         settings = self.__getEnvironment(False)
         commPrc = commentprocessor.CommentProcessor(settings)
 
         # Act
-        result = commPrc.GetCommentIndexToInsertAt(comment, sameLevelComments)
+        result = commPrc.GetCommentIndexToInsertAt(comment, sameLevelCommentIds)
 
         # Assert
         self.assertEqual(result, 2) # xml enumeration starts with 0
@@ -45,14 +52,12 @@ class CommentProcessorTestCase(unittest.TestCase):
     def test_GetCommentIndexToInsertAt_ReturnIndexAfterAllComments(self):
         # Arrange
         comment = fromstring('<comment id="18" />')
-        sameLevelComments = [ fromstring('<comment id="1"/>'),
-                              fromstring('<comment id="2"/>'),
-                              fromstring('<comment id="4"/>')]
+        sameLevelCommentIds = [1, 2, 4]
         settings = self.__getEnvironment(False)
         commPrc = commentprocessor.CommentProcessor(settings)
 
         # Act
-        result = commPrc.GetCommentIndexToInsertAt(comment, sameLevelComments)
+        result = commPrc.GetCommentIndexToInsertAt(comment, sameLevelCommentIds)
 
         # Assert
         self.assertEqual(result, 3) # xml enumeration starts with 0
@@ -108,6 +113,201 @@ class CommentProcessorTestCase(unittest.TestCase):
                                             {'get': 'comment_body', 'startid': startId },
                                             {'Cookie': 'ljsession=%s' % sessionToken },
                                             'GET')
+
+    @mock.patch('commentprocessor.logging.getLogger', autospec=True)
+    @mock.patch('commentprocessor.time', autospec=True)
+    @mock.patch('connection.Connection', autospec=True)
+    def test_ProcessComments_ReadsAllCommentsAndExpiresSession(self, mock_cnn, mock_time, mock_logging):
+        # Arrange
+        mock_cnn.return_value.GetSessionToken.return_value = 'abc'
+        commPrc = commentprocessor.CommentProcessor(self.__getEnvironment(False))
+        metadataInfo = {'metadata': self.__getMetadata(), 'minId': 1, 'maxId': 4, 'count': 4}
+        with mock.patch.object(commPrc, 'OpenMetadataStore') as mock_openstore, \
+             mock.patch.object(commPrc, 'GetCommentsMetadata', return_value = metadataInfo) as mock_getmetadata, \
+             mock.patch.object(commPrc, 'MergeUserIdsMapXmlWithCache', side_effect = lambda usermaps, removeMissingUsers: usermaps), \
+             mock.patch.object(commPrc, 'ProcessCommentsPage', side_effect = [3, 4]) as mock_processpage, \
+             mock.patch.object(commPrc, 'GetCommentsCheckpoint', return_value = None), \
+             mock.patch.object(commPrc, 'SaveCommentsCheckpoint') as mock_savecheckpoint, \
+             mock.patch.object(commPrc, 'RemoveCommentsCheckpoint') as mock_removecheckpoint:
+
+            # Act
+            commPrc.ProcessComments()
+
+            # Assert
+            mock_getmetadata.assert_called_once_with('abc', 0)
+            self.assertEqual([call[0][1] for call in mock_processpage.call_args_list], [1, 4])
+            mock_savecheckpoint.assert_has_calls([mock.call(4), mock.call(5)])
+            mock_removecheckpoint.assert_called_once_with()
+            mock_cnn.return_value.ExpireSession.assert_called_once_with(mock.ANY, 'abc')
+            self.assertEqual(commPrc.sessionToken, None)
+            self.assertEqual(commPrc.lastMaxCommentId, 4)
+
+    @mock.patch('commentprocessor.logging.getLogger', autospec=True)
+    @mock.patch('commentprocessor.time', autospec=True)
+    @mock.patch('connection.Connection', autospec=True)
+    def test_ProcessComments_KeepWarmReadsCommentsTail(self, mock_cnn, mock_time, mock_logging):
+        # Arrange
+        commPrc = commentprocessor.CommentProcessor(self.__getEnvironment(False))
+        commPrc.metadataStore = mock.Mock()
+        commPrc.sessionToken = 'abc'
+        commPrc.sessionTokenDate = datetime.datetime.now()
+        commPrc.lastMaxCommentId = 10
+        commPrc.lastFullPassDate = datetime.datetime.now()
+        metadataInfo = {'metadata': fromstring('<livejournal><maxid>11</maxid><usermaps><usermap id="2" user="bcd"/></usermaps></livejournal>'),
+                        'minId': 11, 'maxId': 11, 'count': 1}
+        with mock.patch.object(commPrc, 'GetCommentsMetadata', return_value = metadataInfo) as mock_getmetadata, \
+             mock.patch.object(commPrc, 'MergeUserIdsMapXmlWithCache', side_effect = lambda usermaps, removeMissingUsers: usermaps) as mock_mergeusermaps, \
+             mock.patch.object(commPrc, 'ProcessCommentsPage', return_value = 11) as mock_processpage, \
+             mock.patch.object(commPrc, 'GetCommentsCheckpoint', return_value = None), \
+             mock.patch.object(commPrc, 'SaveCommentsCheckpoint'), \
+             mock.patch.object(commPrc, 'RemoveCommentsCheckpoint'):
+
+            # Act
+            commPrc.ProcessComments(True)
+
+            # Assert
+            mock_getmetadata.assert_called_once_with('abc', 11)
+            self.assertFalse(mock_mergeusermaps.call_args[0][1]) # tail has only some of the users, cached ones should stay
+            self.assertEqual(mock_processpage.call_args[0][1], 11)
+            self.assertEqual(mock_cnn.return_value.GetSessionToken.call_count, 0)
+            self.assertEqual(mock_cnn.return_value.ExpireSession.call_count, 0)
+            self.assertEqual(commPrc.lastMaxCommentId, 11)
+
+    @mock.patch('commentprocessor.logging.getLogger', autospec=True)
+    @mock.patch('commentprocessor.time', autospec=True)
+    @mock.patch('connection.Connection', autospec=True)
+    def test_ProcessComments_ResumesFromCheckpointAndKeepsItOnError(self, mock_cnn, mock_time, mock_logging):
+        # Arrange
+        mock_cnn.return_value.GetSessionToken.return_value = 'abc'
+        commPrc = commentprocessor.CommentProcessor(self.__getEnvironment(False))
+        metadataInfo = {'metadata': self.__getMetadata(), 'minId': 3, 'maxId': 4, 'count': 2}
+        with mock.patch.object(commPrc, 'OpenMetadataStore'), \
+             mock.patch.object(commPrc, 'GetCommentsMetadata', return_value = metadataInfo) as mock_getmetadata, \
+             mock.patch.object(commPrc, 'MergeUserIdsMapXmlWithCache', side_effect = lambda usermaps, removeMissingUsers: usermaps) as mock_mergeusermaps, \
+             mock.patch.object(commPrc, 'ProcessCommentsPage', side_effect = IOError(u'Network error')), \
+             mock.patch.object(commPrc, 'GetCommentsCheckpoint', return_value = 3), \
+             mock.patch.object(commPrc, 'RemoveCommentsCheckpoint') as mock_removecheckpoint:
+
+            # Act
+            with self.assertRaises(IOError):
+                commPrc.ProcessComments()
+
+            # Assert
+            mock_getmetadata.assert_called_once_with('abc', 3)
+            self.assertFalse(mock_mergeusermaps.call_args[0][1])
+            self.assertEqual(mock_removecheckpoint.call_count, 0)
+            self.assertEqual(mock_cnn.return_value.ExpireSession.call_count, 1)
+
+    @mock.patch('commentprocessor.common.IsDeadlineNear', autospec=True)
+    @mock.patch('commentprocessor.logging.getLogger', autospec=True)
+    @mock.patch('commentprocessor.time', autospec=True)
+    @mock.patch('connection.Connection', autospec=True)
+    def test_ProcessComments_StopsNearDeadline(self, mock_cnn, mock_time, mock_logging, mock_deadline):
+        # Arrange
+        mock_cnn.return_value.GetSessionToken.return_value = 'abc'
+        mock_deadline.side_effect = [False, True]
+        commPrc = commentprocessor.CommentProcessor(self.__getEnvironment(False))
+        metadataInfo = {'metadata': self.__getMetadata(), 'minId': 1, 'maxId': 4, 'count': 4}
+        with mock.patch.object(commPrc, 'OpenMetadataStore'), \
+             mock.patch.object(commPrc, 'GetCommentsMetadata', return_value = metadataInfo), \
+             mock.patch.object(commPrc, 'MergeUserIdsMapXmlWithCache', side_effect = lambda usermaps, removeMissingUsers: usermaps), \
+             mock.patch.object(commPrc, 'ProcessCommentsPage', return_value = 2) as mock_processpage, \
+             mock.patch.object(commPrc, 'GetCommentsCheckpoint', return_value = None), \
+             mock.patch.object(commPrc, 'SaveCommentsCheckpoint') as mock_savecheckpoint, \
+             mock.patch.object(commPrc, 'RemoveCommentsCheckpoint') as mock_removecheckpoint:
+
+            # Act
+            commPrc.ProcessComments()
+
+            # Assert
+            self.assertEqual(mock_processpage.call_count, 1)
+            mock_savecheckpoint.assert_has_calls([mock.call(3), mock.call(3)])
+            self.assertEqual(mock_removecheckpoint.call_count, 0)
+            self.assertEqual(commPrc.lastMaxCommentId, None)
+
+    def test_CommentsCheckpoint(self):
+        # Arrange
+        commPrc = commentprocessor.CommentProcessor(self.__getEnvironment(False))
+
+        # Act
+        with mock.patch('commentprocessor.common.GetUpperLevelDir', return_value = self.tempDir):
+            noCheckpoint = commPrc.GetCommentsCheckpoint()
+            commPrc.SaveCommentsCheckpoint(123)
+            checkpoint = commPrc.GetCommentsCheckpoint()
+            commPrc.RemoveCommentsCheckpoint()
+            removedCheckpoint = commPrc.GetCommentsCheckpoint()
+
+        # Assert
+        self.assertEqual(noCheckpoint, None)
+        self.assertEqual(checkpoint, 123)
+        self.assertEqual(removedCheckpoint, None)
+
+    def test_IsFullCommentPassDue_NeverDone(self):
+        # Arrange
+        commPrc = commentprocessor.CommentProcessor(self.__getEnvironment(False))
+
+        # Act
+        result = commPrc.IsFullCommentPassDue()
+
+        # Assert
+        self.assertTrue(result)
+
+    def test_IsFullCommentPassDue_DoneRecently(self):
+        # Arrange
+        commPrc = commentprocessor.CommentProcessor(self.__getEnvironment(False))
+        commPrc.lastMaxCommentId = 10
+        commPrc.lastFullPassDate = datetime.datetime.now() - datetime.timedelta(days = 1)
+
+        # Act
+        result = commPrc.IsFullCommentPassDue()
+
+        # Assert
+        self.assertFalse(result)
+
+    @mock.patch('commentprocessor.logging.getLogger', autospec=True)
+    @mock.patch('commentprocessor.time', autospec=True)
+    def test_GetCommentsMetadata_FollowsNextId(self, mock_time, mock_logging):
+        # Arrange
+        commPrc = commentprocessor.CommentProcessor(self.__getEnvironment(False))
+        page1 = fromstring('<livejournal><maxid>5</maxid><nextid>4</nextid>' +
+                               '<comments><comment id="2" posterid="1"/><comment id="3" posterid="2"/></comments>' +
+                               '<usermaps><usermap id="1" user="abc"/><usermap id="2" user="ext_123"/></usermaps>' +
+                           '</livejournal>')
+        page2 = fromstring('<livejournal><maxid>5</maxid>' +
+                               '<comments><comment id="4" posterid="1"/><comment id="5" posterid="3"/></comments>' +
+                               '<usermaps><usermap id="1" user="abc"/><usermap id="3" user="xyz"/></usermaps>' +
+                           '</livejournal>')
+        with mock.patch.object(commPrc, 'GetCommentsInfo') as mock_getcommentsinfo:
+            mock_getcommentsinfo.side_effect = [page1, page2]
+
+            # Act
+            result = commPrc.GetCommentsMetadata('abc', 0)
+
+            # Assert
+            mock_getcommentsinfo.assert_has_calls([mock.call('abc', 'META', 0), mock.call('abc', 'META', 4)])
+            self.assertEqual(result['minId'], 2)
+            self.assertEqual(result['maxId'], 5)
+            self.assertEqual(result['count'], 4)
+            self.assertEqual([usermap.attrib['id'] for usermap in result['metadata'].findall('usermaps/usermap')], ['1', '2', '3'])
+            self.assertEqual(result['metadata'].find('maxid').text, '5')
+            self.assertTrue(result['metadata'].find('comments') is None)
+
+    @mock.patch('commentprocessor.logging.getLogger', autospec=True)
+    @mock.patch('commentprocessor.time', autospec=True)
+    def test_GetCommentsMetadata_NoComments(self, mock_time, mock_logging):
+        # Arrange
+        commPrc = commentprocessor.CommentProcessor(self.__getEnvironment(False))
+        with mock.patch.object(commPrc, 'GetCommentsInfo') as mock_getcommentsinfo:
+            mock_getcommentsinfo.return_value = fromstring('<livejournal><maxid>0</maxid><comments/><usermaps/></livejournal>')
+
+            # Act
+            result = commPrc.GetCommentsMetadata('abc', 0)
+
+            # Assert
+            self.assertEqual(mock_getcommentsinfo.call_count, 1)
+            self.assertEqual(result['minId'], None)
+            self.assertEqual(result['maxId'], 0)
+            self.assertEqual(result['count'], 0)
 											
     def test_AddUpdateCommentsInPostXml_AddNewCommentToPostWithoutComments(self):
         # Arrange
@@ -191,46 +391,6 @@ class CommentProcessorTestCase(unittest.TestCase):
         # Assert
         self.assertEqual(u'%s' % str(assertEx.exception), u'Found no comment with id = %s to update in post with url = %s' % (commentId, postXml.find('url').text))
 		
-    def test_RemoveDeletedCommentsMetadata(self):
-        # Arrange
-        cachedCommentsMetadataXml = fromstring('<comments><comment id="1" /><comment id="2" /></comments>')
-        existingCommentIds = ['2']
-        commPrc = commentprocessor.CommentProcessor(self.__getEnvironment(False))
-
-        # Act
-        result = commPrc.RemoveDeletedCommentsMetadata(cachedCommentsMetadataXml, existingCommentIds)
-
-        # Assert
-        self.assertEqual(result, 1)
-        self.assertTrue(cachedCommentsMetadataXml.find('comment[@id="1"]') is None)
-        self.assertTrue(cachedCommentsMetadataXml.find('comment[@id="2"]') is not None)
-		
-    def test_RemoveDeletedCommentsMetadata_AllIdsPresent(self):
-        # Arrange
-        cachedCommentsMetadataXml = fromstring('<comments><comment id="1" /><comment id="2" /></comments>')
-        existingCommentIds = ['2', '1']
-        commPrc = commentprocessor.CommentProcessor(self.__getEnvironment(False))
-
-        # Act
-        result = commPrc.RemoveDeletedCommentsMetadata(cachedCommentsMetadataXml, existingCommentIds)
-
-        # Assert
-        self.assertEqual(result, 0)
-        self.assertTrue(cachedCommentsMetadataXml.find('comment[@id="1"]') is not None)
-        self.assertTrue(cachedCommentsMetadataXml.find('comment[@id="2"]') is not None)
-		
-    def test_RemoveDeletedCommentsMetadata_NoCachedMetadata(self):
-        # Arrange
-        cachedCommentsMetadataXml = fromstring('<comments/>')
-        existingCommentIds = ['2']
-        commPrc = commentprocessor.CommentProcessor(self.__getEnvironment(False))
-
-        # Act
-        result = commPrc.RemoveDeletedCommentsMetadata(cachedCommentsMetadataXml, existingCommentIds)
-
-        # Assert
-        self.assertEqual(result, 0)
-		
     def test_CombineCommentBodiesWithMetadata(self):
         # Arrange
         env = self.__getEnvironment(False)
@@ -247,134 +407,124 @@ class CommentProcessorTestCase(unittest.TestCase):
         self.assertEqual(len([datetime.datetime.strptime(enrichedComment.find('date').text, env['dateFormatString']) for enrichedComment in result['enrichedComments']]), 2)
 		
     @mock.patch('commentprocessor.logging.getLogger', autospec=True)
-    @mock.patch('commentprocessor.common.ReadXmlFileOrDefault', autospec=True)
-    @mock.patch('commentprocessor.common.CreatePathIfNotExists', autospec=True)
-    @mock.patch('commentprocessor.open', create=True)
-    def test_GetNewOrUpdatedComments_NewNoState(self, mock_open, mock_createpath, mock_readxmlordefault, mock_logging):
+    def test_GetNewOrUpdatedComments_NewNoState(self, mock_logging):
         # Arrange
         commentText = 'Text.'
         commentTextHash = common.MD5(commentText)
-        mock_readxmlordefault.return_value = fromstring('<comments/>')
         commentBodies = [fromstring('<comment id="12" jitemid="23" posterid="34" parentid="45"><body>%s</body><date>2015-01-09 23:51:22</date></comment>' % commentText)]
         commPrc = commentprocessor.CommentProcessor(self.__getEnvironment(False))
+        commPrc.metadataStore = self.__getMetadataStore([])
 
         # Act
-        result = commPrc.GetNewOrUpdatedComments(0, commentBodies)
+        result = commPrc.GetNewOrUpdatedComments(12, 12, commentBodies)
 
         # Assert
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0].attrib['processingstate'], 'new')
-        file_handle = mock_open.return_value.__enter__.return_value
-        file_handle.write.assert_called_with(tostring(fromstring('<comments><comment subjectbodyhash="%s" id="12" state="A" date="2015-01-09 23:51:22"/></comments>' % commentTextHash)))
-		
+        self.assertEqual(commPrc.metadataStore.Get(12), {'id': 12, 'state': 'A', 'date': '2015-01-09 23:51:22', 'subjectbodyhash': commentTextHash})
+
     @mock.patch('commentprocessor.logging.getLogger', autospec=True)
-    @mock.patch('commentprocessor.common.ReadXmlFileOrDefault', autospec=True)
-    @mock.patch('commentprocessor.common.CreatePathIfNotExists', autospec=True)
-    @mock.patch('commentprocessor.open', create=True)
-    def test_GetNewOrUpdatedComments_BodyUpdated(self, mock_open, mock_createpath, mock_readxmlordefault, mock_logging):
+    def test_GetNewOrUpdatedComments_BodyUpdated(self, mock_logging):
         # Arrange
         initialCommentBodyHash = common.MD5('AAA')
         updatedCommentBody = 'AAB'
         updatedCommentBodyHash = common.MD5(updatedCommentBody)
-        mock_readxmlordefault.return_value = fromstring('<comments><comment id="12" state="A" date="2015-01-09 23:51:22" subjectbodyhash="%s"/></comments>' % initialCommentBodyHash)
         commentBodies = [fromstring('<comment id="12" jitemid="23" posterid="34" parentid="45"><body>%s</body><date>2015-01-09 23:51:22</date></comment>' % updatedCommentBody)]
         commPrc = commentprocessor.CommentProcessor(self.__getEnvironment(False))
+        commPrc.metadataStore = self.__getMetadataStore([(12, 'A', '2015-01-09 23:51:22', initialCommentBodyHash)])
 
         # Act
-        result = commPrc.GetNewOrUpdatedComments(0, commentBodies)
+        result = commPrc.GetNewOrUpdatedComments(12, 12, commentBodies)
 
         # Assert
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0].attrib['processingstate'], 'updated')
-        file_handle = mock_open.return_value.__enter__.return_value
-        file_handle.write.assert_called_with(tostring(fromstring('<comments><comment id="12" state="A" date="2015-01-09 23:51:22" subjectbodyhash="%s"/></comments>' % updatedCommentBodyHash)))
-		
+        self.assertEqual(commPrc.metadataStore.Get(12)['subjectbodyhash'], updatedCommentBodyHash)
+
     @mock.patch('commentprocessor.logging.getLogger', autospec=True)
-    @mock.patch('commentprocessor.common.ReadXmlFileOrDefault', autospec=True)
-    @mock.patch('commentprocessor.common.CreatePathIfNotExists', autospec=True)
-    @mock.patch('commentprocessor.open', create=True)
-    def test_GetNewOrUpdatedComments_SubjectUpdated(self, mock_open, mock_createpath, mock_readxmlordefault, mock_logging):
+    def test_GetNewOrUpdatedComments_SubjectUpdated(self, mock_logging):
         # Arrange
         body = u'ЖЗЙ'
         initialCommentSubjectBodyHash = common.MD5(u'АБВ%s' % body)
         updatedCommentSubject = u'ЭЮЯ'
         updatedCommentSubjectBodyHash = common.MD5(u'%s%s' % (updatedCommentSubject, body))
-        mock_readxmlordefault.return_value = fromstring(u'<comments><comment id="12" state="A" date="2015-01-09 23:51:22" subjectbodyhash="%s"/></comments>' % initialCommentSubjectBodyHash)
         commentBodiesString = u'<comment id="12" jitemid="23" posterid="34" parentid="45"><subject>%s</subject><body>%s</body><date>2015-01-09 23:51:22</date></comment>' % (updatedCommentSubject, body)
         commentBodies = [fromstring(commentBodiesString.encode('utf-8'))]
         commPrc = commentprocessor.CommentProcessor(self.__getEnvironment(False))
+        commPrc.metadataStore = self.__getMetadataStore([(12, 'A', '2015-01-09 23:51:22', initialCommentSubjectBodyHash)])
 
         # Act
-        result = commPrc.GetNewOrUpdatedComments(0, commentBodies)
+        result = commPrc.GetNewOrUpdatedComments(12, 12, commentBodies)
 
         # Assert
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0].attrib[u'processingstate'], u'updated')
-        file_handle = mock_open.return_value.__enter__.return_value
-        expectedCommentBodiesString = u'<comments><comment id="12" state="A" date="2015-01-09 23:51:22" subjectbodyhash="%s"/></comments>' % updatedCommentSubjectBodyHash
-        file_handle.write.assert_called_with(tostring(fromstring(expectedCommentBodiesString.encode('utf-8'))))
-		
+        self.assertEqual(commPrc.metadataStore.Get(12)['subjectbodyhash'], updatedCommentSubjectBodyHash)
+
     @mock.patch('commentprocessor.logging.getLogger', autospec=True)
-    @mock.patch('commentprocessor.common.ReadXmlFileOrDefault', autospec=True)
-    @mock.patch('commentprocessor.common.CreatePathIfNotExists', autospec=True)
-    @mock.patch('commentprocessor.open', create=True)
-    def test_GetNewOrUpdatedComments_NewHasState(self, mock_open, mock_createpath, mock_readxmlordefault, mock_logging):
+    def test_GetNewOrUpdatedComments_NewHasState(self, mock_logging):
         # Arrange
-        mock_readxmlordefault.return_value = fromstring('<comments/>')
         commentBodies = [fromstring('<comment id="12" jitemid="23" posterid="34" parentid="45" state="D"></comment>')]
         commPrc = commentprocessor.CommentProcessor(self.__getEnvironment(False))
+        commPrc.metadataStore = self.__getMetadataStore([])
 
         # Act
-        result = commPrc.GetNewOrUpdatedComments(0, commentBodies)
+        result = commPrc.GetNewOrUpdatedComments(12, 12, commentBodies)
 
         # Assert
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0].attrib['processingstate'], 'new')
-        file_handle = mock_open.return_value.__enter__.return_value
-        file_handle.write.assert_called_with(tostring(fromstring('<comments><comment id="12" state="D"/></comments>')))
-		
+        self.assertEqual(commPrc.metadataStore.Get(12), {'id': 12, 'state': 'D', 'date': None, 'subjectbodyhash': ''})
+
     @mock.patch('commentprocessor.logging.getLogger', autospec=True)
-    @mock.patch('commentprocessor.common.ReadXmlFileOrDefault', autospec=True)
-    @mock.patch('commentprocessor.common.CreatePathIfNotExists', autospec=True)
-    @mock.patch('commentprocessor.open', create=True)
-    def test_GetNewOrUpdatedComments_DateUpdated(self, mock_open, mock_createpath, mock_readxmlordefault, mock_logging):
+    def test_GetNewOrUpdatedComments_DateUpdated(self, mock_logging):
         # Arrange
         commentText = 'Text.'
         commentTextHash = common.MD5(commentText)
-        mock_readxmlordefault.return_value = fromstring('<comments><comment id="12" state="A" date="2015-01-09 23:51:22"/></comments>')
         commentBodies = [fromstring('<comment id="12" jitemid="23" posterid="34" parentid="45"><body>%s</body><date>2015-02-09 23:51:22</date></comment>' % commentText)]
         commPrc = commentprocessor.CommentProcessor(self.__getEnvironment(False))
+        commPrc.metadataStore = self.__getMetadataStore([(12, 'A', '2015-01-09 23:51:22', commentTextHash)])
 
         # Act
-        result = commPrc.GetNewOrUpdatedComments(0, commentBodies)
+        result = commPrc.GetNewOrUpdatedComments(12, 12, commentBodies)
 
         # Assert
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0].attrib['processingstate'], 'updated')
-        file_handle = mock_open.return_value.__enter__.return_value
-        file_handle.write.assert_called_with(tostring(fromstring('<comments><comment subjectbodyhash="%s" id="12" state="A" date="2015-02-09 23:51:22"/></comments>' % commentTextHash)))
-		
+        self.assertEqual(commPrc.metadataStore.Get(12)['date'], '2015-02-09 23:51:22')
+
     @mock.patch('commentprocessor.logging.getLogger', autospec=True)
-    @mock.patch('commentprocessor.common.ReadXmlFileOrDefault', autospec=True)
-    @mock.patch('commentprocessor.common.CreatePathIfNotExists', autospec=True)
-    @mock.patch('commentprocessor.open', create=True)
-    def test_GetNewOrUpdatedComments_Deleted(self, mock_open, mock_createpath, mock_readxmlordefault, mock_logging):
+    def test_GetNewOrUpdatedComments_NotChanged(self, mock_logging):
+        # Arrange
+        commentText = 'Text.'
+        commentBodies = [fromstring('<comment id="12" jitemid="23" posterid="34" parentid="45"><body>%s</body><date>2015-01-09 23:51:22</date></comment>' % commentText)]
+        commPrc = commentprocessor.CommentProcessor(self.__getEnvironment(False))
+        commPrc.metadataStore = self.__getMetadataStore([(12, 'A', '2015-01-09 23:51:22', common.MD5(commentText))])
+
+        # Act
+        result = commPrc.GetNewOrUpdatedComments(12, 12, commentBodies)
+
+        # Assert
+        self.assertEqual(len(result), 0)
+
+    @mock.patch('commentprocessor.logging.getLogger', autospec=True)
+    def test_GetNewOrUpdatedComments_Deleted(self, mock_logging):
         # Arrange
         commentText1 = 'Text.'
         commentTextHash1 = common.MD5(commentText1)
         commentTextHash2 = common.MD5('Text2.')
-        mock_readxmlordefault.return_value = fromstring('<comments><comment id="12" state="A" date="2015-01-09 23:51:22" subjectbodyhash="%s"/><comment id="23" state="A" date="2015-02-09 23:51:22" subjectbodyhash="%s"/></comments>' % (commentTextHash1, commentTextHash2))
         commentBodies = [fromstring('<comment id="12" jitemid="23" posterid="34" parentid="45"><body>%s</body><date>2015-01-09 23:51:22</date></comment>' % commentText1)]
         commPrc = commentprocessor.CommentProcessor(self.__getEnvironment(False))
+        commPrc.metadataStore = self.__getMetadataStore([(12, 'A', '2015-01-09 23:51:22', commentTextHash1), (23, 'A', '2015-02-09 23:51:22', commentTextHash2)])
 
         # Act
-        result = commPrc.GetNewOrUpdatedComments(0, commentBodies)
+        result = commPrc.GetNewOrUpdatedComments(12, 23, commentBodies)
 
         # Assert
         self.assertEqual(len(result), 0)
-        file_handle = mock_open.return_value.__enter__.return_value
-        file_handle.write.assert_called_with(tostring(fromstring('<comments><comment id="12" state="A" date="2015-01-09 23:51:22" subjectbodyhash="%s"/></comments>' % commentTextHash1)))
-		
+        self.assertTrue(commPrc.metadataStore.Get(12) is not None)
+        self.assertTrue(commPrc.metadataStore.Get(23) is None)
+
     @mock.patch('commentprocessor.logging.getLogger', autospec=True)
     @mock.patch('commentprocessor.common.ReadXmlFileOrDefault', autospec=True)
     @mock.patch('commentprocessor.common.CreatePathIfNotExists', autospec=True)
@@ -436,7 +586,7 @@ class CommentProcessorTestCase(unittest.TestCase):
         self.assertEqual(tostring(result), expectedResult)
         file_handle = mock_open.return_value.__enter__.return_value
         file_handle.write.assert_called_with(expectedResult)
-        commPrc.logger.warning.assert_called_with(u'Couldn\'t get profile page of OpenID user ext_12345', exc_info = True)
+        commPrc.logger.warning.assert_called_with(u'Couldn\'t get profile page of OpenID user %s', 'ext_12345', exc_info = True)
 		
     @mock.patch('commentprocessor.logging.getLogger', autospec=True)
     @mock.patch('commentprocessor.common.ReadXmlFileOrDefault', autospec=True)
@@ -458,7 +608,7 @@ class CommentProcessorTestCase(unittest.TestCase):
         self.assertEqual(tostring(result), expectedResult)
         file_handle = mock_open.return_value.__enter__.return_value
         file_handle.write.assert_called_with(expectedResult)
-        commPrc.logger.warning.assert_called_with(u'Got profile page of OpenID user ext_12345 but couldn\'t find its title to extract user\'s "real" name from it')
+        commPrc.logger.warning.assert_called_with(u'Got profile page of OpenID user %s but couldn\'t find its title to extract user\'s "real" name from it', 'ext_12345')
 		
     @mock.patch('commentprocessor.logging.getLogger', autospec=True)
     @mock.patch('commentprocessor.common.ReadXmlFileOrDefault', autospec=True)
@@ -553,9 +703,18 @@ class CommentProcessorTestCase(unittest.TestCase):
                     'cachedDataFolder': 'cacheddatafolder',
                     'cachedPostIdsFile': 'cachedPostIdsFile.xml',
                     'xsltFile': 'xsltFile.xml',
-                    'dateFormatString': '%Y-%m-%d %H:%M:%S'                    
+                    'dateFormatString': '%Y-%m-%d %H:%M:%S',
+                    'fullSyncIntervalDays': 7
                 }
 				
+    def __getMetadataStore(self, records):
+        store = commentmetadatastore.CommentMetadataStore(os.path.join(self.tempDir, 'metadata.dat'), '%Y-%m-%d %H:%M:%S')
+        store.Open()
+        self.addCleanup(store.Close)
+        for record in records:
+            store.Update(*record)
+        return store
+
     def __getPostXml(self):
         return fromstring('<post>' +
                                  '<itemid>1</itemid>' +
@@ -3,6 +3,9 @@ import sys
 from xml.etree.ElementTree import fromstring, Element
 import re
 import unittest
+import datetime
+import tempfile
+import shutil
 import mock
 
 sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modules'))
@@ -99,6 +102,86 @@ class CommonTestCase(unittest.TestCase):
         # Assert
         self.assertEqual(result, None)
 		
+    def test_GetReconciliationDelta(self):
+        # Act
+        result = common.GetReconciliationDelta({1: 'a', 2: 'b', 3: 'c'}, {2: 'b', 3: 'd', 4: 'e'})
+
+        # Assert
+        self.assertEqual(result, {'added': [4], 'updated': [3], 'deleted': [1]})
+
+    def test_GetReconciliationDelta_NoVersions(self):
+        # Act
+        result = common.GetReconciliationDelta(dict.fromkeys([1, 2]), dict.fromkeys([1, 2]))
+
+        # Assert
+        self.assertEqual(result, {'added': [], 'updated': [], 'deleted': []})
+
+    def test_WriteFileAtomically(self):
+        # Arrange
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir, True)
+        path = os.path.join(tempDir, 'a', 'b.dat')
+        common.WriteFileAtomically(path, 'old')
+
+        # Act
+        common.WriteFileAtomically(path, 'new')
+
+        # Assert
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), 'new')
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['b.dat'])
+
+    def test_RemoveChildren(self):
+        # Arrange
+        parent = fromstring('<posts><post dbid="1"/><post dbid="2"/><post dbid="3"/></posts>')
+
+        # Act
+        common.RemoveChildren(parent, [parent[0], parent[2]])
+
+        # Assert
+        self.assertEqual([child.attrib['dbid'] for child in parent], ['2'])
+
+    @mock.patch('common.os.link', side_effect = OSError(18, 'Invalid cross-device link'))
+    def test_LinkOrCopyFile_CopiesWhenLinkFails(self, mock_link):
+        # Arrange
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir, True)
+        sourcePath = os.path.join(tempDir, 'a.dat')
+        with open(sourcePath, 'wb') as f:
+            f.write('abc')
+
+        # Act
+        common.LinkOrCopyFile(sourcePath, os.path.join(tempDir, 'b.dat'))
+
+        # Assert
+        with open(os.path.join(tempDir, 'b.dat'), 'rb') as f:
+            self.assertEqual(f.read(), 'abc')
+
+    @mock.patch('common.time.time', autospec=True)
+    def test_IsDeadlineNear(self, mock_time):
+        # Arrange
+        mock_time.return_value = 1000
+
+        # Act
+        result = [common.IsDeadlineNear(None), common.IsDeadlineNear(2000), common.IsDeadlineNear(1020), common.IsDeadlineNear(1020, 10)]
+
+        # Assert
+        self.assertEqual(result, [False, False, True, False])
+
+    def test_ParseServerDateTime(self):
+        # Act
+        result = common.ParseServerDateTime('2000-12-12 09:05:07')
+
+        # Assert
+        self.assertEqual(result, datetime.datetime(2000, 12, 12, 9, 5, 7))
+
+    def test_ParseServerDateTime_Fraction(self):
+        # Act
+        result = common.ParseServerDateTime('2000-12-12 09:05:07.00000')
+
+        # Assert
+        self.assertEqual(result, datetime.datetime(2000, 12, 12, 9, 5, 7))
+
     @mock.patch('common.logging')
     @mock.patch('common.os.path')
     @mock.patch('common.os')
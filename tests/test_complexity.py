@@ -0,0 +1,250 @@
+import os
+import sys
+import gc
+import time
+import unittest
+import mock
+import tempfile
+import shutil
+from xml.etree.ElementTree import fromstring, Element, SubElement
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modules'))
+import common
+import postprocessor
+import commentprocessor
+import commentmetadatastore
+import imagescraper
+import connection
+
+class ComplexityTestCase(unittest.TestCase):
+    """Runs hot paths on inputs of growing size and checks that their running time grows roughly linearly with input.
+    Linear and n log n code gets about sizeFactor times slower on sizeFactor times bigger input, quadratic code gets sizeFactor ** 2 times slower"""
+    sizeFactor = 4
+    maxGrowthRatio = 9
+    repeat = 3
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, ignore_errors = True)
+
+    @mock.patch('commentprocessor.logging.getLogger', autospec=True)
+    def test_CombineCommentBodiesWithMetadata(self, mock_logging):
+        # Arrange
+        commPrc = commentprocessor.CommentProcessor(self.__getEnvironment())
+
+        def Prepare(n):
+            metadata = Element('root')
+            SubElement(metadata, 'comments')
+            usermaps = SubElement(metadata, 'usermaps')
+            bodies = Element('root')
+            comments = SubElement(bodies, 'comments')
+            for i in xrange(1, n + 1):
+                SubElement(usermaps, 'usermap', {'id': str(i), 'user': 'user%d' % i})
+                SubElement(comments, 'comment', {'id': str(i), 'jitemid': '1', 'posterid': str(n + 1 - i)})
+            return bodies, metadata
+
+        # Act & Assert
+        self.assertRoughlyLinear(Prepare, lambda args: commPrc.CombineCommentBodiesWithMetadata(*args), 2000)
+
+    @mock.patch('commentprocessor.logging.getLogger', autospec=True)
+    def test_AddUpdateCommentsInPostXml_NewTopLevelComments(self, mock_logging):
+        # Arrange
+        commPrc = commentprocessor.CommentProcessor(self.__getEnvironment())
+
+        def Prepare(n):
+            postXml = fromstring('<post><url>http://a.bcd/1.html</url></post>')
+            newComments = [Element('comment', {'id': str(i), 'jitemid': '1', 'processingstate': 'new'}) for i in xrange(1, n + 1)]
+            return postXml, newComments
+
+        # Act & Assert
+        self.assertRoughlyLinear(Prepare, lambda args: commPrc.AddUpdateCommentsInPostXml(*args), 2000)
+
+    @mock.patch('commentprocessor.logging.getLogger', autospec=True)
+    def test_AddUpdateCommentsInPostXml_UpdatedCommentsInThreads(self, mock_logging):
+        # Arrange
+        commPrc = commentprocessor.CommentProcessor(self.__getEnvironment())
+
+        def Prepare(n):
+            postXml = fromstring('<post><url>http://a.bcd/1.html</url></post>')
+            sameLevelCommentsNode = SubElement(postXml, 'comments')
+            updatedComments = []
+            for i in xrange(1, n + 1):
+                comment = SubElement(sameLevelCommentsNode, 'comment', {'id': str(i), 'jitemid': '1'})
+                if i % 10 != 0:
+                    sameLevelCommentsNode = SubElement(comment, 'comments') # threads ten comments deep
+                else:
+                    sameLevelCommentsNode = postXml.find('comments')
+                updatedComments.append(Element('comment', {'id': str(i), 'jitemid': '1', 'state': 'D', 'processingstate': 'updated'}))
+            return postXml, updatedComments
+
+        # Act & Assert
+        self.assertRoughlyLinear(Prepare, lambda args: commPrc.AddUpdateCommentsInPostXml(*args), 2000)
+
+    @mock.patch('imagescraper.logging', autospec=True)
+    @mock.patch('imagescraper.time', autospec=True)
+    def test_ImageScraper_scrape(self, mock_time, mock_logging):
+        # Arrange
+        cnn = mock.create_autospec(connection.Connection, instance = True)
+        cnn.DownloadImage.side_effect = lambda src, path, sharedImagesPath = None: os.path.join(path, src.rsplit('/', 1)[1])
+
+        def Prepare(n):
+            cachedImagesXml = Element('images')
+            markup = []
+            for i in xrange(n):
+                SubElement(cachedImagesXml, 'image', {'remote': 'http://a.bcd/c%d.jpg' % i, 'local': 'c%d.jpg' % i})
+                markup.append('<img src="http://a.bcd/c%d.jpg"><img src="http://a.bcd/d%d.jpg"><img src="http://a.bcd/d%d.jpg">' % (i, i, i))
+            settings = {'cnn': cnn, 'httpRequestDelaySeconds': 0, 'sectionName': 'A', 'journal': 'B', 'cachedImagesXml': cachedImagesXml, 'imagesFolder': 'images'}
+            return imagescraper.ImageScraper(settings), ''.join(markup)
+
+        # Act & Assert
+        self.assertRoughlyLinear(Prepare, lambda args: args[0].scrape(args[1]), 300)
+
+    @mock.patch('postprocessor.logging.getLogger', autospec=True)
+    @mock.patch('postprocessor.common.ReadXmlFileOrDefault', autospec=True)
+    @mock.patch('postprocessor.ImageScraper.ScrapeImages')
+    def test_PostProcessor_ScrapeImages(self, mock_imagescraper, mock_readxmlfileordefault, mock_logging):
+        # Arrange
+        def Prepare(n):
+            cachedImagesXml = Element('images')
+            for i in xrange(n):
+                imageXml = SubElement(cachedImagesXml, 'image', {'remote': 'http://a.bcd/%d.jpg' % i, 'local': '%d.jpg' % i})
+                SubElement(SubElement(imageXml, 'posts'), 'post', {'dbid': str(i)})
+            mock_readxmlfileordefault.return_value = cachedImagesXml
+            return postprocessor.PostProcessor('Foo', self.__getEnvironment()), n
+
+        def ScrapeAllPosts(args):
+            postPrc, n = args
+            for i in xrange(n):
+                mock_imagescraper.return_value = {'updatedMarkup': '', 'downloadedImageInfos': [],
+                                                  'existingImageInfos': [{'remote': 'http://a.bcd/%d.jpg' % i, 'local': '%d.jpg' % i}], 'failedImageRemotes': []}
+                postPrc.ScrapeImages('', postId = str(i))
+
+        # Act & Assert
+        self.assertRoughlyLinear(Prepare, ScrapeAllPosts, 1000)
+
+    @mock.patch('postprocessor.logging.getLogger', autospec=True)
+    @mock.patch('postprocessor.common.GetUpperLevelDir', autospec=True)
+    @mock.patch('postprocessor.common.ReadXmlFileOrDefault', autospec=True)
+    def test_PostProcessor_SavePostIdsMap(self, mock_readxmlfileordefault, mock_getupperleveldir, mock_logging):
+        # Arrange
+        mock_getupperleveldir.return_value = self.tempDir
+        postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment())
+
+        def Prepare(n):
+            cachedIdsXml = Element('posts')
+            for i in xrange(n):
+                SubElement(cachedIdsXml, 'post', {'dbid': str(i), 'publicid': str(i * 256)})
+            mock_readxmlfileordefault.return_value = cachedIdsXml
+            return dict((i, i * 256) for i in xrange(n / 2, n + n / 2))
+
+        # Act & Assert
+        self.assertRoughlyLinear(Prepare, postPrc.SavePostIdsMap, 2000)
+
+    def test_GetReconciliationDelta(self):
+        # Arrange
+        def Prepare(n):
+            return dict((i, 1) for i in xrange(n)), dict((i, i % 2) for i in xrange(n / 2, n + n / 2))
+
+        # Act & Assert
+        self.assertRoughlyLinear(Prepare, lambda args: common.GetReconciliationDelta(*args), 20000)
+
+    @mock.patch('postprocessor.logging.getLogger', autospec=True)
+    @mock.patch('postprocessor.common.GetUpperLevelDir', autospec=True)
+    @mock.patch('postprocessor.common.ReadXmlFileOrDefault', autospec=True)
+    def test_PostProcessor_RemoveDeletedPosts(self, mock_readxmlfileordefault, mock_getupperleveldir, mock_logging):
+        # Arrange
+        mock_getupperleveldir.return_value = self.tempDir
+
+        def Prepare(n):
+            cachedIdsXml = Element('posts')
+            cachedImagesXml = Element('images')
+            for i in xrange(n):
+                SubElement(cachedIdsXml, 'post', {'dbid': str(i), 'publicid': str(i * 256)})
+                imageXml = SubElement(cachedImagesXml, 'image', {'remote': 'http://a.bcd/%d.jpg' % i, 'local': '%d.jpg' % i})
+                SubElement(SubElement(imageXml, 'posts'), 'post', {'dbid': str(i)})
+            mock_readxmlfileordefault.side_effect = [cachedImagesXml, cachedIdsXml]
+            return postprocessor.PostProcessor('Foo', self.__getEnvironment()), [postprocessor.SyncItem(i, None) for i in xrange(0, n, 2)]
+
+        # Act & Assert
+        self.assertRoughlyLinear(Prepare, lambda args: args[0].RemoveDeletedPosts(args[1]), 2000)
+
+    @mock.patch('commentprocessor.logging.getLogger', autospec=True)
+    @mock.patch('commentprocessor.common.GetUpperLevelDir', autospec=True)
+    @mock.patch('commentprocessor.common.ReadXmlFileOrDefault', autospec=True)
+    def test_CommentProcessor_MergeUserIdsMapXmlWithCache(self, mock_readxmlfileordefault, mock_getupperleveldir, mock_logging):
+        # Arrange
+        mock_getupperleveldir.return_value = self.tempDir
+        commPrc = commentprocessor.CommentProcessor(self.__getEnvironment())
+
+        def Prepare(n):
+            cachedIdsXml = Element('usermaps')
+            userIdsMapXml = Element('usermaps')
+            for i in xrange(n):
+                SubElement(cachedIdsXml, 'usermap', {'id': str(i), 'user': 'user%d' % i})
+                SubElement(userIdsMapXml, 'usermap', {'id': str(i + n / 2), 'user': 'user%d' % (i + n / 2)})
+            mock_readxmlfileordefault.return_value = cachedIdsXml
+            return userIdsMapXml
+
+        # Act & Assert
+        self.assertRoughlyLinear(Prepare, commPrc.MergeUserIdsMapXmlWithCache, 2000)
+
+    @mock.patch('commentmetadatastore.logging.getLogger', autospec=True)
+    def test_CommentMetadataStore_RemoveDeletedCommentsMetadata(self, mock_logging):
+        # Arrange
+        stores = []
+
+        def Prepare(n):
+            store = commentmetadatastore.CommentMetadataStore(os.path.join(self.tempDir, 'store%d.dat' % len(stores)), '%Y-%m-%d %H:%M:%S')
+            store.Open()
+            stores.append(store)
+            self.addCleanup(store.Close)
+            for i in xrange(1, n + 1):
+                store.Update(i, 'A', '2015-01-30 23:43:12', None)
+            return store, n, [str(i) for i in xrange(1, n + 1, 2)]
+
+        # Act & Assert
+        self.assertRoughlyLinear(Prepare, lambda args: args[0].RemoveDeletedCommentsMetadata(1, args[1], args[2]), 5000)
+
+    def assertRoughlyLinear(self, prepare, operation, size):
+        timings = [self.__getBestTime(prepare, operation, n) for n in (size, size * self.sizeFactor)]
+        growthRatio = timings[1] / max(timings[0], 1e-6)
+        self.assertTrue(growthRatio < self.maxGrowthRatio, u'Time grew %.1f times on %d times bigger input (%.4fs -> %.4fs)' %
+                        (growthRatio, self.sizeFactor, timings[0], timings[1]))
+
+    def __getBestTime(self, prepare, operation, n):
+        bestTime = None
+        for i in xrange(self.repeat):
+            args = prepare(n) # operations change their input, so every run gets a fresh copy
+            gcWasEnabled = gc.isenabled()
+            gc.disable()
+            try:
+                startTime = time.time()
+                operation(args)
+                elapsedTime = time.time() - startTime
+            finally:
+                if gcWasEnabled:
+                    gc.enable()
+            bestTime = elapsedTime if bestTime is None else min(bestTime, elapsedTime)
+        return bestTime
+
+    def __getEnvironment(self):
+        return {'cnn': mock.create_autospec(connection.Connection, instance = True),
+                'passwordHash': 'abc',
+                'sectionName': 'A',
+                'journal': 'B',
+                'server': 'http://a.bcd',
+                'serverSchema': 'http',
+                'serverNetloc': 'a.bcd',
+                'applyXSLT': False,
+                'archiveImages': True,
+                'exportCommentsPage': 'a.html',
+                'delay': 0,
+                'cachedDataFolder': 'cacheddatafolder',
+                'cachedPostIdsFile': 'cachedPostIdsFile.xml',
+                'xsltFile': 'xsltFile.xml',
+                'dateFormatString': '%Y-%m-%d %H:%M:%S'}
+
+if __name__ == '__main__':
+    unittest.main()
@@ -110,6 +110,9 @@ class ConfigReaderTestCase(unittest.TestCase):
         self.assertTrue(result[0]['applyXSLT'])
         self.assertFalse(result[0]['archiveComments'])
         self.assertTrue(result[0]['archiveImages'])
+        self.assertEqual(result[0]['fullSyncIntervalDays'], 7)
+        self.assertEqual(result[0]['maxConcurrentJournals'], 1)
+        self.assertEqual(result[0]['syncIntervalMinutes'], 60)
 
     @mock.patch('configreader.ReadXmlFileOrDefault', autospec=True)
     def test_GetConfig_NoUserName(self, mock_readxmlordefault):
@@ -133,6 +136,47 @@ class ConfigReaderTestCase(unittest.TestCase):
         # Assert
         self.assertEqual(u'%s' % str(assertEx.exception), u'No user name specified for one of the users in config section with name A')
 
+    @mock.patch('configreader.ReadXmlFileOrDefault', autospec=True)
+    def test_GetConfig_InvalidMaxConcurrentJournals(self, mock_readxmlordefault):
+        # Arrange
+        mock_readxmlordefault.return_value = fromstring('<configSections>' +
+                                                            '<configSection name="A">' +
+                                                                '<server>abc</server>' +
+                                                                '<exportCommentsPage>abc</exportCommentsPage>' +
+                                                                '<maxConcurrentJournals>0</maxConcurrentJournals>' +
+                                                            '</configSection>' +
+                                                        '</configSections>')
+
+        # Act
+        with self.assertRaises(ValueError) as assertEx:
+            GetConfig('a:\\b\\c.config')
+
+        # Assert
+        self.assertEqual(u'%s' % str(assertEx.exception), u'Max concurrent journals in config section with name A should be a whole number greater than 0')
+
+    @mock.patch('configreader.ReadXmlFileOrDefault', autospec=True)
+    def test_GetConfig_InvalidFullSyncInterval(self, mock_readxmlordefault):
+        # Arrange
+        mock_readxmlordefault.return_value = fromstring('<configSections>' +
+                                                            '<configSection name="A">' +
+                                                                '<server>abc</server>' +
+                                                                '<exportCommentsPage>abc</exportCommentsPage>' +
+                                                                '<users>' +
+                                                                    '<user>' +
+                                                                        '<name>abc</name>' +
+                                                                        '<fullSyncIntervalDays>week</fullSyncIntervalDays>' +
+                                                                    '</user>' +
+                                                                '</users>' +
+                                                            '</configSection>' +
+                                                        '</configSections>')
+
+        # Act
+        with self.assertRaises(ValueError) as assertEx:
+            GetConfig('a:\\b\\c.config')
+
+        # Assert
+        self.assertEqual(u'%s' % str(assertEx.exception), u'Full sync interval for user abc in config section with name A should be a whole number of days')
+
     @mock.patch('configreader.ReadXmlFileOrDefault', autospec=True)
     def test_GetConfig_NoUsers(self,mock_readxmlordefault):
         # Arrange
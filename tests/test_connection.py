@@ -6,9 +6,14 @@ from collections import OrderedDict
 from cStringIO import StringIO
 import unittest
 import mock
+import tempfile
+import shutil
+from hashlib import sha1
 
 sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modules'))
 import connection
+import cassette
+import metrics
 import common
 
 class ConnectionTestCase(unittest.TestCase):
@@ -81,6 +86,88 @@ class ConnectionTestCase(unittest.TestCase):
         # Assert
         self.assertEqual(u'%s' % str(assertEx.exception), u'Could not read response from %s after 3 attempts' % url)
 		
+    @mock.patch('connection.logging', autospec=True)
+    @mock.patch('connection.urllib2.Request', autospec=True)
+    @mock.patch('connection.urllib2.urlopen', autospec=True)
+    def test_MakeRequest_CountsInMetrics(self, mock_urlopen, mock_request, mock_logging):
+        # Arrange
+        url = 'http://a.com/interface/flat'
+        mock_urlopen.return_value.read.side_effect = [httplib.BadStatusLine('URGH!'), 'success\nOK']
+        journalMetrics = metrics.JournalMetrics()
+        cnn = connection.Connection(1, 'Foo').WithMetrics(journalMetrics)
+
+        # Act
+        cnn.MakeRequest(url, {'mode': 'getevents'})
+
+        # Assert
+        self.assertEqual(journalMetrics.GetTotalCount('request.interface/flat.getevents'), 1)
+        self.assertEqual(journalMetrics.GetCounter('bytesReceived'), len('success\nOK'))
+        self.assertEqual(journalMetrics.GetCounter('retries'), 1)
+
+    def test_GetEndpointName(self):
+        # Arrange
+        cnn = connection.Connection(1, 'Foo')
+
+        # Act
+        result = [cnn.GetEndpointName('http://a.bcd/interface/flat', {'mode': 'syncitems', 'ver': 1}),
+                  cnn.GetEndpointName('http://a.bcd/export_comments.bml', {'get': 'comment_body', 'startid': 1}),
+                  cnn.GetEndpointName('http://a.bcd/profile', {'userid': 1}),
+                  cnn.GetEndpointName('http://a.bcd', {})]
+
+        # Assert
+        self.assertEqual(result, ['interface/flat.syncitems', 'export_comments.bml.comment_body', 'profile', '/'])
+
+    @mock.patch('connection.urllib2.Request', autospec=True)
+    @mock.patch('connection.urllib2.urlopen', autospec=True)
+    def test_MakeRequest_RecordsToCassette(self, mock_urlopen, mock_request):
+        # Arrange
+        url = 'http://a.com'
+        params = {'mode': 'getevents', 'auth_challenge': 'c0:1', 'auth_response': 'abc'}
+        mock_urlopen.return_value.read.return_value = 'success\nOK'
+        recordingCassette = mock.create_autospec(cassette.Cassette, instance = True)
+        cnn = connection.Connection(1, 'Foo', recordingCassette)
+        recordingCassette.IsReplaying.return_value = False
+
+        # Act
+        cnn.MakeRequest(url, params, hdrs = {'Cookie': 'ljsession=v2:u1:s1:abc//1'})
+
+        # Assert
+        name, args, kwargs = recordingCassette.Record.mock_calls[0]
+        self.assertEqual(args[:5], ('POST', url, {'mode': 'getevents', 'auth_challenge': cnn.secretWord, 'auth_response': cnn.secretWord},
+                                    {'Cookie': 'ljsession=' + cnn.secretWord, 'User-Agent': 'Foo'}, 'success\nOK'))
+
+    @mock.patch('connection.urllib2.urlopen', autospec=True)
+    def test_MakeRequest_ReplaysFromCassette(self, mock_urlopen):
+        # Arrange
+        url = 'http://a.com'
+        replayingCassette = mock.create_autospec(cassette.Cassette, instance = True)
+        replayingCassette.IsReplaying.return_value = True
+        replayingCassette.Replay.return_value = {'body': u'\u4e00'.encode('utf8'), 'contentType': None, 'errorCode': None}
+        cnn = connection.Connection(1, 'Foo', replayingCassette)
+
+        # Act
+        result = cnn.MakeRequest(url, {'mode': 'getchallenge', 'auth_response': 'abc'}, type = 'GET')
+
+        # Assert
+        self.assertEqual(result, u'\u4e00')
+        replayingCassette.Replay.assert_called_once_with('GET', url, {'mode': 'getchallenge', 'auth_response': cnn.secretWord})
+        self.assertEqual(mock_urlopen.call_count, 0)
+
+    def test_MakeRequest_ExceptionOnResponseNotInCassette(self):
+        # Arrange
+        url = 'http://a.com'
+        replayingCassette = mock.create_autospec(cassette.Cassette, instance = True)
+        replayingCassette.IsReplaying.return_value = True
+        replayingCassette.Replay.return_value = None
+        cnn = connection.Connection(1, 'Foo', replayingCassette)
+
+        # Act
+        with self.assertRaises(IOError) as assertEx:
+            cnn.MakeRequest(url, {'mode': 'getchallenge'})
+
+        # Assert
+        self.assertEqual(u'%s' % str(assertEx.exception), u'No recorded response from %s with params = %s in cassette' % (url, str({'mode': 'getchallenge'})))
+		
     def test_ReadServerAnswer_New(self):
         # Arrange
         input = 'auth_scheme\nc0\nsuccess\nOK\nsync_items\n0'
@@ -298,7 +385,7 @@ class ConnectionTestCase(unittest.TestCase):
 
         # Assert
         self.assertEqual(result, None)
-        cnn.logger.debug.assert_called_once_with(u'Content-type header %s for url %s is not one of an image' % (responseHdrs["Content-Type"], url))
+        cnn.logger.debug.assert_called_once_with(u'Content-type header %s for url %s is not one of an image', responseHdrs["Content-Type"], url)
 		
     @mock.patch('connection.logging.getLogger', autospec=True)
     @mock.patch('connection.urllib2.Request', autospec=True)
@@ -319,7 +406,7 @@ class ConnectionTestCase(unittest.TestCase):
 
         # Assert
         self.assertEqual(result, None)
-        cnn.logger.debug.assert_called_once_with(u'No content-type header for url %s' % url)
+        cnn.logger.debug.assert_called_once_with(u'No content-type header for url %s', url)
 		
     @mock.patch('connection.logging', autospec=True)
     @mock.patch('connection.urllib2.Request', autospec=True)
@@ -340,7 +427,7 @@ class ConnectionTestCase(unittest.TestCase):
 
         # Assert
         self.assertEqual(result, None)
-        cnn.logger.debug.assert_called_once_with(u'Error 404 on downloading from url %s, stopping download attempts' % url)
+        cnn.logger.debug.assert_called_once_with(u'Error %d on downloading from url %s, stopping download attempts', 404, url)
 		
     @mock.patch('connection.logging', autospec=True)
     @mock.patch('connection.urllib2.Request', autospec=True)
@@ -361,8 +448,8 @@ class ConnectionTestCase(unittest.TestCase):
 
         # Assert
         self.assertEqual(result, None)
-        cnn.logger.debug.assert_called_with(u'Exception on downloading attempt #3 from url %s' % url, exc_info = True)
-        cnn.logger.warning.assert_called_once_with(u'Couldn\'t download image from url %s after 3 attempts' % url)
+        cnn.logger.debug.assert_called_with(u'Exception on downloading attempt #%d from url %s', 3, url, exc_info = True)
+        cnn.logger.warning.assert_called_once_with(u'Couldn\'t download image from url %s after %d attempts', url, 3)
 		
     @mock.patch('connection.logging', autospec=True)
     @mock.patch('connection.urllib2.Request', autospec=True)
@@ -383,8 +470,8 @@ class ConnectionTestCase(unittest.TestCase):
 
         # Assert
         self.assertEqual(result, None)
-        cnn.logger.debug.assert_called_with(u'Exception on downloading attempt #3 from url %s' % url, exc_info = True)
-        cnn.logger.warning.assert_called_once_with(u'Couldn\'t download image from url %s after 3 attempts' % url)
+        cnn.logger.debug.assert_called_with(u'Exception on downloading attempt #%d from url %s', 3, url, exc_info = True)
+        cnn.logger.warning.assert_called_once_with(u'Couldn\'t download image from url %s after %d attempts', url, 3)
 		
     @mock.patch('connection.logging', autospec=True)
     @mock.patch('connection.urllib2.Request', autospec=True)
@@ -409,6 +496,52 @@ class ConnectionTestCase(unittest.TestCase):
         # Assert
         self.assertEqual(result, u'a:\\b\\img (a.com).png')
 		
+    @mock.patch('connection.urllib2.Request', autospec=True)
+    @mock.patch('connection.urllib2.urlopen', autospec=True)
+    def test_DownloadImage_SharedImages_SameImageFromTwoUrls(self, mock_urlopen, mock_request):
+        # Arrange
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir, True)
+        imagesPath, sharedImagesPath = os.path.join(tempDir, u'images'), os.path.join(tempDir, u'shared images')
+        responseHdrs = httplib.HTTPMessage(StringIO(""))
+        responseHdrs["Content-Type"] = "image/jpeg"
+        mock_urlopen.return_value.read.side_effect = [b'0123456', b'', b'0123456', b'']
+        mock_urlopen.return_value.info.return_value = responseHdrs
+        cnn = connection.Connection(1, 'Foo')
+
+        # Act
+        result1 = cnn.DownloadImage('http://a.com/img.jpg', imagesPath, sharedImagesPath = sharedImagesPath)
+        result2 = cnn.DownloadImage('http://b.com/copy.jpg', imagesPath, sharedImagesPath = sharedImagesPath)
+
+        # Assert
+        self.assertEqual(result1, os.path.join(imagesPath, u'img (a.com).jpg'))
+        self.assertEqual(result2, os.path.join(imagesPath, u'copy (b.com).jpg'))
+        contentHash = sha1(b'0123456').hexdigest()
+        self.assertEqual(os.listdir(sharedImagesPath), [contentHash[:2]])
+        self.assertEqual(os.listdir(os.path.join(sharedImagesPath, contentHash[:2])), [u'%s.jpg' % contentHash])
+        for result in [result1, result2]:
+            with open(result, 'rb') as f:
+                self.assertEqual(f.read(), b'0123456')
+        self.assertEqual(cnn.metrics.GetCounter('sharedImagesReused'), 1)
+
+    @mock.patch('connection.logging', autospec=True)
+    @mock.patch('connection.urllib2.urlopen', autospec=True)
+    def test_DownloadImage_ReplaysErrorFromCassette(self, mock_urlopen, mock_logging):
+        # Arrange
+        url = 'http://a.com/img.png'
+        replayingCassette = mock.create_autospec(cassette.Cassette, instance = True)
+        replayingCassette.IsReplaying.return_value = True
+        replayingCassette.Replay.return_value = {'body': None, 'contentType': None, 'errorCode': 404}
+        cnn = connection.Connection(1, 'Foo', replayingCassette)
+
+        # Act
+        result = cnn.DownloadImage(url, 'a:\\b\\')
+
+        # Assert
+        self.assertEqual(result, None)
+        self.assertEqual(mock_urlopen.call_count, 0)
+        cnn.logger.debug.assert_called_once_with(u'Error %d on downloading from url %s, stopping download attempts', 404, url)
+		
 	"""Technically speaking, we shouldn't be testing private methods of a class... but an extra unit test or two won't hurt"""
     def test___stripSensitiveInfoFromParams(self):
         # Arrange
@@ -0,0 +1,109 @@
+import os
+import sys
+import unittest
+import mock
+from xml.etree.ElementTree import fromstring
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modules'))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import connection
+import common
+from benchmarks import fakeljserver
+
+class FakeLjServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.fixture = {'journals': {'test_account': {'password': 'pwd',
+                                                      'posts': [{'itemid': 2, 'anum': 7, 'time': '2016-12-07 10:00:00', 'eventtime': '2016-12-07 09:00:00',
+                                                                 'subject': u'Second', 'event': u'<p>Line\nbreak</p>', 'props': {'taglist': u'a, b'}},
+                                                                {'itemid': 1, 'anum': 12, 'time': '2016-12-06 03:25:00', 'eventtime': '2016-12-06 03:20:00',
+                                                                 'subject': u'First', 'event': u'<p>Text</p>', 'props': {}}],
+                                                      'comments': [{'id': 1, 'jitemid': 1, 'posterid': 10, 'parentid': 0, 'state': 'A',
+                                                                    'subject': u'Hi', 'body': u'Body & more', 'date': '2016-12-06T04:00:00Z'},
+                                                                   {'id': 3, 'jitemid': 1, 'posterid': 11, 'parentid': 1, 'state': 'D'}],
+                                                      'usermaps': {'10': 'some_user', '11': 'ext_11'}}},
+                        'profiles': {'11': u'Real Name'},
+                        'images': {'1.jpg': 100}}
+        self.connParams = {'user': 'test_account', 'pwdhash': common.MD5('pwd')}
+
+    def test_FlatInterface(self):
+        # Arrange
+        cnn, server = self.__getConnectionAndServer()
+
+        # Act
+        syncItems = cnn.MakeServerRequestWithAuthentication(self.connParams, 'syncitems', {'lastsync': '2016-12-06 03:25:00'})
+        post = cnn.MakeServerRequestWithAuthentication(self.connParams, 'getevents', {'selecttype': 'one', 'itemid': 2})
+        dayCounts = cnn.MakeServerRequestWithAuthentication(self.connParams, 'getdaycounts', {})
+
+        # Assert
+        self.assertEqual(syncItems['sync_count'], '1')
+        self.assertEqual(syncItems['sync_1_item'], 'L-2')
+        self.assertEqual(post['events_1_anum'], '7')
+        self.assertEqual(post['events_1_event'], '%3Cp%3ELine%0Abreak%3C%2Fp%3E')
+        self.assertEqual(post['prop_1_name'], 'taglist')
+        self.assertEqual(dict(dayCounts), {'2016-12-06': '1', '2016-12-07': '1'})
+        self.assertEqual(server.GetRequestCount('getchallenge'), 3)
+
+    def test_FlatInterface_WrongPassword(self):
+        # Arrange
+        cnn, server = self.__getConnectionAndServer()
+
+        # Act & Assert
+        with self.assertRaises(RuntimeError):
+            cnn.MakeServerRequestWithAuthentication(common.MergeDicts(self.connParams, {'pwdhash': common.MD5('wrong')}), 'syncitems', {})
+
+    def test_ExportComments(self):
+        # Arrange
+        cnn, server = self.__getConnectionAndServer()
+        token = cnn.GetSessionToken(self.connParams)
+
+        # Act
+        metadata = fromstring(cnn.MakeRequest('%s/export_comments.bml' % server.url, {'get': 'comment_meta', 'startid': 0}, {'Cookie': 'ljsession=%s' % token}, 'GET').encode('utf-8'))
+        bodies = fromstring(cnn.MakeRequest('%s/export_comments.bml' % server.url, {'get': 'comment_body', 'startid': 2}, {'Cookie': 'ljsession=%s' % token}, 'GET').encode('utf-8'))
+        cnn.ExpireSession(self.connParams, token)
+
+        # Assert
+        self.assertEqual(metadata.find('maxid').text, '3')
+        self.assertEqual([usermap.attrib['user'] for usermap in metadata.iterfind('usermaps/usermap')], ['some_user', 'ext_11'])
+        self.assertEqual([comment.attrib['id'] for comment in bodies.iterfind('comments/comment')], ['3'])
+        self.assertTrue(bodies.find('comments/comment/body') is None)
+        self.assertEqual(server.sessions, {})
+
+    def test_Profile(self):
+        # Arrange
+        cnn, server = self.__getConnectionAndServer()
+
+        # Act
+        result = cnn.MakeRequest('%s/profile' % server.url, {'userid': 11, 't': 'I'}, type = 'GET')
+
+        # Assert
+        self.assertTrue('<title>Real Name - Profile</title>' in result)
+
+    def test_ErrorInjection(self):
+        # Arrange
+        cnn, server = self.__getConnectionAndServer(errorRate = 1)
+
+        # Act & Assert
+        with self.assertRaises(IOError):
+            cnn.MakeRequest('%s/profile' % server.url, {'userid': 11, 't': 'I'}, type = 'GET')
+        self.assertEqual(server.GetRequestCount('profile'), cnn.onExceptionRepeatCount)
+
+    def test_IsRateLimited(self):
+        # Arrange
+        server = fakeljserver.FakeLjServer(self.fixture, maxRequestsPerSecond = 2)
+
+        # Act
+        result = [server.IsRateLimited(now) for now in [100, 100.1, 100.2, 101.15]]
+
+        # Assert
+        self.assertEqual(result, [False, False, True, False])
+
+    def __getConnectionAndServer(self, **kwargs):
+        server = fakeljserver.FakeLjServer(self.fixture, **kwargs)
+        self.connParams['server'] = server.Start()
+        self.addCleanup(server.Stop)
+        with mock.patch('connection.logging.getLogger', autospec=True):
+            cnn = connection.Connection(5, 'Test')
+        return cnn, server
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modules'))
+import htmltokenizer
+
+class HtmlTokenizerTestCase(unittest.TestCase):
+    def test_ParseTags(self):
+        # Arrange
+        markup = u'<A HREF="http://a.bcd/?a=1&amp;b=2"><lj user="foo"><IMG SRC=\'i.jpg\' alt="a>b"></A><img src=/j.jpg/><p><img src></p>'
+
+        # Act
+        result = htmltokenizer.ParseTags(markup, ['img', 'a'])
+
+        # Assert
+        self.assertEqual([(tag.name, tag.get('src'), tag.parent.name) for tag in result],
+                         [(u'a', None, None), (u'img', u'i.jpg', u'lj'), (u'img', u'/j.jpg/', None), (u'img', u'', u'p')])
+        self.assertEqual(result[0].get('href'), u'http://a.bcd/?a=1&b=2')
+        self.assertEqual(result[1].get('alt'), u'a>b')
+
+    def test_ParseTags_SkipsCommentsScriptsAndClosesSelfClosingTags(self):
+        # Arrange
+        markup = u'<!-- <img src="a.jpg"> --><script>if (a<img) {}</script><a href="x"/><span/><img src="b.jpg"><a href=/x/><img src="c.jpg">'
+
+        # Act
+        result = htmltokenizer.ParseTags(markup, ['img'])
+
+        # Assert
+        self.assertEqual([(tag.get('src'), tag.parent.name) for tag in result], [(u'b.jpg', None), (u'c.jpg', u'a')])
+
+    def test_PatchTags(self):
+        # Arrange
+        markup = u'Текст <user name="foo"> <a href="l.jpg"><IMG SRC="i.jpg" WIDTH="800px" /></a><img src="j.jpg" data-local-src="old"><img/><br>'
+        tags = htmltokenizer.ParseTags(markup, ['img', 'a'])
+
+        # Act
+        tags[0]['data-local-src'] = u'images/l "1".jpg'
+        tags[1]['data-local-src'] = u'images/i&1.jpg'
+        tags[2]['data-local-src'] = u'images/j.jpg'
+        tags[3]['data-local-src'] = u'images/k.jpg'
+        result = htmltokenizer.PatchTags(markup, tags)
+
+        # Assert
+        self.assertEqual(result, u'Текст <user name="foo"> <a href="l.jpg" data-local-src="images/l &quot;1&quot;.jpg"><IMG SRC="i.jpg" WIDTH="800px" data-local-src="images/i&amp;1.jpg" /></a>'
+                                 u'<img src="j.jpg" data-local-src="images/j.jpg"><img data-local-src="images/k.jpg"/><br>')
+
+    def test_PatchTags_NothingChanged(self):
+        # Arrange
+        markup = u'<p>Some <b>markup</b> <lj user="foo"> <img src="i.jpg"></p>'
+
+        # Act
+        result = htmltokenizer.PatchTags(markup, htmltokenizer.ParseTags(markup))
+
+        # Assert
+        self.assertIs(result, markup)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -279,6 +279,25 @@ class ImageScraperTestCase(unittest.TestCase):
         # Assert
         self.assertEqual(markup, result['updatedMarkup'])
 		
+    @mock.patch('imagescraper.logging', autospec=True)
+    @mock.patch('imagescraper.time', autospec=True)
+    @mock.patch('connection.Connection', autospec=True)
+    def test_ScrapeImages_KeepsRestOfMarkupAsItIs(self, mock_cnn, mock_time, mock_logging):
+        # Arrange
+        imagesFolder = 'images'
+        markup = u'<p>Текст <lj user="foo"> <A HREF="http://a.bcd/l-i.jpg"><IMG SRC="http://a.bcd/i.jpg?a=1&amp;b=2" WIDTH=800><br></A></p>'
+        settings = self.__getScraperSettings(fromstring('<images/>'), imagesFolder)
+        mock_cnn.return_value.DownloadImage.side_effect = [os.path.join('a', imagesFolder, 'i.jpg'), os.path.join('a', imagesFolder, 'l-i.jpg')]
+
+        # Act
+        result = imagescraper.ImageScraper.ScrapeImages(markup, settings)
+
+        # Assert
+        self.assertEqual(result['updatedMarkup'], u'<p>Текст <lj user="foo"> <A HREF="http://a.bcd/l-i.jpg" data-local-src="images/l-i.jpg">'
+                                                  u'<IMG SRC="http://a.bcd/i.jpg?a=1&amp;b=2" WIDTH=800 data-local-src="images/i.jpg"><br></A></p>')
+        self.assertEqual(result['downloadedImageInfos'][0]['remote'], u'http://a.bcd/i.jpg?a=1&b=2')
+        self.assertEqual(mock_cnn.return_value.DownloadImage.call_args_list[0][0][0], u'http://a.bcd/i.jpg?a=1&b=2')
+
     def __getScraperSettings(self, cachedImagesXml, imagesFolder):
         return {'cnn': connection.Connection(1, 'Foo'),
                     'httpRequestDelaySeconds': 1,
@@ -0,0 +1,108 @@
+import os
+import sys
+import unittest
+import mock
+import tempfile
+import shutil
+import filecmp
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modules'))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import common
+import connection
+import postprocessor
+import commentprocessor
+from benchmarks import fakeljserver, journalgenerator
+
+class JournalGeneratorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, ignore_errors = True)
+
+    def test_GenerateFixture_SameSeedSameFixture(self):
+        # Act
+        result1 = journalgenerator.JournalGenerator(5).GenerateFixture(postCount = 20, commentCount = 100)
+        result2 = journalgenerator.JournalGenerator(5).GenerateFixture(postCount = 20, commentCount = 100)
+
+        # Assert
+        self.assertEqual(result1, result2)
+
+    def test_GenerateFixture(self):
+        # Arrange
+        generator = journalgenerator.JournalGenerator()
+
+        # Act
+        result = generator.GenerateFixture(postCount = 50, commentCount = 1000, userCount = 40)
+
+        # Assert
+        journal = result['journals']['test_account']
+        self.assertEqual(len(journal['posts']), 50)
+        self.assertEqual(len(journal['comments']), 1000)
+        self.assertEqual(len(journal['usermaps']), 40)
+        self.assertTrue(all(journal['usermaps'][userId].startswith('ext_') for userId in result['profiles']))
+        commentsById = dict((comment['id'], comment) for comment in journal['comments'])
+        depths = {}
+        for comment in journal['comments']:
+            if comment['parentid'] != 0:
+                self.assertEqual(commentsById[comment['parentid']]['jitemid'], comment['jitemid'])
+            depths[comment['id']] = depths.get(comment['parentid'], 0) + 1
+        self.assertTrue(2 < max(depths.values()) <= generator.maxThreadDepth)
+
+    def test_ChangeFixture(self):
+        # Arrange
+        generator = journalgenerator.JournalGenerator()
+        fixture = generator.GenerateFixture(postCount = 50, commentCount = 500)
+        journal = fixture['journals']['test_account']
+
+        # Act
+        result = generator.ChangeFixture(fixture, newPostCount = 2, editedPostCount = 3, deletedPostCount = 4, newCommentCount = 10, deletedCommentCount = 5)
+
+        # Assert
+        changedJournal = result['journals']['test_account']
+        lastSync = max(post['time'] for post in journal['posts'])
+        self.assertEqual(len(changedJournal['posts']), 48)
+        self.assertEqual(len([post for post in changedJournal['posts'] if post['time'] > lastSync]), 5)
+        postIds = set(post['itemid'] for post in changedJournal['posts'])
+        self.assertTrue(all(comment['jitemid'] in postIds for comment in changedJournal['comments']))
+        self.assertEqual(len([comment for comment in changedJournal['comments'] if comment['state'] == 'D']), 5)
+        self.assertEqual(len([comment for comment in changedJournal['comments'] if comment['id'] > journal['comments'][-1]['id']]), 10)
+        self.assertEqual(len(journal['posts']), 50)
+
+    def test_WriteArchive_ArchiverSyncsItToChangedFixture(self):
+        # Arrange
+        generator = journalgenerator.JournalGenerator(1)
+        fixture = generator.GenerateFixture(postCount = 30, commentCount = 300)
+        changedFixture = generator.ChangeFixture(fixture, newPostCount = 2, editedPostCount = 2, deletedPostCount = 2,
+                                                 newCommentCount = 20, editedCommentCount = 3, deletedCommentCount = 3)
+        server = fakeljserver.FakeLjServer(changedFixture)
+        url = server.Start()
+        self.addCleanup(server.Stop)
+        archivePath = os.path.join(self.tempDir, 'archive')
+        expectedArchivePath = os.path.join(self.tempDir, 'expected')
+        journalgenerator.WriteArchive(fixture, archivePath, server = url)
+        journalgenerator.WriteArchive(changedFixture, expectedArchivePath, server = url)
+        environment = self.__getEnvironment(url)
+
+        # Act
+        with mock.patch('common.GetUpperLevelDir', return_value = archivePath), mock.patch('postprocessor.logging.getLogger', autospec=True), \
+             mock.patch('commentprocessor.logging.getLogger', autospec=True):
+            postprocessor.PostProcessor('Archiver', environment).ProcessPosts()
+            commentprocessor.CommentProcessor(environment).ProcessComments()
+
+        # Assert
+        self.assertEqual(server.GetRequestCount('getevents'), 4)
+        comparison = filecmp.dircmp(os.path.join(archivePath, 'LiveJournal', 'test_account'), os.path.join(expectedArchivePath, 'LiveJournal', 'test_account'))
+        self.assertEqual((comparison.left_only, comparison.right_only, comparison.diff_files), ([], [], []))
+
+    def __getEnvironment(self, url):
+        with mock.patch('connection.logging.getLogger', autospec=True):
+            cnn = connection.Connection(5, 'Test')
+        return {'cnn': cnn, 'delay': 0, 'cachedDataFolder': 'cached data', 'cachedPostIdsFile': 'cachedpostids.xml', 'xsltFile': 'stylesheet.xsl',
+                'dateFormatString': '%Y-%m-%d %H:%M:%S', 'applyXSLT': False, 'archiveImages': False, 'archiveComments': True, 'fullSyncIntervalDays': 7,
+                'sectionName': 'LiveJournal', 'journal': 'test_account', 'server': url, 'serverSchema': 'http', 'serverNetloc': url.split('://')[1],
+                'exportCommentsPage': 'export_comments.bml', 'passwordHash': common.MD5('pwd')}
+
+if __name__ == '__main__':
+    unittest.main()
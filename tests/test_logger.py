@@ -0,0 +1,57 @@
+import os
+import sys
+import unittest
+import mock
+import logging
+import Queue
+from logging import handlers
+
+mainPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(mainPath)
+
+from modules import logger
+
+class LoggerTestCase(unittest.TestCase):
+    def test_QueueListener_HandlesRecordsOnItsThreadRespectingLevels(self):
+        # Arrange
+        logQueue = Queue.Queue()
+        infoHandler = handlers.BufferingHandler(10)
+        infoHandler.setLevel(logging.INFO)
+        debugHandler = handlers.BufferingHandler(10)
+        testLogger = logging.getLogger('test_QueueListener')
+        testLogger.setLevel(logging.DEBUG)
+        testLogger.propagate = False
+        testLogger.addHandler(logger.QueueHandler(logQueue))
+        self.addCleanup(testLogger.handlers.pop)
+        listener = logger.QueueListener(logQueue, infoHandler, debugHandler)
+        listener.start()
+
+        # Act
+        testLogger.debug(u'%s: details', 'A')
+        testLogger.info(u'%s: %d post(s) saved', 'A', 2)
+        listener.stop()
+
+        # Assert
+        self.assertEqual([record.getMessage() for record in infoHandler.buffer], [u'A: 2 post(s) saved'])
+        self.assertEqual([record.getMessage() for record in debugHandler.buffer], [u'A: details', u'A: 2 post(s) saved'])
+        self.assertEqual(infoHandler.buffer[0].funcName, 'test_QueueListener_HandlesRecordsOnItsThreadRespectingLevels')
+        self.assertTrue(logQueue.empty())
+        self.assertIsNone(listener.thread)
+
+    def test_QueueHandler_DoesNotFormatMessage(self):
+        # Arrange
+        logQueue = Queue.Queue()
+        handler = logger.QueueHandler(logQueue)
+        markup = mock.Mock()
+        markup.__unicode__ = mock.Mock(return_value = u'<p></p>')
+        record = logging.LogRecord('log', logging.DEBUG, 'a.py', 1, u'Markup "%s"', (markup,), None)
+
+        # Act
+        handler.handle(record)
+
+        # Assert
+        self.assertIs(logQueue.get_nowait().args[0], markup)
+        self.assertEqual(markup.__unicode__.call_count, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+import unittest
+import mock
+import tempfile
+import shutil
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modules'))
+import metrics
+import tracer
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, ignore_errors = True)
+
+    @mock.patch('metrics.time.time', autospec=True)
+    def test_GetReport(self, mock_time):
+        # Arrange
+        mock_time.side_effect = [100, 101, 103.5, 110]
+        journalMetrics = metrics.JournalMetrics('A', 'B')
+
+        # Act
+        journalMetrics.Increment('postsSaved')
+        journalMetrics.Increment('bytesReceived', 10)
+        journalMetrics.Increment('bytesReceived', 5)
+        journalMetrics.AddTime('request.interface/flat.getevents', 0.5)
+        journalMetrics.AddTime('request.interface/flat.getevents', 1.5)
+        with journalMetrics.Measure('sleep'):
+            pass
+        journalMetrics.Finish(True)
+        result = journalMetrics.GetReport()
+
+        # Assert
+        self.assertEqual(result, {'sectionName': 'A', 'journal': 'B', 'startTime': 100, 'durationSeconds': 10, 'succeeded': True, 'lastSuccessTime': 110,
+                                  'counters': {'postsSaved': 1, 'bytesReceived': 15},
+                                  'timings': {'request.interface/flat.getevents': {'count': 2, 'seconds': 2.0, 'maxSeconds': 1.5},
+                                              'sleep': {'count': 1, 'seconds': 2.5, 'maxSeconds': 2.5}}})
+
+    def test_Reset_KeepsLastSuccessTime(self):
+        # Arrange
+        journalMetrics = metrics.JournalMetrics('A', 'B')
+        journalMetrics.Increment('postsSaved')
+        journalMetrics.Finish(True)
+        lastSuccessTime = journalMetrics.lastSuccessTime
+
+        # Act
+        journalMetrics.Reset()
+        journalMetrics.Finish(False)
+
+        # Assert
+        self.assertEqual(journalMetrics.GetCounter('postsSaved'), 0)
+        self.assertEqual(journalMetrics.lastSuccessTime, lastSuccessTime)
+
+    def test_GetLastReport(self):
+        # Arrange
+        journalMetrics = metrics.JournalMetrics('A', 'B')
+        journalMetrics.Increment('postsSaved')
+        journalMetrics.Finish(True)
+
+        # Act
+        journalMetrics.Reset()
+        journalMetrics.Increment('postsFailed')
+        runningReport = journalMetrics.GetLastReport()
+        journalMetrics.Finish(False)
+        finishedReport = journalMetrics.GetLastReport()
+
+        # Assert
+        self.assertEqual((runningReport['counters'], runningReport['succeeded']), ({'postsSaved': 1}, True))
+        self.assertEqual((finishedReport['counters'], finishedReport['succeeded']), ({'postsFailed': 1}, False))
+
+    @mock.patch('metrics.time.time', autospec=True)
+    def test_Measure_AddsSpanToTracer(self, mock_time):
+        # Arrange
+        mock_time.side_effect = [100, 100, 101, 103.5, 104]
+        journalMetrics = metrics.JournalMetrics('A', 'B')
+        runTracer = tracer.Tracer()
+        journalMetrics.Reset(runTracer)
+
+        # Act
+        with journalMetrics.Measure('stage.post', {'postId': 7}):
+            pass
+        journalMetrics.AddTime('request.image', 0.5)
+
+        # Assert
+        self.assertEqual([(event['name'], event['ts'], event['dur'], event.get('args')) for event in runTracer.events],
+                         [('stage.post', 101000000, 2500000, {'postId': 7}), ('request.image', 103500000, 500000, None)])
+        self.assertEqual(journalMetrics.GetTotalSeconds('stage'), 2.5)
+
+    def test_Reset_DetachesTracer(self):
+        # Arrange
+        runTracer = tracer.Tracer()
+        journalMetrics = metrics.JournalMetrics('A', 'B')
+        journalMetrics.Reset(runTracer)
+
+        # Act
+        journalMetrics.Reset()
+        journalMetrics.AddTime('sleep', 1)
+
+        # Assert
+        self.assertEqual(runTracer.events, [])
+
+    def test_FormatSummary(self):
+        # Arrange
+        journalMetrics = metrics.JournalMetrics('A', 'B')
+        journalMetrics.AddTime('request.interface/flat.getevents', 1)
+        journalMetrics.AddTime('request.image', 2)
+        journalMetrics.AddTime('sleep', 3)
+        journalMetrics.AddTime('parse.post', 0.25)
+        journalMetrics.AddTime('write.post', 0.5)
+        journalMetrics.Increment('postsSaved', 2)
+        journalMetrics.durationSeconds = 7
+
+        # Act
+        result = journalMetrics.FormatSummary()
+
+        # Assert
+        self.assertEqual(result, u'A: B: run took 7.0s: 3.0s in 2 request(s), 3.0s sleeping, 0.2s parsing, 0.0s serializing, 0.5s writing files; postsSaved = 2')
+
+    def test_MetricsRegistry_SaveReport(self):
+        # Arrange
+        registry = metrics.MetricsRegistry()
+        registry.GetJournalMetrics('A', 'B').Increment('postsSaved')
+        registry.GetJournalMetrics('A', 'C')
+        path = os.path.join(self.tempDir, 'report', 'metrics.json')
+
+        # Act
+        registry.GetJournalMetrics('A', 'B').Increment('postsSaved')
+        registry.SaveReport(path)
+
+        # Assert
+        with open(path, 'r') as reportFile:
+            report = json.load(reportFile)
+        self.assertEqual([(journal['journal'], journal['counters']) for journal in report['journals']], [('B', {'postsSaved': 2}), ('C', {})])
+
+if __name__ == '__main__':
+    unittest.main()
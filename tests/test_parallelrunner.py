@@ -0,0 +1,81 @@
+import os
+import sys
+import unittest
+import mock
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modules'))
+import parallelrunner
+
+class ParallelRunnerTestCase(unittest.TestCase):
+    def test_GroupJournalsByServer(self):
+        # Arrange
+        configSections = [{'journal': 'a', 'serverNetloc': 'lj.com'}, {'journal': 'b', 'serverNetloc': 'dw.org'}, {'journal': 'c', 'serverNetloc': 'lj.com'}]
+
+        # Act
+        result = parallelrunner.GroupJournalsByServer(configSections)
+
+        # Assert
+        self.assertEqual(result.keys(), ['lj.com', 'dw.org'])
+        self.assertEqual([configSection['journal'] for configSection in result['lj.com']], ['a', 'c'])
+
+    def test_GetServerEnvironments(self):
+        # Arrange
+        configSections = [{'journal': 'a', 'maxConcurrentJournals': 2}, {'journal': 'b', 'maxConcurrentJournals': 2}, {'journal': 'c', 'maxConcurrentJournals': 2}]
+
+        # Act
+        concurrency, environments = parallelrunner.GetServerEnvironments(configSections, {'delay': 3, 'xsltFile': 'a.xsl'})
+
+        # Assert
+        self.assertEqual(concurrency, 2)
+        self.assertEqual([(environment['journal'], environment['delay'], environment['xsltFile']) for environment in environments], [('a', 6, 'a.xsl'), ('b', 6, 'a.xsl'), ('c', 6, 'a.xsl')])
+
+    def test_GetServerEnvironments_FewerJournalsThanAllowed(self):
+        # Arrange
+        configSections = [{'journal': 'a', 'maxConcurrentJournals': 4}]
+
+        # Act
+        concurrency, environments = parallelrunner.GetServerEnvironments(configSections, {'delay': 3})
+
+        # Assert
+        self.assertEqual(concurrency, 1)
+        self.assertEqual(environments[0]['delay'], 3)
+
+    def test_RunJournals(self):
+        # Arrange
+        configSections = [{'journal': 'a', 'serverNetloc': 'lj.com', 'maxConcurrentJournals': 2},
+                          {'journal': 'b', 'serverNetloc': 'lj.com', 'maxConcurrentJournals': 2},
+                          {'journal': 'c', 'serverNetloc': 'dw.org', 'maxConcurrentJournals': 1}]
+        processedJournals = {}
+        lock = threading.Lock()
+        def processJournal(environment):
+            with lock:
+                processedJournals[environment['journal']] = (environment['delay'], threading.current_thread().name)
+
+        # Act
+        parallelrunner.RunJournals(configSections, {'delay': 3}, processJournal)
+
+        # Assert
+        self.assertEqual(sorted(processedJournals.keys()), ['a', 'b', 'c'])
+        self.assertEqual([processedJournals[journal][0] for journal in ['a', 'b', 'c']], [6, 6, 3])
+        self.assertNotEqual(processedJournals['c'][1], threading.current_thread().name)
+
+    @mock.patch('parallelrunner.logging.getLogger', autospec=True)
+    def test_RunJournals_ErrorInOneJournal(self, mock_logging):
+        # Arrange
+        configSections = [{'journal': 'a', 'serverNetloc': 'lj.com'}, {'journal': 'b', 'serverNetloc': 'lj.com'}]
+        processedJournals = []
+        def processJournal(environment):
+            if environment['journal'] == 'a':
+                raise RuntimeError(u'Error')
+            processedJournals.append(environment['journal'])
+
+        # Act
+        parallelrunner.RunJournals(configSections, {'delay': 3}, processJournal)
+
+        # Assert
+        self.assertEqual(processedJournals, ['b'])
+        self.assertEqual(mock_logging.return_value.debug.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
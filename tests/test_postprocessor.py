@@ -3,6 +3,8 @@ import sys
 import unittest
 import mock
 import datetime
+import tempfile
+import shutil
 from collections import OrderedDict
 from xml.etree.ElementTree import fromstring, Element, tostring
 
@@ -45,12 +47,35 @@ class PostProcessorTestCase(unittest.TestCase):
         # Assert
         self.assertEqual(len(result.findall('tag')), 0)
 		
+    def test_DecodePostData(self):
+        # Arrange
+        postData = OrderedDict()
+        postData[u'events_1_itemid'] = u'2'
+        postData[u'events_1_anum'] = u'1'
+        postData[u'events_1_test_event_prop'] = u'abc'
+        postData[u'events_count'] = u'1'
+        postData[u'prop_1_name'] = u'current_mood'
+        postData[u'prop_2_value'] = u'A - BCD.mp3'
+        postData[u'prop_1_value'] = u'URGH!'
+        postData[u'prop_2_name'] = u'current_music'
+        postData[u'prop_count'] = u'2'
+        postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, False))
+
+        # Act
+        result = postPrc.DecodePostData(postData)
+
+        # Assert
+        self.assertEqual(result.events.items(), [(u'itemid', u'2'), (u'anum', u'1'), (u'test_event_prop', u'abc')])
+        self.assertEqual(result.props.items(), [(u'current_mood', u'URGH!'), (u'current_music', u'A - BCD.mp3')])
+        self.assertEqual(result.itemId, u'2')
+        self.assertEqual(result.anum, u'1')
+
     def test_GetPublicPostId(self):
         # Arrange
         postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, False))
 
         # Act
-        result = postPrc.GetPublicPostId({'events_101_itemid': '1', 'events_101_anum': '2'})
+        result = postPrc.GetPublicPostId(postPrc.DecodePostData({'events_101_itemid': '1', 'events_101_anum': '2'}))
 
         # Assert
         self.assertEqual(result, 258)
@@ -61,7 +86,7 @@ class PostProcessorTestCase(unittest.TestCase):
 
         # Act
         with self.assertRaises(ValueError) as assertEx:
-            postPrc.GetPublicPostId({'abc': '1', 'events_101_anum': '2'})
+            postPrc.GetPublicPostId(postPrc.DecodePostData({'abc': '1', 'events_101_anum': '2'}))
 
         # Assert
         self.assertEqual(u'%s' % str(assertEx.exception), u'Could not get itemid from post data')
@@ -72,7 +97,7 @@ class PostProcessorTestCase(unittest.TestCase):
 
         # Act
         with self.assertRaises(ValueError) as assertEx:
-            postPrc.GetPublicPostId({'events_101_itemid': '1', 'abc': '2'})
+            postPrc.GetPublicPostId(postPrc.DecodePostData({'events_101_itemid': '1', 'abc': '2'}))
 
         # Assert
         self.assertEqual(u'%s' % str(assertEx.exception), u'Could not get anum from post data')
@@ -228,7 +253,7 @@ class PostProcessorTestCase(unittest.TestCase):
         postPrc = postprocessor.PostProcessor('Foo', env)
 
         # Act
-        result = postPrc.FlatPostDataToXmlObject(postData)
+        result = postPrc.FlatPostDataToXmlObject(postPrc.DecodePostData(postData))
 
         # Assert
         self.assertEqual(tostring(result), u'<post>' +
@@ -266,11 +291,11 @@ class PostProcessorTestCase(unittest.TestCase):
         postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, False))
 
         # Act
-        postPrc.SavePostToFile(postData, '1234.xml')
+        postPrc.SavePostToFile(postPrc.DecodePostData(postData), '1234.xml')
 
         # Assert
         file_handle = mock_open.return_value.__enter__.return_value
-        xmlToCheckAgainst = postPrc.FlatPostDataToXmlObject(postData)
+        xmlToCheckAgainst = postPrc.FlatPostDataToXmlObject(postPrc.DecodePostData(postData))
         common.CreateXmlElement('comments', oldPostComments.find('comments'), xmlToCheckAgainst) # add comments to xml to check against
         file_handle.write.assert_called_with(common.PrettyPrintXml(xmlToCheckAgainst, None))
 		
@@ -287,11 +312,11 @@ class PostProcessorTestCase(unittest.TestCase):
         postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, False))
 
         # Act
-        postPrc.SavePostToFile(postData, '1234.xml')
+        postPrc.SavePostToFile(postPrc.DecodePostData(postData), '1234.xml')
 
         # Assert
         file_handle = mock_open.return_value.__enter__.return_value
-        file_handle.write.assert_called_with(common.PrettyPrintXml(postPrc.FlatPostDataToXmlObject(postData), None))
+        file_handle.write.assert_called_with(common.PrettyPrintXml(postPrc.FlatPostDataToXmlObject(postPrc.DecodePostData(postData)), None))
 		
     @mock.patch('postprocessor.common.ReadXmlFileOrDefault', autospec=True)
     @mock.patch('postprocessor.common.CreatePathIfNotExists', autospec=True)
@@ -306,12 +331,27 @@ class PostProcessorTestCase(unittest.TestCase):
         postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, False))
 
         # Act
-        postPrc.SavePostToFile(postData, '1234.xml')
+        postPrc.SavePostToFile(postPrc.DecodePostData(postData), '1234.xml')
 
         # Assert
         file_handle = mock_open.return_value.__enter__.return_value
-        file_handle.write.assert_called_with(common.PrettyPrintXml(postPrc.FlatPostDataToXmlObject(postData), None))
+        file_handle.write.assert_called_with(common.PrettyPrintXml(postPrc.FlatPostDataToXmlObject(postPrc.DecodePostData(postData)), None))
 		
+    @mock.patch('postprocessor.logging.getLogger', autospec=True)
+    def test_SavePostToFile_PostDataCannotBeConverted(self, mock_logging):
+        # Arrange
+        postData = OrderedDict()
+        postData[u'events_1_anum'] = u'1'
+        postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, False))
+
+        # Act
+        with mock.patch.object(postPrc, 'FlatPostDataToXmlObject', side_effect = ValueError(u'Bad post data')):
+            with self.assertRaises(ValueError):
+                postPrc.SavePostToFile(postPrc.DecodePostData(postData), '1234.xml')
+
+        # Assert
+        self.assertEqual(postPrc.logger.debug.call_count, 1)
+
     @mock.patch('postprocessor.common.ReadXmlFileOrDefault', autospec=True)
     @mock.patch('postprocessor.common.CreatePathIfNotExists', autospec=True)
     @mock.patch('postprocessor.open', create=True)
@@ -326,11 +366,11 @@ class PostProcessorTestCase(unittest.TestCase):
         postPrc = postprocessor.PostProcessor('Foo', env)
 
         # Act
-        postPrc.SavePostToFile(postData, '1234.xml')
+        postPrc.SavePostToFile(postPrc.DecodePostData(postData), '1234.xml')
 
         # Assert
         file_handle = mock_open.return_value.__enter__.return_value
-        file_handle.write.assert_called_with(common.PrettyPrintXml(postPrc.FlatPostDataToXmlObject(postData), env['xsltFile']))
+        file_handle.write.assert_called_with(common.PrettyPrintXml(postPrc.FlatPostDataToXmlObject(postPrc.DecodePostData(postData)), env['xsltFile']))
 		
     @mock.patch('postprocessor.common.ReadXmlFileOrDefault', autospec=True)
     @mock.patch('postprocessor.common.CreatePathIfNotExists', autospec=True)
@@ -465,7 +505,7 @@ class PostProcessorTestCase(unittest.TestCase):
                                                                 '<image remote="http://a.bcd/img2.jpg" local="img2 (a.bcd).jpg">' +
                                                                     '<posts><post dbid="1"/></posts></image>' +
                                                             '</images>')]
-        syncItemsToCheckForDeletion = [{'id': 1}, {'id': 3}] # post with id = 2 was deleted on server
+        syncItemsToCheckForDeletion = [postprocessor.SyncItem(1, None), postprocessor.SyncItem(3, None)] # post with id = 2 was deleted on server
         env = self.__getEnvironment(False, False)
         postPrc = postprocessor.PostProcessor('Foo', env)
 
@@ -506,7 +546,7 @@ class PostProcessorTestCase(unittest.TestCase):
                                                                 '<image remote="http://a.bcd/img2.jpg" local="img2 (a.bcd).jpg">' +
                                                                     '<posts><post dbid="1"/></posts></image>' +
                                                             '</images>')]
-        syncItemsToCheckForDeletion = [{'id': 2}, {'id': 3}] # post with id = 1 was deleted on server
+        syncItemsToCheckForDeletion = [postprocessor.SyncItem(2, None), postprocessor.SyncItem(3, None)] # post with id = 1 was deleted on server
         env = self.__getEnvironment(False, False)
         postPrc = postprocessor.PostProcessor('Foo', env)
 
@@ -535,6 +575,34 @@ class PostProcessorTestCase(unittest.TestCase):
             self.assertEqual(args[5], True)
 			
 			
+    @mock.patch('postprocessor.logging.getLogger', autospec=True)
+    @mock.patch('imagescraper.time.sleep', autospec=True)
+    @mock.patch('postprocessor.common.ReadXmlFileOrDefault', autospec=True)
+    def test_RemoveDeletedPosts_DaemonModeImageCacheIsUpdatedBetweenRuns(self, mock_readxmlfileordefault, mock_sleep, mock_logging):
+        # Arrange
+        cachedFiles = {'cachedPostIdsFile.xml': '<posts><post dbid="1" publicid="12" /><post dbid="2" publicid="23" /></posts>',
+                       'cachedimagepaths.xml': '<images><image remote="http://a.bcd/img1.jpg" local="img1 (a.bcd).jpg"><posts><post dbid="1"/></posts></image></images>'}
+        mock_readxmlfileordefault.side_effect = lambda path, default: fromstring(cachedFiles[os.path.basename(path)]) if os.path.basename(path) in cachedFiles else Element(default)
+        env = self.__getEnvironment(False, True)
+        postPrc = postprocessor.PostProcessor('Foo', env) # the same processor is kept between runs in daemon mode
+        postPrc.imageScraperSettings['cnn'] = mock.Mock()
+        postPrc.imageScraperSettings['cnn'].DownloadImage.side_effect = lambda src, path, *args, **kwargs: os.path.join(path, 'img1 (a.bcd).jpg')
+
+        with mock.patch.object(postPrc, 'UpdateFilesMapping') as wrappedMethod:
+            # Act
+            postPrc.RemoveDeletedPosts([postprocessor.SyncItem(2, None)]) # first run: post with id = 1 was deleted on server together with its image
+            result = postPrc.ScrapeImages(u'<img src="http://a.bcd/img1.jpg">', postId = '2') # second run: the same image was added to another post
+
+            # Assert
+            self.assertEqual(postPrc.imageScraperSettings['cnn'].DownloadImage.call_count, 1)
+            self.assertIn(u'data-local-src="images/img1 (a.bcd).jpg"', result)
+            name, args, kwargs = wrappedMethod.mock_calls[-1]
+            self.assertEqual(tostring(args[1]), tostring(fromstring('<images>' +
+                                                                        '<image local="img1 (a.bcd).jpg" remote="http://a.bcd/img1.jpg">' +
+                                                                            '<posts><post dbid="2"/></posts></image>' +
+                                                                    '</images>')))
+            self.assertEqual(postPrc.imageScraperSettings['cachedImagesByPostId'].keys(), ['2'])
+
     @mock.patch('postprocessor.logging.getLogger', autospec=True)
     @mock.patch('postprocessor.common.ReadXmlFileOrDefault', autospec=True)
     def test_RemoveDeletedPosts_RemovePostWithoutImages(self, mock_readxmlfileordefault, mock_logging):
@@ -546,7 +614,7 @@ class PostProcessorTestCase(unittest.TestCase):
                                                                 '<image remote="http://a.bcd/img2.jpg" local="img2 (a.bcd).jpg">' +
                                                                     '<posts><post dbid="1"/></posts></image>' +
                                                             '</images>')]
-        syncItemsToCheckForDeletion = [{'id': 1}, {'id': 2}] # post with id = 3 was deleted on server
+        syncItemsToCheckForDeletion = [postprocessor.SyncItem(1, None), postprocessor.SyncItem(2, None)] # post with id = 3 was deleted on server
         env = self.__getEnvironment(False, False)
         postPrc = postprocessor.PostProcessor('Foo', env)
 
@@ -587,7 +655,7 @@ class PostProcessorTestCase(unittest.TestCase):
                                                                 '<image remote="http://a.bcd/img2.jpg" local="img2 (a.bcd).jpg">' +
                                                                     '<posts><post dbid="1"/></posts></image>' +
                                                             '</images>')]
-        syncItemsToCheckForDeletion = [{'id': 2}] # posts with id = 1 and 3 was deleted on server
+        syncItemsToCheckForDeletion = [postprocessor.SyncItem(2, None)] # posts with id = 1 and 3 was deleted on server
         env = self.__getEnvironment(False, False)
         postPrc = postprocessor.PostProcessor('Foo', env)
 
@@ -626,7 +694,7 @@ class PostProcessorTestCase(unittest.TestCase):
                                                                 '<image remote="http://a.bcd/img2.jpg" local="img2 (a.bcd).jpg">' +
                                                                     '<posts><post dbid="1"/></posts></image>' +
                                                             '</images>')]
-        syncItemsToCheckForDeletion = [{'id': 1}, {'id': 2}, {'id': 3}] # nothing was deleted
+        syncItemsToCheckForDeletion = [postprocessor.SyncItem(1, None), postprocessor.SyncItem(2, None), postprocessor.SyncItem(3, None)] # nothing was deleted
         env = self.__getEnvironment(False, False)
         postPrc = postprocessor.PostProcessor('Foo', env)
 
@@ -662,7 +730,7 @@ class PostProcessorTestCase(unittest.TestCase):
         # Arrange
         mock_readxmlfileordefault.side_effect = [fromstring('<NoCachedInfo/>'),
                                                  fromstring('<images/>')]
-        syncItemsToCheckForDeletion = [{'id': 1}, {'id': 2}, {'id': 3}] # new data
+        syncItemsToCheckForDeletion = [postprocessor.SyncItem(1, None), postprocessor.SyncItem(2, None), postprocessor.SyncItem(3, None)] # new data
         env = self.__getEnvironment(False, False)
         postPrc = postprocessor.PostProcessor('Foo', env)
 
@@ -710,8 +778,294 @@ class PostProcessorTestCase(unittest.TestCase):
         result = postPrc.GetSyncItems(datetime.datetime(2015, 1, 1, 0, 0, 0))
 
         # Assert
-        self.assertEqual([elem['id'] for elem in result], [23, 34, 12])
+        self.assertEqual([elem.id for elem in result], [23, 34, 12])
 		
+    @mock.patch('postprocessor.time', autospec=True)
+    @mock.patch('connection.Connection', autospec=True)
+    def test_GetSyncItems_SkipsNonPostItemsAndChopsFractions(self, mock_cnn, mock_time):
+        # Arrange
+        syncItems = OrderedDict()
+        syncItems['sync_1_item'] = 'C-12'
+        syncItems['sync_1_time'] = '2015-01-30 23:45:12'
+        syncItems['sync_2_item'] = 'L-23'
+        syncItems['sync_2_time'] = '2015-01-30 23:43:12.00000'
+        syncItems['sync_count'] = '2'
+        syncItems['sync_total'] = '2'
+        mock_cnn.return_value.MakeServerRequestWithAuthentication.return_value = syncItems
+        postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, False))
+
+        # Act
+        result = postPrc.GetSyncItems(datetime.datetime(2015, 1, 1, 0, 0, 0))
+
+        # Assert
+        self.assertEqual([(elem.id, elem.time) for elem in result], [(23, datetime.datetime(2015, 1, 30, 23, 43, 12))])
+        self.assertEqual(mock_cnn.return_value.MakeServerRequestWithAuthentication.call_count, 1)
+
+    @mock.patch('postprocessor.logging.getLogger', autospec=True)
+    @mock.patch('postprocessor.time', autospec=True)
+    def test_ProcessPosts_FailedPostDoesNotStopOthers(self, mock_time, mock_logging):
+        # Arrange
+        syncItems = [postprocessor.SyncItem(postId, datetime.datetime(2015, 1, postId, 0, 0, 0)) for postId in [1, 2, 3]]
+        postPrc = self.__getPostProcessorForProcessPosts(syncItems, set(), datetime.datetime(2014, 12, 31, 0, 0, 0))
+        postPrc.GetPost.side_effect = [{'events_1_itemid': '1', 'events_1_anum': '0'}, IOError(u'Network error'), {'events_1_itemid': '3', 'events_1_anum': '0'}]
+
+        # Act
+        postPrc.ProcessPosts()
+
+        # Assert
+        self.assertEqual(postPrc.GetPost.call_count, 3)
+        postPrc.SavePostIdsMap.assert_called_once_with({1: 256, 3: 768})
+        postPrc.SaveFailedPostIds.assert_called_once_with(set([2]))
+        postPrc.SaveLastSyncDate.assert_called_once_with(datetime.datetime(2015, 1, 3, 0, 0, 0))
+        self.assertEqual(postPrc.logger.error.call_count, 1)
+
+    @mock.patch('postprocessor.logging.getLogger', autospec=True)
+    @mock.patch('postprocessor.time', autospec=True)
+    def test_ProcessPosts_RetriesFailedPosts(self, mock_time, mock_logging):
+        # Arrange
+        syncItems = [postprocessor.SyncItem(postId, datetime.datetime(2015, 1, postId, 0, 0, 0)) for postId in [1, 2, 3]]
+        postPrc = self.__getPostProcessorForProcessPosts(syncItems, set([1, 5]), datetime.datetime(2015, 1, 2, 0, 0, 0))
+        postPrc.GetPost.side_effect = [{'events_1_itemid': '1', 'events_1_anum': '0'}, {'events_1_itemid': '3', 'events_1_anum': '0'}]
+
+        # Act
+        postPrc.ProcessPosts()
+
+        # Assert
+        self.assertEqual([call[0][0] for call in postPrc.GetPost.call_args_list], [1, 3])
+        postPrc.SaveFailedPostIds.assert_called_once_with(set())
+        postPrc.SaveLastSyncDate.assert_called_once_with(datetime.datetime(2015, 1, 3, 0, 0, 0))
+        self.assertEqual(postPrc.logger.error.call_count, 0)
+
+    @mock.patch('postprocessor.logging.getLogger', autospec=True)
+    @mock.patch('postprocessor.time', autospec=True)
+    def test_ProcessPosts_InterruptedRunIsResumedFromProgressLog(self, mock_time, mock_logging):
+        # Arrange
+        syncItems = [postprocessor.SyncItem(postId, datetime.datetime(2015, 1, postId, 0, 0, 0)) for postId in [1, 2, 3]]
+        postPrc = self.__getPostProcessorForProcessPosts(syncItems, set(), datetime.datetime(2014, 12, 31, 0, 0, 0))
+        postPrc.GetPost.side_effect = [{'events_1_itemid': '1', 'events_1_anum': '0'}, KeyboardInterrupt(),
+                                       {'events_1_itemid': '2', 'events_1_anum': '0'}, {'events_1_itemid': '3', 'events_1_anum': '0'}]
+        with self.assertRaises(KeyboardInterrupt):
+            postPrc.ProcessPosts() # killed while getting the second post
+
+        # Act
+        postPrc.ProcessPosts()
+
+        # Assert
+        self.assertEqual([args[0] for name, args, kwargs in postPrc.GetPost.mock_calls], [1, 2, 2, 3])
+        postPrc.SavePostIdsMap.assert_has_calls([mock.call({1: 256}), mock.call({2: 512, 3: 768})])
+        postPrc.SaveLastSyncDate.assert_has_calls([mock.call(datetime.datetime(2015, 1, 1, 0, 0, 0)), mock.call(datetime.datetime(2015, 1, 3, 0, 0, 0))])
+        self.assertFalse(os.path.exists(os.path.join(common.GetUpperLevelDir(), 'A', 'B', 'cacheddatafolder', postPrc.progressLogFileName)))
+
+    @mock.patch('postprocessor.common.GetUpperLevelDir', autospec=True)
+    @mock.patch('postprocessor.logging.getLogger', autospec=True)
+    def test_FoldProgressLog(self, mock_logging, mock_upperleveldir):
+        # Arrange
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir, True)
+        mock_upperleveldir.return_value = tempDir
+        postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, False))
+        postPrc.AppendToProgressLog(postprocessor.SyncItem(1, datetime.datetime(2015, 1, 1, 0, 0, 0)), 256, datetime.datetime(2015, 1, 1, 0, 0, 0))
+        postPrc.AppendToProgressLog(postprocessor.SyncItem(2, datetime.datetime(2015, 1, 2, 0, 0, 0)), None, datetime.datetime(2015, 1, 2, 0, 0, 0))
+        path = os.path.join(tempDir, 'A', 'B', 'cacheddatafolder', postPrc.progressLogFileName)
+        with open(path, 'a') as progressLogFile:
+            progressLogFile.write('3\t768\t2015-01-03') # run was killed in the middle of the line
+
+        # Act
+        with mock.patch.object(postPrc, 'SaveProgress') as wrappedMethod:
+            result = postPrc.FoldProgressLog()
+
+        # Assert
+        self.assertEqual(result, {1: datetime.datetime(2015, 1, 1, 0, 0, 0)})
+        wrappedMethod.assert_called_once_with({1: 256}, set([2]), datetime.datetime(2015, 1, 2, 0, 0, 0))
+
+    @mock.patch('postprocessor.common.IsDeadlineNear', autospec=True)
+    @mock.patch('postprocessor.logging.getLogger', autospec=True)
+    @mock.patch('postprocessor.time', autospec=True)
+    def test_ProcessPosts_StopsNearDeadline(self, mock_time, mock_logging, mock_deadline):
+        # Arrange
+        syncItems = [postprocessor.SyncItem(postId, datetime.datetime(2015, 1, 1, 0, 0, 0)) for postId in [1, 2]]
+        syncItems.append(postprocessor.SyncItem(3, datetime.datetime(2015, 1, 3, 0, 0, 0)))
+        postPrc = self.__getPostProcessorForProcessPosts(syncItems, set(), datetime.datetime(2014, 12, 31, 0, 0, 0))
+        postPrc.GetPost.side_effect = [{'events_1_itemid': '1', 'events_1_anum': '0'}]
+        mock_deadline.side_effect = [False, True]
+
+        # Act
+        postPrc.ProcessPosts()
+
+        # Assert
+        self.assertEqual(postPrc.GetPost.call_count, 1)
+        postPrc.SavePostIdsMap.assert_called_once_with({1: 256})
+        # post 2 has the same time as saved post 1, so sync date should stay before it
+        postPrc.SaveLastSyncDate.assert_called_once_with(datetime.datetime(2014, 12, 31, 23, 59, 59))
+
+    def test_GetSyncDateBefore(self):
+        # Arrange
+        syncItems = [postprocessor.SyncItem(1, datetime.datetime(2015, 1, 1, 0, 0, 0)), postprocessor.SyncItem(2, datetime.datetime(2015, 1, 2, 0, 0, 0))]
+        postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, False))
+
+        # Act
+        result = [postPrc.GetSyncDateBefore(syncItems, 1, datetime.datetime(2015, 1, 1, 0, 0, 0)),
+                  postPrc.GetSyncDateBefore(syncItems, 1, datetime.datetime(2015, 1, 2, 0, 0, 0)),
+                  postPrc.GetSyncDateBefore(syncItems, 2, datetime.datetime(2015, 1, 2, 0, 0, 0))]
+
+        # Assert
+        self.assertEqual(result, [datetime.datetime(2015, 1, 1, 0, 0, 0), datetime.datetime(2015, 1, 1, 23, 59, 59), datetime.datetime(2015, 1, 2, 0, 0, 0)])
+
+    @mock.patch('postprocessor.common.GetUpperLevelDir', autospec=True)
+    def test_SaveFailedPostIds(self, mock_upperleveldir):
+        # Arrange
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir, True)
+        mock_upperleveldir.return_value = tempDir
+        postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, False))
+
+        # Act
+        postPrc.SaveFailedPostIds(set([12, 3]))
+        savedIds = postPrc.ReadFailedPostIds()
+        postPrc.SaveFailedPostIds(set())
+        clearedIds = postPrc.ReadFailedPostIds()
+
+        # Assert
+        self.assertEqual(savedIds, set([3, 12]))
+        self.assertEqual(clearedIds, set())
+
+    def test_MergeSyncItems(self):
+        # Arrange
+        cachedSyncItems = [postprocessor.SyncItem(1, datetime.datetime(2015, 1, 1, 0, 0, 0)), postprocessor.SyncItem(2, datetime.datetime(2015, 1, 2, 0, 0, 0))]
+        newSyncItems = [postprocessor.SyncItem(1, datetime.datetime(2015, 1, 3, 0, 0, 0)), postprocessor.SyncItem(3, datetime.datetime(2015, 1, 4, 0, 0, 0))]
+        postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, False))
+
+        # Act
+        result = postPrc.MergeSyncItems(cachedSyncItems, newSyncItems)
+
+        # Assert
+        self.assertEqual([(elem.id, elem.time.day) for elem in result], [(2, 2), (1, 3), (3, 4)])
+
+    @mock.patch('connection.Connection', autospec=True)
+    def test_GetServerPostCount(self, mock_cnn):
+        # Arrange
+        mock_cnn.return_value.MakeServerRequestWithAuthentication.return_value = {'2015-01-30': '2', '2015-02-01': '5', 'xyz': '10'}
+        postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, False))
+
+        # Act
+        result = postPrc.GetServerPostCount()
+
+        # Assert
+        self.assertEqual(result, 7)
+        self.assertEqual(mock_cnn.return_value.MakeServerRequestWithAuthentication.call_args[0][1], 'getdaycounts')
+
+    @mock.patch('postprocessor.logging.getLogger', autospec=True)
+    @mock.patch('connection.Connection', autospec=True)
+    def test_GetServerPostCount_ServerError(self, mock_cnn, mock_logging):
+        # Arrange
+        mock_cnn.return_value.MakeServerRequestWithAuthentication.side_effect = RuntimeError(u'Unknown method')
+        postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, False))
+
+        # Act
+        result = postPrc.GetServerPostCount()
+
+        # Assert
+        self.assertEqual(result, None)
+
+    @mock.patch('postprocessor.logging.getLogger', autospec=True)
+    @mock.patch('connection.Connection', autospec=True)
+    def test_GetServerPostCount_NoResponse(self, mock_cnn, mock_logging):
+        # Arrange
+        mock_cnn.return_value.MakeServerRequestWithAuthentication.side_effect = IOError(u'Could not read response')
+        postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, False))
+
+        # Act
+        result = postPrc.GetServerPostCount()
+
+        # Assert
+        self.assertEqual(result, None)
+
+    @mock.patch('postprocessor.logging.getLogger', autospec=True)
+    @mock.patch('postprocessor.os.path.exists', autospec=True)
+    def test_IsFullSyncDue_NoIndex(self, mock_pathexists, mock_logging):
+        # Arrange
+        mock_pathexists.return_value = False
+        postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, False))
+
+        # Act
+        result = postPrc.IsFullSyncDue()
+
+        # Assert
+        self.assertTrue(result)
+
+    @mock.patch('postprocessor.os.path.exists', autospec=True)
+    def test_IsFullSyncDue_IntervalPassed(self, mock_pathexists):
+        # Arrange
+        mock_pathexists.return_value = True
+        postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, False))
+
+        # Act
+        with mock.patch.object(postPrc, 'GetLastFullSyncDate') as wrappedMethod:
+            wrappedMethod.return_value = datetime.datetime.now() - datetime.timedelta(days = 8)
+            result = postPrc.IsFullSyncDue()
+
+        # Assert
+        self.assertTrue(result)
+
+    @mock.patch('postprocessor.os.path.exists', autospec=True)
+    def test_IsFullSyncDue_IntervalNotPassed(self, mock_pathexists):
+        # Arrange
+        mock_pathexists.return_value = True
+        postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, False))
+
+        # Act
+        with mock.patch.object(postPrc, 'GetLastFullSyncDate') as wrappedMethod:
+            wrappedMethod.return_value = datetime.datetime.now() - datetime.timedelta(days = 1)
+            result = postPrc.IsFullSyncDue()
+
+        # Assert
+        self.assertFalse(result)
+
+    @mock.patch('postprocessor.os.path.exists', autospec=True)
+    @mock.patch('postprocessor.open', create=True)
+    def test_ReadSyncItemsIndex(self, mock_open, mock_pathexists):
+        # Arrange
+        mock_pathexists.return_value = True
+        mock_open.return_value = mock.MagicMock(spec=file)
+        mock_open.return_value.__enter__.return_value.__iter__.return_value = iter(['12\t2015-01-30 23:43:12\n', '\n', '34\t2015-01-30 23:44:12\n'])
+        postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, False))
+
+        # Act
+        result = postPrc.ReadSyncItemsIndex()
+
+        # Assert
+        self.assertEqual([(elem.id, elem.time) for elem in result], [(12, datetime.datetime(2015, 1, 30, 23, 43, 12)), (34, datetime.datetime(2015, 1, 30, 23, 44, 12))])
+
+    @mock.patch('postprocessor.logging.getLogger', autospec=True)
+    @mock.patch('postprocessor.os.path.exists', autospec=True)
+    @mock.patch('postprocessor.open', create=True)
+    def test_ReadSyncItemsIndex_DamagedFile(self, mock_open, mock_pathexists, mock_logging):
+        # Arrange
+        mock_pathexists.return_value = True
+        mock_open.return_value = mock.MagicMock(spec=file)
+        mock_open.return_value.__enter__.return_value.__iter__.return_value = iter(['12\t2015-01-30 23:43:12\n', '34\t2015-01-'])
+        postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, False))
+
+        # Act
+        result = postPrc.ReadSyncItemsIndex()
+
+        # Assert
+        self.assertEqual(result, [])
+        self.assertEqual(postPrc.logger.warning.call_count, 1)
+
+    @mock.patch('postprocessor.common.WriteFileAtomically', autospec=True)
+    def test_SaveSyncItemsIndex(self, mock_writefileatomically):
+        # Arrange
+        env = self.__getEnvironment(False, False)
+        postPrc = postprocessor.PostProcessor('Foo', env)
+
+        # Act
+        postPrc.SaveSyncItemsIndex([postprocessor.SyncItem(12, datetime.datetime(2015, 1, 30, 23, 43, 12)), postprocessor.SyncItem(34, datetime.datetime(2015, 1, 30, 23, 44, 12))])
+
+        # Assert
+        path = os.path.join(common.GetUpperLevelDir(), env['sectionName'], env['journal'], env['cachedDataFolder'], postPrc.syncItemsIndexFileName)
+        mock_writefileatomically.assert_called_once_with(path, '12\t2015-01-30 23:43:12\n34\t2015-01-30 23:44:12\n')
+
     @mock.patch('postprocessor.logging.getLogger', autospec=True)
     @mock.patch('postprocessor.common.ReadXmlFileOrDefault', autospec=True)
     @mock.patch('postprocessor.ImageScraper.ScrapeImages') # can't use autospec=True on @classmethod because of a bug: http://bugs.python.org/issue23078
@@ -721,7 +1075,8 @@ class PostProcessorTestCase(unittest.TestCase):
         mock_imagescraper.return_value = {
             'updatedMarkup': '<img src="http://a.bcd/img1.jpg" data-local-src="images/img1 (a.bcd).jpg">',
             'downloadedImageInfos': [{'remote': 'http://a.bcd/img1.jpg', 'local': 'img1 (a.bcd).jpg'}],
-            'existingImageInfos': []
+            'existingImageInfos': [],
+            'failedImageRemotes': []
             }
         env = self.__getEnvironment(False, True)
         postPrc = postprocessor.PostProcessor('Foo', env)
@@ -752,7 +1107,8 @@ class PostProcessorTestCase(unittest.TestCase):
         mock_imagescraper.return_value = {
             'updatedMarkup': '<img src="http://a.bcd/img1.jpg" data-local-src="images/img1 (a.bcd).jpg">',
             'downloadedImageInfos': [{'remote': 'http://a.bcd/img1.jpg', 'local': 'img1 (a.bcd).jpg'}],
-            'existingImageInfos': []
+            'existingImageInfos': [],
+            'failedImageRemotes': []
             }
         postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, True))
 
@@ -762,6 +1118,78 @@ class PostProcessorTestCase(unittest.TestCase):
 
         # Assert
         self.assertEqual(u'%s' % str(assertEx.exception), u'Parameter postId not present in arguments list')
+
+    @mock.patch('postprocessor.logging.getLogger', autospec=True)
+    @mock.patch('postprocessor.common.ReadXmlFileOrDefault', autospec=True)
+    @mock.patch('postprocessor.ImageScraper.ScrapeImages') # can't use autospec=True on @classmethod because of a bug: http://bugs.python.org/issue23078
+    def test_ScrapeImages_MarkupDidNotChange(self, mock_imagescraper, mock_readxmlfileordefault, mock_logging):
+        # Arrange
+        mock_readxmlfileordefault.return_value = fromstring('<images>' +
+                                                                '<image remote="http://a.bcd/img1.jpg" local="img1 (a.bcd).jpg">' +
+                                                                    '<posts><post dbid="123"/></posts></image>' +
+                                                            '</images>')
+        postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, True))
+        scrapedMarkup = '<img src="http://a.bcd/img1.jpg" data-local-src="images/img1 (a.bcd).jpg">'
+        postPrc.markupDigests = {'123': postprocessor.MarkupDigest(postPrc.GetMarkupDigest('<img src="http://a.bcd/img1.jpg">\r\n'),
+                                                                   postPrc.GetMarkupDigest(scrapedMarkup), ['http://a.bcd/img1.jpg'])}
+        previousPostXml = Element('post')
+        previousPostXml.append(Element('event'))
+        previousPostXml[0].text = scrapedMarkup
+
+        # Act
+        result = postPrc.ScrapeImages('<img src="http://a.bcd/img1.jpg">\n', postId = '123', previousPostXml = previousPostXml)
+
+        # Assert
+        self.assertEqual(result, scrapedMarkup)
+        self.assertEqual(mock_imagescraper.call_count, 0)
+        self.assertEqual(postPrc.metrics.counters['imageScrapingSkipped'], 1)
+
+    @mock.patch('postprocessor.logging.getLogger', autospec=True)
+    @mock.patch('postprocessor.common.ReadXmlFileOrDefault', autospec=True)
+    @mock.patch('postprocessor.ImageScraper.ScrapeImages') # can't use autospec=True on @classmethod because of a bug: http://bugs.python.org/issue23078
+    def test_ScrapeImages_MarkupDidNotChangeButImageIsNotCached(self, mock_imagescraper, mock_readxmlfileordefault, mock_logging):
+        # Arrange
+        mock_readxmlfileordefault.return_value = fromstring('<images/>')
+        mock_imagescraper.return_value = {
+            'updatedMarkup': '<img src="http://a.bcd/img1.jpg" data-local-src="images/img1 (a.bcd).jpg">',
+            'downloadedImageInfos': [],
+            'existingImageInfos': [],
+            'failedImageRemotes': ['http://a.bcd/img1.jpg']
+            }
+        postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, True))
+        markup = '<img src="http://a.bcd/img1.jpg">'
+        postPrc.markupDigests = {'123': postprocessor.MarkupDigest(postPrc.GetMarkupDigest(markup),
+                                                                   postPrc.GetMarkupDigest(mock_imagescraper.return_value['updatedMarkup']), ['http://a.bcd/img1.jpg'])}
+        previousPostXml = Element('post')
+        previousPostXml.append(Element('event'))
+        previousPostXml[0].text = mock_imagescraper.return_value['updatedMarkup']
+
+        # Act
+        with mock.patch.object(postPrc, 'UpdateFilesMapping'):
+            result = postPrc.ScrapeImages(markup, postId = '123', previousPostXml = previousPostXml)
+
+        # Assert
+        self.assertEqual(mock_imagescraper.call_count, 1)
+        self.assertFalse('123' in postPrc.markupDigests) # image failed to download, so post is scraped again next time
+        self.assertTrue(postPrc.markupDigestsChanged)
+
+    @mock.patch('postprocessor.logging.getLogger', autospec=True)
+    @mock.patch('postprocessor.common.WriteFileAtomically', autospec=True)
+    def test_SaveMarkupDigests(self, mock_writefileatomically, mock_logging):
+        # Arrange
+        env = self.__getEnvironment(False, True)
+        postPrc = postprocessor.PostProcessor('Foo', env)
+        postPrc.syncItems = [postprocessor.SyncItem(12, datetime.datetime(2015, 1, 30, 23, 43, 12))]
+        postPrc.markupDigests = {'12': postprocessor.MarkupDigest('a', 'b', ['http://a.bcd/img1.jpg']), '34': postprocessor.MarkupDigest('c', 'd', [])}
+        postPrc.markupDigestsChanged = True
+
+        # Act
+        postPrc.SaveMarkupDigests()
+
+        # Assert
+        path = os.path.join(common.GetUpperLevelDir(), env['sectionName'], env['journal'], env['cachedDataFolder'], postPrc.markupDigestsFileName)
+        mock_writefileatomically.assert_called_once_with(path, '<posts><post dbid="12" markup="a" scrapedmarkup="b"><image remote="http://a.bcd/img1.jpg" /></post></posts>')
+        self.assertFalse(postPrc.markupDigestsChanged)
 		
     @mock.patch('postprocessor.logging.getLogger', autospec=True)
     @mock.patch('postprocessor.common.ReadXmlFileOrDefault', autospec=True)
@@ -775,7 +1203,8 @@ class PostProcessorTestCase(unittest.TestCase):
         mock_imagescraper.return_value = {
             'updatedMarkup': '<img src="http://a.bcd/img1.jpg" data-local-src="images/img1 (a.bcd).jpg">',
             'downloadedImageInfos': [],
-            'existingImageInfos': [{'remote': 'http://a.bcd/img1.jpg', 'local': 'img1 (a.bcd).jpg'}]
+            'existingImageInfos': [{'remote': 'http://a.bcd/img1.jpg', 'local': 'img1 (a.bcd).jpg'}],
+            'failedImageRemotes': []
             }
         env = self.__getEnvironment(False, True)
         postPrc = postprocessor.PostProcessor('Foo', env)
@@ -809,7 +1238,8 @@ class PostProcessorTestCase(unittest.TestCase):
         mock_imagescraper.return_value = {
             'updatedMarkup': '<a href="http://a.bcd/img1_big.jpg"><img src="http://a.bcd/img1.jpg" data-local-src="images/img1 (a.bcd).jpg"></a>',
             'downloadedImageInfos': [],
-            'existingImageInfos': [{'remote': 'http://a.bcd/img1.jpg', 'local': 'img1 (a.bcd).jpg', 'linkedRemote': 'http://a.bcd/img1_big.jpg', 'linkedLocal': 'img1_big (linked) (a.bcd).jpg'}]
+            'existingImageInfos': [{'remote': 'http://a.bcd/img1.jpg', 'local': 'img1 (a.bcd).jpg', 'linkedRemote': 'http://a.bcd/img1_big.jpg', 'linkedLocal': 'img1_big (linked) (a.bcd).jpg'}],
+            'failedImageRemotes': []
             }
         env = self.__getEnvironment(False, True)
         postPrc = postprocessor.PostProcessor('Foo', env)
@@ -843,7 +1273,8 @@ class PostProcessorTestCase(unittest.TestCase):
         mock_imagescraper.return_value = {
             'updatedMarkup': '',
             'downloadedImageInfos': [],
-            'existingImageInfos': []
+            'existingImageInfos': [],
+            'failedImageRemotes': []
             }
         env = self.__getEnvironment(False, True)
         postPrc = postprocessor.PostProcessor('Foo', env)
@@ -874,7 +1305,8 @@ class PostProcessorTestCase(unittest.TestCase):
         mock_imagescraper.return_value = {
             'updatedMarkup': '',
             'downloadedImageInfos': [],
-            'existingImageInfos': []
+            'existingImageInfos': [],
+            'failedImageRemotes': []
             }
         env = self.__getEnvironment(False, True)
         postPrc = postprocessor.PostProcessor('Foo', env)
@@ -906,7 +1338,8 @@ class PostProcessorTestCase(unittest.TestCase):
         mock_imagescraper.return_value = {
             'updatedMarkup': '<img src="http://a.bcd/img1.jpg" data-local-src="images/img1 (a.bcd).jpg">',
             'downloadedImageInfos': [],
-            'existingImageInfos': [{'remote': 'http://a.bcd/img1.jpg', 'local': 'img1 (a.bcd).jpg'}]
+            'existingImageInfos': [{'remote': 'http://a.bcd/img1.jpg', 'local': 'img1 (a.bcd).jpg'}],
+            'failedImageRemotes': []
             }
         env = self.__getEnvironment(False, True)
         postPrc = postprocessor.PostProcessor('Foo', env)
@@ -940,7 +1373,8 @@ class PostProcessorTestCase(unittest.TestCase):
         mock_imagescraper.return_value = {
             'updatedMarkup': '',
             'downloadedImageInfos': [],
-            'existingImageInfos': []
+            'existingImageInfos': [],
+            'failedImageRemotes': []
             }
         env = self.__getEnvironment(False, True)
         postPrc = postprocessor.PostProcessor('Foo', env)
@@ -981,9 +1415,29 @@ class PostProcessorTestCase(unittest.TestCase):
                     'xsltFile': 'xsltFile.xml',
                     'dateFormatString': '%Y-%m-%d %H:%M:%S',
                     'eventPropertiesToExclude': ['test_event_prop'],
-                    'propPropertiesToExclude': ['test_prop_prop']
+                    'propPropertiesToExclude': ['test_prop_prop'],
+                    'fullSyncIntervalDays': 7
                 }
 				
+    def __getPostProcessorForProcessPosts(self, syncItems, failedPostIds, lastSyncDate):
+        tempDir = tempfile.mkdtemp() # progress log is written for real
+        self.addCleanup(shutil.rmtree, tempDir, True)
+        patcher = mock.patch('postprocessor.common.GetUpperLevelDir', return_value = tempDir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        postPrc = postprocessor.PostProcessor('Foo', self.__getEnvironment(False, False))
+        for methodName in ['GetSyncItems', 'SaveSyncItemsIndex', 'GetPost', 'SavePostToFile', 'RemoveDeletedPosts', 'SaveLastFullSyncDate',
+                           'SavePostIdsMap', 'SaveLastSyncDate', 'SaveFailedPostIds']:
+            patcher = mock.patch.object(postPrc, methodName)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for methodName, returnValue in [('GetLastSyncDate', lastSyncDate), ('IsFullSyncDue', True), ('ReadFailedPostIds', failedPostIds)]:
+            patcher = mock.patch.object(postPrc, methodName, return_value = returnValue)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        postPrc.GetSyncItems.return_value = syncItems
+        return postPrc
+
     def __unicodeToHtml(self, s):
         return s.encode('ascii', 'xmlcharrefreplace')
 
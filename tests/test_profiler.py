@@ -0,0 +1,104 @@
+import os
+import sys
+import unittest
+import mock
+import tempfile
+import shutil
+import pstats
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modules'))
+import profiler
+
+class ProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, ignore_errors = True)
+
+    def test_Init_ExceptionOnMode(self):
+        # Act
+        with self.assertRaises(ValueError) as assertEx:
+            profiler.JournalProfiler(self.tempDir, ['cpu', 'disk'])
+
+        # Assert
+        self.assertEqual(u'%s' % str(assertEx.exception), u'Invalid profiling mode disk, only cpu and memory are allowed')
+
+    @mock.patch('profiler.logging.getLogger', autospec=True)
+    def test_Profile_Cpu(self, mock_logging):
+        # Arrange
+        journalProfiler = profiler.JournalProfiler(self.tempDir, ['cpu'])
+
+        # Act
+        result = journalProfiler.Profile('A', 'B', lambda: sum(xrange(1000)))
+
+        # Assert
+        self.assertEqual(result, 499500)
+        fileNames = sorted(os.listdir(self.tempDir))
+        self.assertEqual(len(fileNames), 2)
+        self.assertTrue(fileNames[0].startswith('profile_A_B_') and fileNames[0].endswith('.pstats'))
+        self.assertEqual(fileNames[1], fileNames[0].replace('.pstats', '_cpu.txt'))
+        self.assertTrue(pstats.Stats(os.path.join(self.tempDir, fileNames[0])).total_calls > 0)
+
+    @mock.patch('profiler.logging.getLogger', autospec=True)
+    def test_Profile_SavesProfileOfFailedRun(self, mock_logging):
+        # Arrange
+        journalProfiler = profiler.JournalProfiler(self.tempDir, ['cpu'])
+
+        def Fail():
+            raise RuntimeError(u'Failed')
+
+        # Act
+        with self.assertRaises(RuntimeError):
+            journalProfiler.Profile('A', 'B', Fail)
+
+        # Assert
+        self.assertEqual(len(os.listdir(self.tempDir)), 2)
+
+    @mock.patch('profiler.logging.getLogger', autospec=True)
+    def test_Profile_RunIsNotInSample(self, mock_logging):
+        # Arrange
+        journalProfiler = profiler.JournalProfiler(self.tempDir, ['cpu'], 0.25)
+        journalProfiler.random = mock.Mock()
+        journalProfiler.random.random.return_value = 0.25
+        function = mock.Mock(return_value = 1)
+
+        # Act
+        result = journalProfiler.Profile('A', 'B', function)
+
+        # Assert
+        self.assertEqual(result, 1)
+        self.assertEqual(os.listdir(self.tempDir), [])
+
+    @mock.patch('profiler.logging.getLogger', autospec=True)
+    @mock.patch('profiler.tracemalloc')
+    def test_Profile_Memory(self, mock_tracemalloc, mock_logging):
+        # Arrange
+        mock_tracemalloc.take_snapshot.return_value.statistics.return_value = ['a.py:1: size=2 KiB, count=3', 'b.py:2: size=1 KiB, count=1']
+        journalProfiler = profiler.JournalProfiler(self.tempDir, ['memory'])
+
+        # Act
+        journalProfiler.Profile('A', 'B', lambda: None)
+
+        # Assert
+        fileNames = os.listdir(self.tempDir)
+        self.assertEqual(len(fileNames), 1)
+        with open(os.path.join(self.tempDir, fileNames[0]), 'r') as memoryFile:
+            self.assertEqual(memoryFile.read().splitlines()[1:], ['a.py:1: size=2 KiB, count=3', 'b.py:2: size=1 KiB, count=1'])
+        mock_tracemalloc.start.assert_called_once_with()
+        mock_tracemalloc.stop.assert_called_once_with()
+
+    @mock.patch('profiler.logging.getLogger', autospec=True)
+    @mock.patch('profiler.tracemalloc', None)
+    def test_Profile_MemoryWithoutTracemalloc(self, mock_logging):
+        # Act
+        journalProfiler = profiler.JournalProfiler(self.tempDir, ['memory'])
+        result = journalProfiler.Profile('A', 'B', lambda: 1)
+
+        # Assert
+        self.assertEqual(result, 1)
+        self.assertEqual(journalProfiler.logger.warning.call_count, 1)
+        self.assertEqual(os.listdir(self.tempDir), [])
+
+if __name__ == '__main__':
+    unittest.main()
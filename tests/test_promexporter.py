@@ -0,0 +1,34 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modules'))
+import promexporter
+
+class PromExporterTestCase(unittest.TestCase):
+    def test_FormatPrometheusText(self):
+        # Arrange
+        report = {'generatedAt': 2000, 'journals': [
+            {'sectionName': 'LiveJournal', 'journal': 'user1', 'startTime': 1000, 'durationSeconds': 12.5, 'succeeded': True, 'lastSuccessTime': 1012.5,
+             'counters': {'postsSaved': 3, 'bytesReceived': 2048L, 'requestErrors': 1, 'imageErrors': 2}, 'timings': {}},
+            {'sectionName': 'Dream"width', 'journal': 'user2', 'startTime': 1500, 'durationSeconds': None, 'succeeded': None, 'lastSuccessTime': None,
+             'counters': {}, 'timings': {}}]}
+
+        # Act
+        result = promexporter.FormatPrometheusText(report)
+
+        # Assert
+        lines = result.splitlines()
+        self.assertEqual(lines[:4], ['# HELP ljarch_journal_run_start_timestamp_seconds Time the last journal run started, seconds since epoch',
+                                     '# TYPE ljarch_journal_run_start_timestamp_seconds gauge',
+                                     'ljarch_journal_run_start_timestamp_seconds{section="LiveJournal",journal="user1"} 1000',
+                                     'ljarch_journal_run_start_timestamp_seconds{section="Dream\\"width",journal="user2"} 1500'])
+        self.assertTrue('ljarch_journal_run_duration_seconds{section="LiveJournal",journal="user1"} 12.5' in lines)
+        self.assertTrue('ljarch_journal_errors{section="LiveJournal",journal="user1"} 3' in lines)
+        self.assertTrue('ljarch_journal_bytes_received{section="LiveJournal",journal="user1"} 2048' in lines)
+        self.assertTrue('ljarch_journal_posts_saved{section="Dream\\"width",journal="user2"} 0' in lines)
+        self.assertEqual(len([line for line in lines if line.startswith('ljarch_journal_last_success_timestamp_seconds')]), 1)
+        self.assertTrue(result.endswith('\n'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import unittest
+import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modules'))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks import runbenchmarks
+
+class RunBenchmarksTestCase(unittest.TestCase):
+    def test_CompareWithBaseline(self):
+        # Arrange
+        baseline = {'hotPaths': {'ReadServerAnswer': {'opsPerSecond': 1000}, 'PrettyPrintXml': {'opsPerSecond': 100}},
+                    'pipeline': {'initialPosts': {'seconds': 10, 'peakRssKb': 1000}}, 'startup': {'importArchiver': {'seconds': 0.1}}}
+        results = {'hotPaths': {'ReadServerAnswer': {'opsPerSecond': 700}, 'PrettyPrintXml': {'opsPerSecond': 150}, 'New': {'opsPerSecond': 1}},
+                   'pipeline': {'initialPosts': {'seconds': 11, 'peakRssKb': None}}, 'startup': {'importArchiver': {'seconds': 0.2}}}
+
+        # Act
+        comparison, regressions = runbenchmarks.CompareWithBaseline(results, baseline, 0.25)
+
+        # Assert
+        self.assertEqual(sorted(comparison.keys()), ['hotPaths.PrettyPrintXml.opsPerSecond', 'hotPaths.ReadServerAnswer.opsPerSecond', 'pipeline.initialPosts.seconds',
+                                                     'startup.importArchiver.seconds'])
+        self.assertEqual(comparison['hotPaths.ReadServerAnswer.opsPerSecond']['change'], -0.3)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('hotPaths.ReadServerAnswer.opsPerSecond changed by -30%'))
+        self.assertTrue(regressions[1].startswith('startup.importArchiver.seconds changed by +100%'))
+
+    def test_MeasureOpsPerSecond(self):
+        # Arrange
+        calls = []
+
+        # Act
+        result = runbenchmarks.MeasureOpsPerSecond(calls.append, 0.01)
+
+        # Assert
+        self.assertEqual(calls, range(result['ops']))
+        self.assertTrue(result['opsPerSecond'] > 0)
+
+    @mock.patch('postprocessor.logging.getLogger', autospec=True)
+    def test_BenchmarkRunner_Run(self, mock_logging):
+        # Arrange
+        runner = runbenchmarks.BenchmarkRunner({'posts': 20, 'comments': 200}, minSeconds = 0.01)
+        currentDir = os.getcwdu()
+
+        # Act
+        result = runner.Run()
+
+        # Assert
+        self.assertEqual(result['pipeline'].keys(), ['generate', 'initialPosts', 'initialComments', 'incrementalPosts', 'incrementalComments'])
+        self.assertEqual(result['pipeline']['initialPosts']['requests'], 2 * (20 + 1)) # challenge and getevents for every post, challenge and syncitems
+        self.assertEqual(set(result['hotPaths'].keys()), set(['ReadServerAnswer', 'FlatPostDataToXmlObject', 'PrettyPrintXml', 'ImageScraper.scrape',
+                                                              'GetNewOrUpdatedComments', 'AddUpdateCommentsInPostXml']))
+        self.assertTrue(0 < result['startup']['importArchiver']['seconds'] < result['startup']['importArchiver']['processSeconds'])
+        self.assertEqual(os.getcwdu(), currentDir)
+        self.assertFalse(os.path.exists(runner.rootPath))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import sys
+import unittest
+import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modules'))
+import scheduler
+
+class JournalSchedulerTestCase(unittest.TestCase):
+    def test_RunDueJournals_KeepsProcessorsBetweenRuns(self):
+        # Arrange
+        processorsSeen = []
+        def processJournal(environment, processors):
+            processors.setdefault('posts', object())
+            processorsSeen.append((environment['journal'], processors['posts']))
+        journalScheduler = scheduler.JournalScheduler(self.__getConfigSections(), self.__getGlobalSettings(), processJournal)
+
+        # Act
+        journalScheduler.RunDueJournals(1000)
+        journalScheduler.RunDueJournals(1000 + 5 * 60)
+
+        # Assert
+        self.assertEqual(len(processorsSeen), 3)
+        self.assertEqual(processorsSeen[0][0], 'a')
+        self.assertEqual(processorsSeen[2], processorsSeen[0])
+
+    def test_RunDueJournals_RunsOnlyDueJournals(self):
+        # Arrange
+        processJournal = mock.Mock()
+        journalScheduler = scheduler.JournalScheduler(self.__getConfigSections(), self.__getGlobalSettings(), processJournal)
+        journalScheduler.RunDueJournals(1000)
+
+        # Act
+        result = journalScheduler.RunDueJournals(1000 + 4 * 60)
+
+        # Assert
+        self.assertEqual(result, 0)
+        self.assertEqual(journalScheduler.GetNextRunTime(), 1000 + 5 * 60)
+
+    @mock.patch('scheduler.logging.getLogger', autospec=True)
+    @mock.patch('scheduler.time', autospec=True)
+    def test_Run_ClosesProcessors(self, mock_time, mock_logging):
+        # Arrange
+        mock_time.time.return_value = 1000
+        commentProcessor = mock.Mock()
+        def processJournal(environment, processors):
+            processors['comments'] = commentProcessor
+        journalScheduler = scheduler.JournalScheduler(self.__getConfigSections()[:1], self.__getGlobalSettings(), processJournal)
+
+        # Act
+        journalScheduler.Run(2)
+
+        # Assert
+        self.assertEqual(mock_time.sleep.call_count, 1)
+        commentProcessor.Close.assert_called_once_with()
+
+    @mock.patch('scheduler.logging.getLogger', autospec=True)
+    @mock.patch('scheduler.time', autospec=True)
+    def test_Run_StopsAtDeadline(self, mock_time, mock_logging):
+        # Arrange
+        mock_time.time.return_value = 1000
+        processJournal = mock.Mock()
+        globalSettings = self.__getGlobalSettings()
+        globalSettings['deadline'] = 1000 + 60
+        journalScheduler = scheduler.JournalScheduler(self.__getConfigSections(), globalSettings, processJournal)
+
+        # Act
+        journalScheduler.Run()
+
+        # Assert
+        self.assertEqual(processJournal.call_count, 2)
+        self.assertEqual(mock_time.sleep.call_count, 0)
+
+    def __getConfigSections(self):
+        return [{'journal': 'a', 'sectionName': 'A', 'serverNetloc': 'a.bcd', 'maxConcurrentJournals': 1, 'syncIntervalMinutes': 5},
+                {'journal': 'b', 'sectionName': 'B', 'serverNetloc': 'b.cde', 'maxConcurrentJournals': 1, 'syncIntervalMinutes': 10}]
+
+    def __getGlobalSettings(self):
+        return {'delay': 1, 'dateFormatString': '%Y-%m-%d %H:%M:%S'}
+
+if __name__ == '__main__':
+    unittest.main()
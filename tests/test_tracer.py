@@ -0,0 +1,53 @@
+import os
+import sys
+import json
+import unittest
+import tempfile
+import shutil
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modules'))
+import tracer
+
+class TracerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, ignore_errors = True)
+
+    def test_Save(self):
+        # Arrange
+        runTracer = tracer.Tracer()
+        path = os.path.join(self.tempDir, 'traces', 'trace.json')
+
+        # Act
+        runTracer.AddSpan('sleep', 12.5, 3)
+        runTracer.AddSpan('request.interface/flat.getevents', 10.000001, 0.25, {'itemid': 5})
+        runTracer.Save(path)
+
+        # Assert
+        with open(path, 'r') as traceFile:
+            trace = json.load(traceFile)
+        events = trace['traceEvents']
+        self.assertEqual([(event['name'], event['cat'], event['ph'], event['ts'], event['dur']) for event in events],
+                         [('request.interface/flat.getevents', 'request', 'X', 10000001, 250000), ('sleep', 'sleep', 'X', 12500000, 3000000)])
+        self.assertEqual(events[0]['args'], {'itemid': 5})
+        self.assertFalse('args' in events[1])
+        self.assertEqual(events[0]['pid'], os.getpid())
+        self.assertEqual(events[0]['tid'], events[1]['tid'])
+        self.assertEqual(trace['otherData'], {'droppedSpanCount': 0})
+
+    def test_AddSpan_DropsSpansOverLimit(self):
+        # Arrange
+        runTracer = tracer.Tracer(2)
+
+        # Act
+        for i in xrange(5):
+            runTracer.AddSpan('sleep', i, 1)
+
+        # Assert
+        self.assertEqual([event['ts'] for event in runTracer.events], [0, 1000000])
+        self.assertEqual(runTracer.droppedSpanCount, 3)
+
+if __name__ == '__main__':
+    unittest.main()